@@ -0,0 +1,307 @@
+"""
+Micro-benchmarks for the functions every row of every ECO form and PN Reserve Log passes through.
+
+Inputs are generated from a fixed seed, with roughly the mix of revs seen in real logs: mostly single letters,
+some long alpha revs, redlines (numeric revs and lettered revs with a numeric suffix), dashes and, for the
+permissive alphabet, invalid chars.  Each benchmark reports the fastest of REPEAT timeit runs in ns per operation,
+plus allocations per operation.  The runs are taken round robin across the benchmarks, so a busy spell on the
+machine slows one run of each benchmark rather than every run of one, and isn't reported as a regression.
+Allocations are approximated from gc.get_count(), which counts only objects the garbage collector tracks (lists,
+dicts, class instances...), not strings or ints, so they're a guide to how much garbage an operation makes rather
+than an exact count.
+
+Rev.next_rev clears the alphabet's next-rev cache before each pass over its revs, so it times working out each
+distinct rev's successor once plus cached lookups for the repeats, as one run of cid.py does.  "Rev.next_rev
+cached" times only the lookups, as a long-running process (ex. cid.py -w) sees once every rev has been seen.
+
+usage: bench_cid.py [--save BASELINE] [--compare BASELINE] [--tolerance FRACTION] [--filter TEXT]
+
+--compare exits with status 1 if any operation got slower than its baseline by more than the tolerance, or
+allocates more per operation, so it can gate a build.  Baselines are machine-specific; don't commit them.
+"""
+
+import argparse
+import gc
+import json
+import random
+import sys
+import timeit
+
+from cid_classes import *
+import bdt_utils
+
+VERSION_STRING = "CID bench v1.0"
+
+SEED = 1729
+SAMPLE_SIZE = 2000
+REPEAT = 15
+RUN_TIME = 0.05
+
+DEFAULT_TOLERANCE = 0.25
+
+# an operation allocating this many more objects than its baseline is a regression, whatever its time
+ALLOCATION_SLACK = 0.5
+
+
+def random_rev(rng, alphabet=STRICT_REV_ALPHABET):
+    """
+    :return: a rev drawn from a realistic mix of rev formats, built from alphabet's chars
+    """
+    letters = [char for char in alphabet.chars if char.isalpha()]
+    roll = rng.random()
+
+    if roll < 0.05:
+        return "-"
+    if roll < 0.15:
+        return str(rng.randint(1, 9))
+    if roll < 0.30:
+        return rng.choice(letters) + str(rng.randint(1, 9))
+    if roll < 0.45:
+        return "".join(rng.choice(letters) for _ in range(rng.randint(2, 4)))
+
+    return rng.choice(letters)
+
+
+def random_part(rng):
+    return "{:03d}-{:06d}-{:02d}".format(rng.randint(0, 999), rng.randint(0, 999999), rng.randint(0, 99))
+
+
+def make_inputs(seed=SEED, sample_size=SAMPLE_SIZE):
+    """
+    :return: dict of the input lists the benchmarks share
+    """
+    rng = random.Random(seed)
+
+    strict_revs = [random_rev(rng) for _ in range(sample_size)]
+    permissive_revs = [random_rev(rng, PERMISSIVE_REV_ALPHABET) for _ in range(sample_size)]
+
+    # about one part number in ten is malformed, as found in hand-maintained logs
+    parts = [random_part(rng) for _ in range(sample_size)]
+    mixed_parts = [part if rng.random() > 0.1 else rng.choice(["123", "987-654-3210", "12-345678-90", None, 42])
+                   for part in parts]
+
+    rev_pairs = [(Rev(rng.choice(strict_revs)), Rev(rng.choice(strict_revs))) for _ in range(sample_size)]
+
+    log_entries = [(rng.choice(parts[:sample_size // 4]), rev) for rev in strict_revs]
+
+    table = [["CD1:139-000001-00-B", ""]]
+    for index in range(50):
+        pn = parts[index]
+        table.append(["  " * rng.randint(0, 3) + pn + " Rev. " + strict_revs[index], pn])
+
+    return {"strict_revs": strict_revs, "permissive_revs": permissive_revs, "parts": parts,
+            "mixed_parts": mixed_parts, "rev_pairs": rev_pairs, "log_entries": log_entries, "table": table}
+
+
+def make_benchmarks(inputs):
+    """
+    :return: a list of (name, operations per call, function) tuples
+    """
+    strict_revs = inputs["strict_revs"]
+    permissive_revs = inputs["permissive_revs"]
+    rev_pairs = inputs["rev_pairs"]
+    log_entries = inputs["log_entries"]
+
+    strict_rev_objects = [Rev(rev) for rev in strict_revs]
+
+    full_list = ListOfParts()
+    for pn, rev in log_entries:
+        full_list.add_part(pn, rev)
+
+    # half the lookups are for CIs the list holds, half for revs it doesn't
+    lookups = [(pn, rev) for pn, rev in log_entries[::2]] + \
+              [(pn, Rev(rev).next_rev.name) for pn, rev in log_entries[1::2]]
+
+    def rev_gt():
+        for first, second in rev_pairs:
+            first > second
+
+    def rev_init():
+        for rev in strict_revs:
+            Rev(rev)
+
+    def rev_next_rev():
+        # each distinct rev's successor is worked out once, then looked up in the alphabet's cache
+        STRICT_REV_ALPHABET.next_revs.clear()
+        for rev in strict_rev_objects:
+            rev.next_rev
+
+    def rev_next_rev_cached():
+        for rev in strict_rev_objects:
+            rev.next_rev
+
+    def valid_rev_strict():
+        for rev in permissive_revs:
+            is_valid_rev(rev)
+
+    def valid_rev_permissive():
+        for rev in permissive_revs:
+            is_valid_rev(rev, mode=2, alphabet=PERMISSIVE_REV_ALPHABET)
+
+    def valid_part():
+        for pn in inputs["mixed_parts"]:
+            is_valid_part(pn)
+
+    def list_add_part():
+        parts = ListOfParts()
+        for pn, rev in log_entries:
+            parts.add_part(pn, rev)
+
+    def list_has_part():
+        for pn, rev in lookups:
+            full_list.has_part(pn, rev)
+
+    def pretty_table():
+        bdt_utils.pretty_table(inputs["table"])
+
+    return [("Rev.__gt__", len(rev_pairs), rev_gt),
+            ("Rev()", len(strict_revs), rev_init),
+            ("Rev.next_rev", len(strict_rev_objects), rev_next_rev),
+            ("Rev.next_rev cached", len(strict_rev_objects), rev_next_rev_cached),
+            ("is_valid_rev", len(permissive_revs), valid_rev_strict),
+            ("is_valid_rev mode 2", len(permissive_revs), valid_rev_permissive),
+            ("is_valid_part", len(inputs["mixed_parts"]), valid_part),
+            ("ListOfParts.add_part", len(log_entries), list_add_part),
+            ("ListOfParts.has_part", len(lookups), list_has_part),
+            ("pretty_table", 1, pretty_table)]
+
+
+def allocations_per_op(function, operations):
+    """
+    :return: approximate number of GC-tracked objects function leaves allocated per operation, while it runs
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        function()
+        after = gc.get_count()[0]
+    finally:
+        gc.enable()
+
+    return max(after - before, 0) / float(operations)
+
+
+def run_benchmarks(name_filter=None, repeat=REPEAT, run_time=RUN_TIME):
+    """
+    :param name_filter: only run benchmarks whose name contains this text
+    :param repeat: timing runs per benchmark
+    :param run_time: seconds each timing run should take
+    :return: dict of {"ns_per_op": ..., "allocs_per_op": ...} dicts, keyed by benchmark name
+    """
+    benchmarks = [(name, operations, function) for name, operations, function in make_benchmarks(make_inputs())
+                  if not name_filter or name_filter in name]
+
+    # enough calls per timing run to take about run_time seconds
+    numbers = {}
+    for name, operations, function in benchmarks:
+        function()
+        numbers[name] = max(1, int(run_time / max(timeit.timeit(function, number=1), 1e-6)))
+
+    # The timing runs are taken round robin, one run of every benchmark per round, so a stretch of time when the
+    # machine is busy slows one run of each benchmark rather than every run of one.  Interference only ever adds
+    # time, so the fastest run is the best estimate.
+    timings = dict((name, []) for name, operations, function in benchmarks)
+    for _ in range(repeat):
+        for name, operations, function in benchmarks:
+            timings[name].append(timeit.timeit(function, number=numbers[name]))
+
+    results = {}
+    for name, operations, function in benchmarks:
+        results[name] = {"ns_per_op": min(timings[name]) / (numbers[name] * operations) * 1e9,
+                         "allocs_per_op": allocations_per_op(function, operations)}
+
+    return results
+
+
+def compare_results(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    :return: a list of (name, reason) tuples, one per operation that regressed against the baseline
+    """
+    regressions = []
+
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+
+        result, base = results[name], baseline[name]
+        if result["ns_per_op"] > base["ns_per_op"] * (1 + tolerance):
+            regressions.append((name, "{:.0f} ns/op, baseline {:.0f} ns/op (+{:.0%})".format(
+                result["ns_per_op"], base["ns_per_op"], result["ns_per_op"] / base["ns_per_op"] - 1)))
+        if result["allocs_per_op"] > base["allocs_per_op"] + ALLOCATION_SLACK:
+            regressions.append((name, "{:.2f} allocs/op, baseline {:.2f} allocs/op".format(
+                result["allocs_per_op"], base["allocs_per_op"])))
+
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print "{:<24}{:>12}{:>12}{:>12}".format("operation", "ns/op", "allocs/op", "vs. base")
+    for name in sorted(results):
+        change = ""
+        if baseline and name in baseline:
+            change = "{:+.0%}".format(results[name]["ns_per_op"] / baseline[name]["ns_per_op"] - 1)
+        print "{:<24}{:>12.0f}{:>12.2f}{:>12}".format(name, results[name]["ns_per_op"],
+                                                      results[name]["allocs_per_op"], change)
+
+
+def make_parser():
+    """
+    Construct a command-line parser for the script, using the build-in argparse library
+
+    :return: an argparse parser object
+    """
+    description = VERSION_STRING + " - Time the per-row functions of cid.py and pnr.py."
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('-v', '-V', '--version', action='version', version=VERSION_STRING)
+    parser.add_argument('--save', type=str, default=None, metavar="BASELINE",
+                        help="save the results to BASELINE, a JSON file")
+    parser.add_argument('--compare', type=str, default=None, metavar="BASELINE",
+                        help="compare the results to BASELINE, and exit with status 1 on any regression")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, metavar="FRACTION",
+                        help="slowdown allowed by --compare, as a fraction of the baseline (default "
+                             "{})".format(DEFAULT_TOLERANCE))
+    parser.add_argument('--filter', type=str, default=None, metavar="TEXT",
+                        help="only run benchmarks whose name contains TEXT")
+
+    return parser
+
+
+def main():
+    """
+    Command line execution starts here.
+    """
+    arguments = vars(make_parser().parse_args(sys.argv[1:]))
+
+    baseline = None
+    if arguments["compare"]:
+        try:
+            with open(arguments["compare"]) as f:
+                baseline = json.load(f)
+        except (IOError, ValueError) as e:
+            print "\nERROR: Could not read baseline {} ({}).".format(arguments["compare"], e)
+            sys.exit(1)
+
+    results = run_benchmarks(arguments["filter"])
+    print_results(results, baseline)
+
+    if arguments["save"]:
+        with open(arguments["save"], "w") as f:
+            json.dump(results, f, sort_keys=True, indent=1)
+        print "\nSaved baseline {}.".format(arguments["save"])
+
+    if baseline is not None:
+        regressions = compare_results(results, baseline, arguments["tolerance"])
+        if regressions:
+            print "\nERROR: {} regression(s) past the {:.0%} tolerance:".format(len(regressions),
+                                                                             arguments["tolerance"])
+            for name, reason in regressions:
+                print "  {}: {}".format(name, reason)
+            sys.exit(1)
+
+        print "\nNo regressions past the {:.0%} tolerance.".format(arguments["tolerance"])
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,16 @@ VERSION_STRING = "CID v1.27 03/02/2015"
 
 import argparse
 import sys
-import io
-import openpyxl  # third party open source library, https://openpyxl.readthedocs.org/en/latest/
 from cid_classes import *  # custom object defs & helper functions for this script
-import cid_classes  # re-import to allow alternate means of access to constants in this module
-import bdt_utils  # Benji's bag-o'-utility-functions
+import cid_cache
+import cid_output
+import cid_progress
+import cid_suggest
+import cid_export
+import cid_watch
 import pnr
+import pnr_backends
+import pnr_update
 
 # HAS_NO_MEDIA is a list of "media" tags used for P/Ns that are not put on any official media.  By default
 # they are skipped during CONTENTS_ID output. Media tags are converted to lowercase, with spaces converted
@@ -17,49 +21,101 @@ import pnr
 HAS_NO_MEDIA = ["scif", "hard_copy", "hardcopy", "synergy"]
 
 
-# column aliases
-AD_COL = 'A'
-CR_COL = 'B'
-NR_COL = 'C'
-ECO_COL = 'D'
-DES_COL = 'E'
-MT_COL = 'F'
-IN_COL = 'G'
-PN_SHEET_COLS = 'ABCDEFG'
+# CI_Sheet column layouts.  Form rev B1, and every form rev after B2, added a column before the ECO column.
+FORM_LAYOUT_ORIGINAL = FormLayout("original", ad_col='A', cr_col='B', nr_col='C', eco_col='D', des_col='E',
+                                  mt_col='F', iso_col='G')
+FORM_LAYOUT_WIDE = FormLayout("wide", ad_col='A', cr_col='B', nr_col='C', eco_col='E', des_col='F',
+                              mt_col='G', iso_col='H')
 
+# (test, layout) pairs, checked in order.  The first test that accepts the form's rev (a Rev object) picks the
+# layout.  New form revs get a layout via register_form_layout().
+FORM_LAYOUTS = [
+    (lambda form_rev: form_rev == Rev('B1') or form_rev > Rev('B2'), FORM_LAYOUT_WIDE),
+    (lambda form_rev: True, FORM_LAYOUT_ORIGINAL),
+]
 
-def form_rev_switches(cover_sheet):
 
-    global ECO_COL
-    global DES_COL
-    global MT_COL
-    global IN_COL
-    global PN_SHEET_COLS
+def register_form_layout(test, layout):
+    """
+    Add a CI_Sheet layout, checked before every layout already registered.
+
+    :param test: function taking the form rev (a Rev object) and returning True if layout applies to it
+    :param layout: a FormLayout object
+    """
+    FORM_LAYOUTS.insert(0, (test, layout))
+
+
+def select_rev_alphabet(arguments):
+    """
+    :param arguments: argparse command line arguments, formatted into a hash
+    :return: the RevAlphabet used to build revs: permissive if the -i/--invalid-revs argument is present,
+             otherwise strict
+    """
+    if arguments["invalid_revs"]:
+        return PERMISSIVE_REV_ALPHABET
+
+    return STRICT_REV_ALPHABET
+
+
+def detect_form_layout(cover_sheet, alphabet=STRICT_REV_ALPHABET):
+    """
+    Determine which CI_Sheet layout an ECO form uses, from the form rev in cover sheet cell A44.
 
+    :param cover_sheet: openpyxl sheet object for the ECO form's cover sheet
+    :param alphabet: RevAlphabet used to read the form rev
+    :return: a FormLayout object
+    """
     if not cover_sheet['A44'].value:
-        form_rev = Rev('B1')
+        form_rev = Rev('B1', alphabet=alphabet)
     else:
-        form_rev = Rev(cover_sheet['A44'].value)
+        form_rev = Rev(cover_sheet['A44'].value, alphabet=alphabet)
+
+    for test, layout in FORM_LAYOUTS:
+        if test(form_rev):
+            return layout
+
+
+def parse_row_range(text):
+    """
+    :param text: a range of CI_Sheet row numbers, ex. "120-180", "120-" for row 120 to the end of the sheet, or
+                 "120" for just row 120
+    :return: a tuple of the first and last row numbers (None for the end of the sheet), or None if text isn't a
+             range of row numbers
+    """
+    first, dash, last = text.strip().partition("-")
+    if not dash:
+        last = first
 
-    if form_rev == Rev('B1') or form_rev > Rev('B2'):
-        ECO_COL = 'E'
-        DES_COL = 'F'
-        MT_COL = 'G'
-        IN_COL = 'H'
-        PN_SHEET_COLS = 'ABCEFGH'
+    if not first.strip().isdigit() or not (last.strip().isdigit() or not last.strip()):
+        return None
 
+    first = int(first)
+    last = int(last) if last.strip() else None
+    if last is not None and last < first:
+        return None
 
-def split_sheet_rows_ps1(pn_sheet, pn_rows, media_to_skip, arguments):
+    return first, last
+
+
+def split_sheet_rows_ps1(pn_sheet, pn_rows, media_to_skip, arguments, diagnostics=None, layout=FORM_LAYOUT_ORIGINAL,
+                         progress=None):
     """
     Store rows from CI_Sheet tab of spreadsheet into a dictionary of lists of row objects, keyed by media type.
 
+    If --media or --rows selected part of the sheet, rows are only read up to the end of the selection.  The rows
+    before it are still stored, since the rows selected depend on what they list, but aren't counted as CIs.
+
     :param pn_sheet: openpyxl sheet object
     :param pn_rows: openpxyl rows object
     :param media_to_skip: controls which keywords in the media column mark PN blocks to skip
     :param arguments: argparse command line arguments, formatted into a hash
+    :param diagnostics: a DiagnosticLog that receives any errors found
+    :param layout: the FormLayout of the ECO form the sheet belongs to
+    :param progress: a cid_progress.Progress that receives rows processed, if any
     :return: a tuple of values, including...
              - dict with lists of row objects, keyed by media type
              - a list of the keys in the returned dict, to preserve the order they're accessed in
+             - a set of the numbers of the rows selected by --media and --rows, or None if every row is
     """
 
     row_num = 0
@@ -72,37 +128,63 @@ def split_sheet_rows_ps1(pn_sheet, pn_rows, media_to_skip, arguments):
     media_set_order = []
     skip_media_set_appended = False
 
+    # --media names, normalized like media types, that haven't been found yet; and whether the current media
+    # block is one of those --media named
+    media_wanted = set(name.strip().replace(" ", "_").lower() for name in arguments["media"] or [])
+    media_not_found = set(media_wanted)
+    media_selected = not media_wanted
+    first_row, last_row = arguments["rows"] or (None, None)
+    selected_rows = set() if media_wanted or arguments["rows"] else None
+
+    if diagnostics is None:
+        diagnostics = DiagnosticLog()
+    if progress is not None:
+        progress.start("Reading CI_Sheet", total_rows=pn_sheet.max_row)
 
     # split PN rows into per-media-type lists
     for row in pn_rows:
         row_num += 1
+        if progress is not None and not row_num % progress.check_every:
+            progress.update(row_num)
+
+        # the rest of the sheet is past the selection
+        if last_row is not None and row_num > last_row:
+            break
 
         # skip header section
         if row_num > 4:
-            if row_num == 5 and not pn_sheet[MT_COL + '5'].value:
-                print "\nERROR: CI_Sheet cell {}5 - First P/N must have a value in media column.".format(MT_COL)
+            values = layout.row_values(row)
+
+            if row_num == 5 and not values[layout.mt]:
+                diagnostics.error("no-media", "\nERROR: CI_Sheet cell {}5 - First P/N must have a value in "
+                                              "media column.".format(layout.mt_col), row=5, cell=layout.mt_col + "5")
                 sys.exit(1)
-            current_media_col = pn_sheet[MT_COL + str(row_num)].value
+            current_media_col = values[layout.mt]
 
             # if this row contains a note, we ignore it completely
             if str(current_media_col).strip().lower() in ("note", "notes"):
                 continue
 
-            if pn_sheet[AD_COL + str(row_num)].value:
-                part_number_count += 1
-
             # is this a new media set?
             if current_media_col:
+                # every media block --media named has been read
+                if media_wanted and not media_not_found:
+                    break
+
                 current_media_type = str(current_media_col).strip().replace(" ", "_").lower()
-                curr_rev = pn_sheet[CR_COL + str(row_num)].value
-                new_rev = pn_sheet[NR_COL + str(row_num)].value
+                curr_rev = values[layout.cr]
+                new_rev = values[layout.nr]
 
                 if new_rev:
-                    current_media = "{}-{}".format(str(pn_sheet[AD_COL + str(row_num)].value).strip(),
-                                                   str(pn_sheet[NR_COL + str(row_num)].value).strip())
+                    current_media = "{}-{}".format(str(values[layout.ad]).strip(), str(new_rev).strip())
                 elif curr_rev:
-                    current_media = "{}-{}".format(str(pn_sheet[AD_COL + str(row_num)].value.strip()),
-                                                   str(pn_sheet[CR_COL + str(row_num)].value))
+                    current_media = "{}-{}".format(str(values[layout.ad].strip()), str(curr_rev))
+
+                # a block is selected by its media type (ex. "CD1") or by its media set (ex. "139-000001-00-B")
+                if media_wanted:
+                    media_names = set([current_media_type, current_media.lower()])
+                    media_selected = bool(media_names & media_wanted)
+                    media_not_found -= media_names
 
                 # if this is a media type we want a CONTENTS_ID for, crate an empty list for it in the media_sets dict
                 if not current_media_type in media_to_skip:
@@ -113,9 +195,18 @@ def split_sheet_rows_ps1(pn_sheet, pn_rows, media_to_skip, arguments):
                         media_set_order.append("skipped")
                         skip_media_set_appended = True
 
+            # an unselected row is stored for the state it leaves behind, but isn't counted
+            row_selected = media_selected and (first_row is None or row_num >= first_row)
+            if row_selected and selected_rows is not None:
+                selected_rows.add(row_num)
+
+            if values[layout.ad] and row_selected:
+                part_number_count += 1
+
             # if -n/--new-pn-only is set, we need to verify the part is new before adding this row.
-            if pn_sheet[NR_COL + str(row_num)].value and not pn_sheet[ECO_COL + str(row_num)].value and current_media:
-                new_part_number_count += 1
+            if values[layout.nr] and not values[layout.eco] and current_media:
+                if row_selected:
+                    new_part_number_count += 1
                 if arguments["new_pn_only"]:
                     media_sets[current_media].append(row)
                     # return to the top of the for loop
@@ -127,18 +218,49 @@ def split_sheet_rows_ps1(pn_sheet, pn_rows, media_to_skip, arguments):
             else:
                 media_sets["skipped"].append(row)
 
-    print "\n{} total configuration items. {} CIs " \
-          "were changed.\n".format(part_number_count, new_part_number_count)
+    if progress is not None:
+        progress.finish(row_num)
+
+    if media_not_found and (last_row is None or row_num <= last_row):
+        diagnostics.error("media-not-found",
+                          "\nERROR: No media block on CI_Sheet matches --media {}.".format(
+                              ", ".join(sorted(media_not_found))),
+                          args={"media": sorted(media_not_found)})
+        sys.exit(1)
+    if selected_rows is not None and not selected_rows:
+        diagnostics.error("empty-selection", "\nERROR: --media and --rows don't select any CI_Sheet rows.")
+        sys.exit(1)
+
+    if selected_rows is None:
+        diagnostics.info("ci-count", "\n{} total configuration items. {} CIs "
+                                     "were changed.\n".format(part_number_count, new_part_number_count),
+                         args={"total": part_number_count, "changed": new_part_number_count})
+    else:
+        diagnostics.info("ci-count", "\n{} configuration items selected. {} CIs "
+                                     "were changed.\n".format(part_number_count, new_part_number_count),
+                         args={"total": part_number_count, "changed": new_part_number_count,
+                               "selected": True})
 
-    return media_sets, media_set_order
+    return media_sets, media_set_order, selected_rows
 
 
-def extract_ps1_tab_part_nums(arguments, pnr_list=None, pnr_warnings=[], pnr_dupe_pn_list=[]):
+def extract_ps1_tab_part_nums(arguments, pnr_list=None, pnr_warnings=[], pnr_dupe_pn_list=[], diagnostics=None,
+                              ci_records=None, row_cache=None, progress=None, cid_texts=None):
     """
     Open ECO spreadsheet, extract part numbers from the PS1 tab
 
     :param arguments: argparse command line arguments, formatted into a hash
-    :param pnr_list: the contents of the part number reserve log, contained in a ListOfParts object
+    :param pnr_list: the contents of the part number reserve log, in a parts object from pnr_backends
+    :param diagnostics: a DiagnosticLog that receives every error, warning and info message
+    :param ci_records: a list that receives one dict per CI listed on the ECO (P/N, rev and the cell it's in,
+                       cur rev of a new CI, description, indent, media set, row, status and ECO), for structured
+                       export
+    :param row_cache: a RowValidationCache holding results from earlier passes over this (or an earlier version
+                      of this) ECO form.  Rows whose values and cross-row dependencies are unchanged are replayed
+                      from it instead of being validated again.
+    :param progress: a cid_progress.Progress that receives bytes read and rows processed, if any
+    :param cid_texts: a dict that receives each media set's table formatted by bdt_utils.pretty_table(), keyed by
+                      media set
     :return: a tuple of values, including...
              - a dict where each value is a table represented by a list of lists, keyed by media type
              - a list of the keys in the returned dict, to preserve the order they're accessed in
@@ -146,6 +268,16 @@ def extract_ps1_tab_part_nums(arguments, pnr_list=None, pnr_warnings=[], pnr_dup
     """
 
     invalid_revs_ok = arguments["invalid_revs"]
+    rev_alphabet = select_rev_alphabet(arguments)
+
+    if diagnostics is None:
+        diagnostics = DiagnosticLog()
+    if ci_records is None:
+        ci_records = []
+    if row_cache is None:
+        row_cache = RowValidationCache()
+    if cid_texts is None:
+        cid_texts = {}
 
     # -n automatically prints all parts
     if arguments["all_parts"] or arguments["new_pn_only"]:
@@ -153,17 +285,29 @@ def extract_ps1_tab_part_nums(arguments, pnr_list=None, pnr_warnings=[], pnr_dup
     else:
         media_to_skip = HAS_NO_MEDIA
 
-    # pnr_verify will be True if a ListOfParts with the contents of the PN Reserve Log is passed in
-    pnr_verify = isinstance(pnr_list, ListOfParts)
+    # pnr_verify will be True if the contents of the PN Reserve Log (a parts object from pnr_backends) are passed in
+    pnr_verify = pnr_list is not None
+
+    # openpyxl is imported here rather than at the top of the module, so runs answered from the output cache
+    # never pay the (considerable) cost of loading it.
+    import openpyxl  # third party open source library, https://openpyxl.readthedocs.org/en/latest/
+
+    eco_file = arguments["eco_file"]
+    if progress is not None:
+        eco_file = progress.open_workbook(arguments["eco_file"])
 
     try:
         # openpyxl is a library for reading/writing Excel files.
-        eco_form = openpyxl.load_workbook(arguments["eco_file"])
+        eco_form = openpyxl.load_workbook(eco_file)
 
     except openpyxl.exceptions.InvalidFileException:
-        print '\nERROR: Could not open ECO form at path:\n' \
-              '       {}\n\n       Is path correct?'.format(arguments["eco_file"])
+        diagnostics.error("eco-open", '\nERROR: Could not open ECO form at path:\n'
+                                      '       {}\n\n       Is path correct?'.format(arguments["eco_file"]))
         sys.exit(1)
+    finally:
+        if eco_file is not arguments["eco_file"]:
+            eco_file.close()
+            progress.finish()
 
     # ECO form workbook must have a sheet named "CoverSheet"
     cover_sheet = eco_form.get_sheet_by_name('CoverSheet')
@@ -179,12 +323,13 @@ def extract_ps1_tab_part_nums(arguments, pnr_list=None, pnr_warnings=[], pnr_dup
             cover_rows = cover_sheet.rows
 
         except AttributeError:
-            print '\nERROR: No "CoverSheet" or "NewCoverSheet" tab in ECO form at path:\n' \
-                  '       {}'.format(arguments["eco_file"])
+            diagnostics.error("eco-no-cover-sheet",
+                              '\nERROR: No "CoverSheet" or "NewCoverSheet" tab in ECO form at path:\n'
+                              '       {}'.format(arguments["eco_file"]))
             sys.exit(1)
 
-    # Determine version of form being used, adjust constants, etc. accordingly
-    form_rev_switches(cover_sheet)
+    # Determine version of form being used, and so where each CI_Sheet column is
+    layout = detect_form_layout(cover_sheet, rev_alphabet)
 
     # ECO form workbook must have a sheet called "CI_Sheet"
     pn_sheet = eco_form.get_sheet_by_name('CI_Sheet')
@@ -199,12 +344,31 @@ def extract_ps1_tab_part_nums(arguments, pnr_list=None, pnr_warnings=[], pnr_dup
             pn_rows = pn_sheet.rows
 
         except AttributeError:
-            print '\nERROR: No "CI_Sheet" or "PS1" tab in ECO form at path:\n' \
-                  '       {}'.format(arguments["eco_file"])
+            diagnostics.error("eco-no-ci-sheet",
+                              '\nERROR: No "CI_Sheet" or "PS1" tab in ECO form at path:\n'
+                              '       {}'.format(arguments["eco_file"]))
             sys.exit(1)
 
+    # with --media or --rows, rows are made as they're read, so none are made past the end of the selection
+    if arguments["media"] or arguments["rows"]:
+        pn_rows = pn_sheet.iter_rows()
+
     # convert pn_sheet.rows into a dict of row object lists, keyed by media keyword
-    media_sets, media_set_order = split_sheet_rows_ps1(pn_sheet, pn_rows, media_to_skip, arguments)
+    media_sets, media_set_order, selected_rows = split_sheet_rows_ps1(pn_sheet, pn_rows, media_to_skip, arguments,
+                                                                      diagnostics, layout, progress)
+
+    # every P/N+rev the rows can look up in the PNR Log is fetched up front, so a remote log answers the whole
+    # ECO in a few batched requests rather than one request per row
+    if pnr_verify:
+        form_cis = set()
+        for set_name in media_set_order:
+            for row in media_sets[set_name]:
+                values = layout.row_values(row)
+                if values[layout.ad] and (selected_rows is None or row[0].row in selected_rows):
+                    for rev in (values[layout.cr], values[layout.nr]):
+                        if rev:
+                            form_cis.add((str(values[layout.ad]).strip(), str(rev).strip()))
+        pnr_list.prefetch(form_cis)
 
     cid_tables = {}
     cid_table_order = []
@@ -217,213 +381,362 @@ def extract_ps1_tab_part_nums(arguments, pnr_list=None, pnr_warnings=[], pnr_dup
     missing_from_pnr_warnings_issued = []
     skip_media = False
 
+    # cached row results are only valid for the same flags, form layout, ECO number, PNR Log and rev rules
+    row_cache.start_pass((VERSION_STRING, invalid_revs_ok, tuple(media_to_skip), arguments["new_pn_only"],
+                          layout.key, str(cover_sheet['S2'].value),
+                          pnr_verify and pnr_backends.fingerprint(pnr_list), rev_alphabet.name))
+
+    # CONTENTS_ID tables are rendered from the CI tree once every row has been validated, so for now we just
+    # note which CI records belong to each pass over a media set
+    set_record_spans = []
+
+    # every CI the form lists as new, on any media (including skipped media), for the ECO coverage check
+    form_new_cis = set()
+
+    rows_done = 0
+    if progress is not None:
+        progress.start("Validating CI_Sheet", total_rows=sum(len(media_sets[set_name])
+                                                             for set_name in media_set_order))
+
     for set_name in media_set_order:
-        current_indent_level = 0
-        cid_tables[set_name] = []
-        if not set_name == "skipped":
+        if not set_name == "skipped" and (selected_rows is None or
+                                          any(row[0].row in selected_rows for row in media_sets[set_name])):
             cid_table_order.append(set_name)
 
-        # pn_table is a reference to cid_tables[set_name], not a copy,
-        # so updates to it will be reflected in the original dict
-        pn_table = cid_tables[set_name]
+        set_start = len(ci_records)
 
         for row in media_sets[set_name]:
-            for cell in row:
 
-                # we only care about certain columns
-                if cell.column not in PN_SHEET_COLS:
-                    continue
+            # A row's results depend on its own cells plus a small slice of cross-row state: the media block we're
+            # in (and whether it's skipped), and what earlier rows recorded for this P/N+rev.
+            row_num = row[0].row
+            values = layout.row_values(row)
+
+            rows_done += 1
+            if progress is not None and not rows_done % progress.check_every:
+                progress.update(rows_done)
+
+            row_pn = str(values[layout.ad]).strip()
+            row_pn_plus_rev = row_pn + " Rev. {}".format(str(values[layout.nr] or values[layout.cr]).strip())
+            # Rows before the selection are only read for the state the selected rows depend on: which media block
+            # they're in, and which CIs earlier rows listed (and on what ECO, for released CIs).  Nothing in them is
+            # validated, so they can't stop the run.
+            if selected_rows is not None and row_num not in selected_rows:
+                if values[layout.mt]:
+                    current_media = str(values[layout.mt]).strip()
+                    skip_media = current_media.lower() in media_to_skip
+                if values[layout.ad] and values[layout.cr]:
+                    part_numbers_already_used[row_pn_plus_rev] = "{}".format(row_num)
+                    if not values[layout.nr] and values[layout.eco] and not values[layout.eco] == "dup":
+                        old_part_numbers[row_pn_plus_rev] = {str(values[layout.cr]).strip(): values[layout.eco]}
+                continue
+
+            if values[layout.ad] and values[layout.nr]:
+                form_new_cis.add((row_pn, str(values[layout.nr]).strip()))
+
+            # The row's number isn't part of its key (a row inserted or deleted above it would invalidate it), only
+            # how far back its P/N+rev was last used.  Results found under another row number are renumbered.
+            used_row = part_numbers_already_used.get(row_pn_plus_rev)
+            used_row = int(used_row) if used_row is not None else None
+            row_key = (tuple(values), row[layout.des].style.alignment.indent, set_name,
+                       current_media, skip_media,
+                       row_num - used_row if used_row is not None else None,
+                       row_pn_plus_rev in missing_from_pnr_warnings_issued,
+                       row_pn in old_part_numbers,
+                       tuple(sorted(old_part_numbers.get(row_pn_plus_rev, {}).items())))
+
+            cached_result = row_cache.lookup(row_key)
+            if cached_result is not None:
+                # replay the row's effects, exactly as validating it again would have produced them
+                cached_result = cached_result.moved_to(row_num)
+                ci_records.extend(cached_result.ci_records)
+                diagnostics.extend(cached_result.diagnostics)
+                pnr_warnings.extend(cached_result.pnr_warnings)
+                current_media, skip_media, row_used, row_missing, row_old = cached_result.state
+                if row_used is not None:
+                    part_numbers_already_used[row_pn_plus_rev] = row_used
+                if row_missing and row_pn_plus_rev not in missing_from_pnr_warnings_issued:
+                    missing_from_pnr_warnings_issued.append(row_pn_plus_rev)
+                if row_old is not None:
+                    old_part_numbers[row_pn_plus_rev] = dict(row_old)
+                continue
+
+            row_start = (len(ci_records), len(diagnostics.records), len(pnr_warnings))
+
+            # we only care about certain columns, and only those the sheet actually has
+            for column in layout.indices:
+                if column >= len(row):
+                    break
 
                 # Basic line validation: if Affected Documentation col is blank, there should be no values in
                 # the Cur Rev or Media Type columns.  Allowing lines like this screws everything up.
-                if not pn_sheet[AD_COL + str(cell.row)].value:
-                    if pn_sheet[CR_COL + str(cell.row)].value:
-                        print "ERROR: Rev present in CI_Sheet cell {}{}, but {}{} is empty.".format(
-                            CR_COL, cell.row, AD_COL, cell.row)
+                if not values[layout.ad]:
+                    if values[layout.cr]:
+                        diagnostics.error("rev-without-pn",
+                                          "ERROR: Rev present in CI_Sheet cell {}{}, but {}{} is empty.".format(
+                                              layout.cr_col, row_num, layout.ad_col, row_num),
+                                          row=row_num, cell=layout.cr_col + str(row_num))
                         sys.exit(1)
-                    elif pn_sheet[MT_COL + str(cell.row)].value:
-                        print "ERROR: Media type present in CI_Sheet cell {}{}, but {}{} is empty.".format(
-                            MT_COL, cell.row, AD_COL, cell.row)
+                    elif values[layout.mt]:
+                        diagnostics.error("media-without-pn",
+                                          "ERROR: Media type present in CI_Sheet cell {}{}, but {}{} is empty.".format(
+                                              layout.mt_col, row_num, layout.ad_col, row_num),
+                                          row=row_num, cell=layout.mt_col + str(row_num))
                         sys.exit(1)
                     else:
                         continue
 
                 # "Affected Documentation" column
-                if cell.column == AD_COL:
-                    pn_table.append([])
-                    pn_table[-1].append(str(cell.value).strip())
-                    current_pn = str(cell.value).strip()
+                if column == layout.ad:
+                    current_pn = str(values[column]).strip()
 
                     if not is_valid_part(current_pn):
-                        print "ERROR: CI_Sheet cell {}{} contains an improperly-formatted part number.".format(
-                            AD_COL, cell.row)
+                        diagnostics.error("bad-pn",
+                                          "ERROR: CI_Sheet cell {}{} contains an improperly-formatted "
+                                          "part number.".format(layout.ad_col, row_num),
+                                          row=row_num, cell=layout.ad_col + str(row_num), args={"pn": current_pn})
                         sys.exit(1)
 
+                    # start the structured record for this CI; the columns that follow fill it in
+                    ci_record = {"pn": current_pn, "rev": None, "rev_cell": None, "prev_rev": None,
+                                 "description": None, "indent": 0, "media_set": set_name, "media_type": None,
+                                 "row": row_num, "status": "released", "eco": None}
+                    if not set_name == "skipped":
+                        ci_records.append(ci_record)
+
                 # "Cur Rev" column
-                if cell.column == CR_COL:
-                    if not cell.value:
-                        print "ERROR: P/N present in CI_Sheet cell A{}, but B{} is empty.".format(
-                            AD_COL, cell.row, CR_COL, cell.row)
+                if column == layout.cr:
+                    if not values[column]:
+                        diagnostics.error("missing-rev",
+                                          "ERROR: P/N present in CI_Sheet cell {}{}, but {}{} is empty.".format(
+                                              layout.ad_col, row_num, layout.cr_col, row_num),
+                                          row=row_num, cell=layout.cr_col + str(row_num))
                         sys.exit(1)
-                    if not is_valid_rev(str(cell.value).strip()):
+                    if not is_valid_rev(str(values[column]).strip()):
                         if arguments["invalid_revs"]:
-                            print "WARNING: CI_Sheet cell {}{} contains invalid " \
-                                  "revision '{}'.".format(CR_COL, cell.row, str(cell.value).strip())
-                            print "         Script execution continuing because the -i argument was used."
+                            diagnostics.warning("invalid-rev",
+                                                "WARNING: CI_Sheet cell {}{} contains invalid revision '{}'.\n"
+                                                "         Script execution continuing because the -i argument "
+                                                "was used.".format(layout.cr_col, row_num, str(values[column]).strip()),
+                                                row=row_num, cell=layout.cr_col + str(row_num),
+                                                args={"rev": str(values[column]).strip()})
                         else:
-                            print "ERROR: CI_Sheet cell {}{} contains invalid " \
-                                  "revision '{}'.".format(CR_COL, cell.row, str(cell.value).strip())
-                            print "       If an exception was approved use the -i argument to override."
+                            diagnostics.error("invalid-rev",
+                                              "ERROR: CI_Sheet cell {}{} contains invalid revision '{}'.\n"
+                                              "       If an exception was approved use the -i argument to "
+                                              "override.".format(layout.cr_col, row_num, str(values[column]).strip()),
+                                              row=row_num, cell=layout.cr_col + str(row_num),
+                                              args={"rev": str(values[column]).strip()})
                             sys.exit(1)
 
                     # if there's not a new revision, this is the revision we're using
-                    if not pn_sheet[NR_COL + str(cell.row)].value:
-                        current_rev = str(cell.value).strip()
+                    if not values[layout.nr]:
+                        current_rev = str(values[column]).strip()
                         current_pn_plus_rev = current_pn + " Rev. {}".format(current_rev)
-
-                        # Replace p/n in last table "cell" with pn+revision
-                        pn_table[-1][-1] = current_pn_plus_rev
+                        ci_record["rev"] = current_rev
+                        ci_record["rev_cell"] = layout.cr_col + str(row_num)
 
                         # if there's no new rev, there's no need for the prev_rev var, which is only
                         # used for comparing previous rev to new rev
                         prev_rev = ""
 
                     else:
-                        prev_rev = str(cell.value).strip()
+                        prev_rev = str(values[column]).strip()
+                        ci_record["prev_rev"] = prev_rev
 
                 # "New Rev" column
-                if cell.column == NR_COL and cell.value:
-                    if not is_valid_rev(str(cell.value).strip()):
+                if column == layout.nr and values[column]:
+                    if not is_valid_rev(str(values[column]).strip()):
                         if arguments["invalid_revs"]:
-                            print "WARNING: CI_Sheet cell {}{} contains invalid " \
-                                  "revision '{}'.".format(NR_COL, cell.row, str(cell.value).strip())
-                            print "         Script execution continuing because the -i argument was used."
+                            diagnostics.warning("invalid-rev",
+                                                "WARNING: CI_Sheet cell {}{} contains invalid revision '{}'.\n"
+                                                "         Script execution continuing because the -i argument "
+                                                "was used.".format(layout.nr_col, row_num, str(values[column]).strip()),
+                                                row=row_num, cell=layout.nr_col + str(row_num),
+                                                args={"rev": str(values[column]).strip()})
                         else:
-                            print "ERROR: CI_Sheet cell {}{} contains invalid " \
-                                  "revision '{}'.".format(NR_COL, cell.row, str(cell.value).strip())
-                            print "       If an exception was approved use the -i argument to override."
+                            diagnostics.error("invalid-rev",
+                                              "ERROR: CI_Sheet cell {}{} contains invalid revision '{}'.\n"
+                                              "       If an exception was approved use the -i argument to "
+                                              "override.".format(layout.nr_col, row_num, str(values[column]).strip()),
+                                              row=row_num, cell=layout.nr_col + str(row_num),
+                                              args={"rev": str(values[column]).strip()})
                             sys.exit(1)
 
-                    if not (Rev(pn_sheet[CR_COL + str(cell.row)].value).next_rev.name == str(cell.value).strip()) \
-                            and is_valid_rev(str(cell.value).strip()):
-                        print "WARNING: CI_Sheet cell {}{} lists new rev '{}'.  Expected '{}', the first\n" \
-                              "         valid rev after cur " \
-                              "rev '{}' (cell {}{}).".format(NR_COL, cell.row,
-                                                             str(cell.value).strip(),
-                                                             Rev(pn_sheet[CR_COL + str(cell.row)].value).next_rev.name,
-                                                             pn_sheet[CR_COL + str(cell.row)].value,
-                                                             CR_COL,
-                                                             cell.row
-                                                             )
-
-                    if pn_sheet[ECO_COL + str(cell.row)].value and str(pn_sheet[ECO_COL + str(cell.row)].value).isdigit():
-                        print 'ERROR: CI_Sheet row {} -- there cannot be both a new rev \n       ' \
-                              'in {}{} and an ECO number in {}{}.'.format(cell.row, NR_COL, cell.row, ECO_COL, cell.row)
+                    expected_rev = Rev(values[layout.cr], alphabet=rev_alphabet).next_rev.name
+                    if not (expected_rev == str(values[column]).strip()) \
+                            and is_valid_rev(str(values[column]).strip()):
+                        diagnostics.warning("unexpected-new-rev",
+                                            "WARNING: CI_Sheet cell {}{} lists new rev '{}'.  Expected '{}', the "
+                                            "first\n         valid rev after cur "
+                                            "rev '{}' (cell {}{}).".format(layout.nr_col, row_num,
+                                                                           str(values[column]).strip(),
+                                                                           expected_rev,
+                                                                           values[layout.cr],
+                                                                           layout.cr_col,
+                                                                           row_num
+                                                                           ),
+                                            row=row_num, cell=layout.nr_col + str(row_num),
+                                            args={"rev": str(values[column]).strip(), "expected": expected_rev})
+
+                    if values[layout.eco] and str(values[layout.eco]).isdigit():
+                        diagnostics.error("new-rev-and-eco",
+                                          'ERROR: CI_Sheet row {} -- there cannot be both a new rev \n       '
+                                          'in {}{} and an ECO number in {}{}.'.format(row_num, layout.nr_col, row_num,
+                                                                                    layout.eco_col, row_num),
+                                          row=row_num, cell=layout.eco_col + str(row_num))
                         sys.exit(1)
 
-                    current_rev = str(cell.value).strip()
+                    current_rev = str(values[column]).strip()
 
                     current_pn_plus_rev = current_pn + " Rev. {}".format(current_rev)
+                    ci_record["rev"] = current_rev
+                    ci_record["rev_cell"] = layout.nr_col + str(row_num)
+                    ci_record["status"] = "new"
+                    ci_record["eco"] = str(cover_sheet['S2'].value)
 
                     if pnr_verify:
 
                         if current_pn_plus_rev in pnr_dupe_pn_list:
-                            print "ERROR: CI_Sheet cell {}{} contains CI {}, which is\n       in the PN Reserve Log " \
-                                  "more than once. See file PNR_WARNINGS.".format(AD_COL, cell.row, current_pn_plus_rev)
+                            diagnostics.error("pnr-dupe",
+                                              "ERROR: CI_Sheet cell {}{} contains CI {}, which is\n       in the PN "
+                                              "Reserve Log more than once. See file "
+                                              "PNR_WARNINGS.".format(layout.ad_col, row_num, current_pn_plus_rev),
+                                              row=row_num, cell=layout.ad_col + str(row_num),
+                                              args={"ci": current_pn_plus_rev})
                             sys.exit(1)
 
                         # For new parts, error if pn in PNRL and ECO# listed is not the current ECO.
-                        if pnr_list.has_part(current_pn, current_rev):
-                            if pnr_list.parts[current_pn].revs[current_rev].eco != str(cover_sheet['S2'].value):
-                                print "ERROR: CI_Sheet row {} -- new pn {} is marked in the\n       PN Reserve " \
-                                      "Log as released on ECO {}, not " \
-                                      "current ECO {}.".format(cell.row,
-                                                               current_pn_plus_rev,
-                                                               pnr_list.parts[current_pn].revs[current_rev].eco,
-                                                               str(cover_sheet['S2'].value))
+                        pnr_eco = pnr_list.eco(current_pn, current_rev)
+                        if pnr_eco is not None:
+                            if pnr_eco != str(cover_sheet['S2'].value):
+                                diagnostics.error("pnr-eco-mismatch",
+                                                  "ERROR: CI_Sheet row {} -- new pn {} is marked in the\n       PN "
+                                                  "Reserve Log as released on ECO {}, not "
+                                                  "current ECO {}.".format(row_num,
+                                                                           current_pn_plus_rev,
+                                                                           pnr_eco,
+                                                                           str(cover_sheet['S2'].value)),
+                                                  row=row_num,
+                                                  args={"ci": current_pn_plus_rev,
+                                                        "pnr_eco": pnr_eco,
+                                                        "eco": str(cover_sheet['S2'].value)})
                                 sys.exit(1)
 
                         else:
                             # Report if a new pn/rev combo is not in the PNR Log (report only once per pn/rev)
                             if current_pn_plus_rev not in missing_from_pnr_warnings_issued:
                                 pnr_warnings.append("WARNING: CI_Sheet row {} - Add part {}"
-                                                    " to the PN Reserve Log.".format(cell.row,
+                                                    " to the PN Reserve Log.".format(row_num,
                                                                                        current_pn_plus_rev))
+                                diagnostics.warning("pnr-missing-new", pnr_warnings[-1], row=row_num,
+                                                    echo=False, args={"ci": current_pn_plus_rev})
                                 missing_from_pnr_warnings_issued.append(current_pn_plus_rev)
 
-                            # For new parts, warning if if new rev doesn't follow previous rev in PNRL
-                            if pnr_list.has_part(current_pn, prev_rev):
-                                expected_next_rev = pnr_list.parts[current_pn].revs[prev_rev].next_rev.name
+                            # For new parts, warning if the new rev doesn't follow the previous rev in the PNRL:
+                            # the log's greatest rev before the new rev, or the form's Cur Rev if the log lists
+                            # it and it's later (ex. a new rev that isn't after the Cur Rev)
+                            pnr_prev_rev = pnr_list.rev_before(current_pn, current_rev) \
+                                if is_valid_rev(current_rev, mode=2, alphabet=rev_alphabet) else None
+                            if pnr_list.has_part(current_pn, prev_rev) and \
+                                    (pnr_prev_rev is None or Rev(prev_rev, alphabet=rev_alphabet) > pnr_prev_rev):
+                                pnr_prev_rev = Rev(prev_rev, alphabet=rev_alphabet)
+                            if pnr_prev_rev is not None:
+                                expected_next_rev = pnr_prev_rev.next_rev.name
                                 if (expected_next_rev != current_rev) and is_valid_rev(current_rev):
 
                                     error_msg = u"WARNING: PN Reserve Log lists the prev rev for {} as '{}'.\n" \
                                                 u"         Expected new rev '{}' in CI_Sheet " \
                                                 u"cell {}{}, instead of'{}'.".format(current_pn,
-                                                                                     prev_rev,
+                                                                                     pnr_prev_rev.name,
                                                                                      expected_next_rev,
-                                                                                     NR_COL,
-                                                                                     cell.row,
+                                                                                     layout.nr_col,
+                                                                                     row_num,
                                                                                      current_rev
                                                                                      )
 
                                     pnr_warnings.append(error_msg)
-                                    print error_msg
-
-                    # Replace p/n in last table "cell" with pn+revision
-                    pn_table[-1][-1] = current_pn_plus_rev
+                                    diagnostics.warning("pnr-prev-rev", error_msg, row=row_num,
+                                                        cell=layout.nr_col + str(row_num),
+                                                        args={"pn": current_pn, "prev_rev": pnr_prev_rev.name,
+                                                              "expected": expected_next_rev, "rev": current_rev})
 
                 # "ECO" column -- not useful for CONTENTS_ID, but used for form validation.
-                if cell.column == ECO_COL:
+                if column == layout.eco:
 
                     # once a new p/n has been listed, subsequent occurrences must be marked
                     # "dup" in the "ECO" column.  Is this a dup not marked "dup?"
-                    if current_pn_plus_rev in part_numbers_already_used.keys() and not cell.value == "dup" \
-                            and pn_sheet[NR_COL + str(cell.row)].value:
-                        print 'WARNING: CI_Sheet row {} has duplicate P/N {}\n         which is not marked "dup." ' \
-                              'Last used on row {}.'.format(cell.row, current_pn_plus_rev,
-                                                            part_numbers_already_used[current_pn_plus_rev])
+                    if current_pn_plus_rev in part_numbers_already_used.keys() and not values[column] == "dup" \
+                            and values[layout.nr]:
+                        diagnostics.warning("dup-not-marked",
+                                            'WARNING: CI_Sheet row {} has duplicate P/N {}\n         which is not '
+                                            'marked "dup." Last used on '
+                                            'row {}.'.format(row_num, current_pn_plus_rev,
+                                                             part_numbers_already_used[current_pn_plus_rev]),
+                                            row=row_num, cell=layout.eco_col + str(row_num),
+                                            args={"ci": current_pn_plus_rev,
+                                                  "last_row": part_numbers_already_used[current_pn_plus_rev]})
 
                     # Next: is this a p/n marked "dup" that isn't actually a dup?
-                    elif current_pn_plus_rev not in part_numbers_already_used.keys() and cell.value == "dup" \
-                            and pn_sheet[NR_COL + str(cell.row)].value:
-                        print 'WARNING: CI_Sheet row {} has new P/N {}, incorrectly\n         marked ' \
-                              'as "dup"'.format(cell.row, current_pn_plus_rev)
+                    elif current_pn_plus_rev not in part_numbers_already_used.keys() and values[column] == "dup" \
+                            and values[layout.nr]:
+                        diagnostics.warning("dup-marked-new",
+                                            'WARNING: CI_Sheet row {} has new P/N {}, incorrectly\n         marked '
+                                            'as "dup"'.format(row_num, current_pn_plus_rev),
+                                            row=row_num, cell=layout.eco_col + str(row_num),
+                                            args={"ci": current_pn_plus_rev})
 
                     # If there's no new rev, there must be an ECO listed in the ECO column
-                    elif not pn_sheet[NR_COL + str(cell.row)].value:
-                        if not cell.value:
-                            if pnr_verify and pnr_list.has_part(current_pn, current_rev) and \
-                                    pnr_list.parts[current_pn].revs[current_rev].eco != str(cell.value).strip():
-                                print 'ERROR: CI_Sheet row {} lists {}, which the PNR Log\n' \
-                                      '       lists as released on ECO {}. Cell {}{} should contain ' \
-                                      "'{}'.".format(cell.row, current_pn_plus_rev,
-                                                     pnr_list.parts[current_pn].revs[current_rev].eco,
-                                                     ECO_COL,
-                                                     cell.row,
-                                                     pnr_list.parts[current_pn].revs[current_rev].eco
-                                                     )
+                    elif not values[layout.nr]:
+                        if not values[column]:
+                            pnr_eco = pnr_list.eco(current_pn, current_rev) if pnr_verify else None
+                            if pnr_eco is not None and pnr_eco != str(values[column]).strip():
+                                diagnostics.error("eco-missing",
+                                                  'ERROR: CI_Sheet row {} lists {}, which the PNR Log\n'
+                                                  '       lists as released on ECO {}. Cell {}{} should contain '
+                                                  "'{}'.".format(row_num, current_pn_plus_rev,
+                                                                 pnr_eco,
+                                                                 layout.eco_col,
+                                                                 row_num,
+                                                                 pnr_eco
+                                                                 ),
+                                                  row=row_num, cell=layout.eco_col + str(row_num),
+                                                  args={"ci": current_pn_plus_rev,
+                                                        "pnr_eco": pnr_eco})
                             else:
-                                print 'ERROR: CI_Sheet cell {}{} has no value, so a value must be added to ' \
-                                      'empty cell {}{}!'.format(NR_COL, cell.row, ECO_COL, cell.row)
+                                diagnostics.error("eco-missing",
+                                                  'ERROR: CI_Sheet cell {}{} has no value, so a value must be '
+                                                  'added to empty cell {}{}!'.format(layout.nr_col, row_num,
+                                                                                     layout.eco_col, row_num),
+                                                  row=row_num, cell=layout.eco_col + str(row_num))
 
-                        elif not cell.value == "dup":
+                        elif not values[column] == "dup":
 
                             # if -p/--pnr-verify was set, verify old P/N's vs PN Reserve log
                             if pnr_verify:
                                 # Error if the ECO# listed for a released pn/rev doesn't match what's in the PNR Log
-                                if pnr_list.has_part(current_pn, current_rev):
-                                    if pnr_list.parts[current_pn].revs[current_rev].eco != str(cell.value).strip():
-                                        print 'ERROR: On CI_Sheet row {}, {} is marked as being released on \n       ' \
-                                              'ECO {}. This conflicts with the PN Reserve Log, where\n       ' \
-                                              'it is marked as released ' \
-                                              'on ECO {}.'.format(cell.row, current_pn, str(cell.value).strip(),
-                                                                  pnr_list.parts[current_pn].revs[current_rev].eco)
+                                pnr_eco = pnr_list.eco(current_pn, current_rev)
+                                if pnr_eco is not None:
+                                    if pnr_eco != str(values[column]).strip():
+                                        diagnostics.error("released-eco-mismatch",
+                                                          'ERROR: On CI_Sheet row {}, {} is marked as being '
+                                                          'released on \n       ECO {}. This conflicts with the '
+                                                          'PN Reserve Log, where\n       it is marked as released '
+                                                          'on ECO {}.'.format(row_num, current_pn,
+                                                                              str(values[column]).strip(),
+                                                                              pnr_eco),
+                                                          row=row_num, cell=layout.eco_col + str(row_num),
+                                                          args={"ci": current_pn_plus_rev,
+                                                                "eco": str(values[column]).strip(),
+                                                                "pnr_eco": pnr_eco})
                                         sys.exit(1)
                                 else:
                                     # Report if an old pn/rev combo is not in the PNR Log (report only once per pn/rev)
                                     if current_pn_plus_rev not in missing_from_pnr_warnings_issued:
                                         pnr_warnings.append(u"INFO: CI_Sheet row {} - released part {} not "
-                                                            u"in the PNR Log.".format(cell.row, current_pn_plus_rev))
+                                                            u"in the PNR Log.".format(row_num, current_pn_plus_rev))
+                                        diagnostics.info("pnr-missing-released", pnr_warnings[-1], row=row_num,
+                                                         echo=False, args={"ci": current_pn_plus_rev})
                                         missing_from_pnr_warnings_issued.append(current_pn_plus_rev)
 
                             # The following block of validation tests keeps track of the ECO numbers recorded
@@ -438,114 +751,114 @@ def extract_ps1_tab_part_nums(arguments, pnr_list=None, pnr_warnings=[], pnr_dup
 
                                 # When a previously-released part/rev is listed more than once, all instances
                                 # should list the same ECO#
-                                if old_part_numbers[current_pn_plus_rev][current_rev] != str(cell.value).strip():
-                                    print "ERROR: On CI_Sheet row {}, {} is marked as released on \n       ECO {}. " \
-                                          "This conflicts with row {}, where it is marked as \n       released on " \
-                                          "ECO {}.".format(cell.row,
-                                                           current_pn_plus_rev,
-                                                           str(cell.value).strip(),
-                                                           part_numbers_already_used[current_pn_plus_rev],
-                                                           old_part_numbers[current_pn_plus_rev][current_rev])
+                                if old_part_numbers[current_pn_plus_rev][current_rev] != str(values[column]).strip():
+                                    diagnostics.error("released-eco-conflict",
+                                                      "ERROR: On CI_Sheet row {}, {} is marked as released on \n"
+                                                      "       ECO {}. This conflicts with row {}, where it is "
+                                                      "marked as \n       released on "
+                                                      "ECO {}.".format(row_num,
+                                                                       current_pn_plus_rev,
+                                                                       str(values[column]).strip(),
+                                                                       part_numbers_already_used[current_pn_plus_rev],
+                                                                       old_part_numbers[current_pn_plus_rev][
+                                                                           current_rev]),
+                                                      row=row_num, cell=layout.eco_col + str(row_num),
+                                                      args={"ci": current_pn_plus_rev,
+                                                            "eco": str(values[column]).strip(),
+                                                            "other_row": part_numbers_already_used[
+                                                                current_pn_plus_rev]})
                                     sys.exit(1)
 
                             # store the ECO# listed for the pn/rev on this row
-                            old_part_numbers[current_pn_plus_rev][current_rev] = cell.value
+                            old_part_numbers[current_pn_plus_rev][current_rev] = values[column]
+
+                    # a new rev listed again, whether or not it's marked "dup", isn't a new CI for this ECO.  The first
+                    # listing is, even if it's wrongly marked "dup" (which is warned about above).
+                    if values[layout.nr] and current_pn_plus_rev in part_numbers_already_used:
+                        ci_record["status"] = "dup"
+                    elif not values[layout.nr] and values[column]:
+                        ci_record["eco"] = str(values[column]).strip()
 
                     # Keep track of part numbers already listed on the ECO
-                    part_numbers_already_used[current_pn_plus_rev] = "{}".format(cell.row)
+                    part_numbers_already_used[current_pn_plus_rev] = "{}".format(row_num)
 
                 # "Description..." column
-                if cell.column == DES_COL:
-                    if not cell.value:
-                        print "ERROR: P/N present in CI_Sheet cell {}{}, but {}{} is empty.".format(
-                            AD_COL, cell.row, DES_COL, cell.row)
+                if column == layout.des:
+                    if not values[column]:
+                        diagnostics.error("missing-description",
+                                          "ERROR: P/N present in CI_Sheet cell {}{}, but {}{} is empty.".format(
+                                              layout.ad_col, row_num, layout.des_col, row_num),
+                                          row=row_num, cell=layout.des_col + str(row_num))
                         sys.exit(1)
-                    new_indent_level = cell.style.alignment.indent
-
-                    # this will only happen on the first line
-                    if not current_indent_level:
-                        current_indent_level = new_indent_level
 
-                    # test the current (previous row's) indent level vs. this row's indent level
-                    indent_reduced = new_indent_level < current_indent_level
-                    current_indent_level = new_indent_level
-
-                    # if the description is indented, we need to add spaces to the part number
-                    pn_table[-1][-1] = "  " * int("{:.0f}".format(current_indent_level)) + pn_table[-1][-1]
-
-                    # if the indention level was reduced, add blank line to improve legibility
-                    if indent_reduced and current_indent_level == 0:
-                        pn_table[-1][-1] = "\n" + pn_table[-1][-1]
-
-                    pn_table[-1].append(cell.value)
+                    # the description's indent level is what nests this CI under the assembly above it
+                    ci_record["description"] = values[column]
+                    ci_record["indent"] = int("{:.0f}".format(row[column].style.alignment.indent))
 
                 # "Media" column
-                if cell.column == MT_COL:
-                    if cell.value:
-                        current_media = str(cell.value).strip()
-                        if current_media.lower() in media_to_skip:
-                            skip_media = True
-                        else:
-                            # if on a new, non-skipped media type, we pre-pend a line with the first part number
-                            skip_media = False
-                            hold_row = pn_table.pop()
-                            pn_table.append([current_media + ":" + set_name, ""])
-                            pn_table.append(hold_row)
+                if column == layout.mt:
+                    if values[column]:
+                        current_media = str(values[column]).strip()
+                        skip_media = current_media.lower() in media_to_skip
 
-                    # If we're on a row for media we skip, remove entire row from results
-                    if skip_media:
-                        pn_table.pop()
+                    # the media type heads this CI's media set in its CONTENTS_ID table
+                    ci_record["media_type"] = current_media
 
-                # "ISO Name" column
-                if cell.column == IN_COL:
-                    if cell.value:
-                        iso_name_len = len(str(cell.value).replace('.iso', '').strip())
+                    # If we're on a row for media we skip, remove entire row from results
+                    if skip_media and ci_records and ci_records[-1] is ci_record:
+                        ci_records.pop()
+
+                # "ISO Name" column.  Checked here rather than on the render workers, so its warnings come out in
+                # row order with the rest of the row's, and are replayed with them from the row cache.
+                if column == layout.iso:
+                    if values[column]:
+                        iso_name_len = len(str(values[column]).replace('.iso', '').strip())
                         if iso_name_len > 16:
-                            print 'WARNING: ISO name in CI_Sheet cell {}{} is {} chars. Is vol name <= ' \
-                                  '16 chars?'.format(IN_COL, cell.row, iso_name_len)
+                            diagnostics.warning("iso-name-length",
+                                                'WARNING: ISO name in CI_Sheet cell {}{} is {} chars. Is vol name '
+                                                '<= 16 chars?'.format(layout.iso_col, row_num, iso_name_len),
+                                                row=row_num, cell=layout.iso_col + str(row_num),
+                                                args={"length": iso_name_len})
+
+            row_cache.store(row_key, RowResult(ci_records[row_start[0]:], diagnostics.records[row_start[1]:],
+                                               pnr_warnings[row_start[2]:],
+                                               (current_media, skip_media,
+                                                part_numbers_already_used.get(row_pn_plus_rev),
+                                                row_pn_plus_rev in missing_from_pnr_warnings_issued,
+                                                dict(old_part_numbers[row_pn_plus_rev])
+                                                if row_pn_plus_rev in old_part_numbers else None),
+                                               row_num, used_row))
+
+        set_record_spans.append((set_name, set_start, len(ci_records)))
+
+    # a pass over part of the sheet keeps the cached results for the rows it didn't validate
+    row_cache.end_pass(prune=selected_rows is None)
+    if progress is not None:
+        progress.finish(rows_done)
+
+    # New CIs that aren't in the log, or that the log puts on another ECO, were reported row by row above.  What
+    # the rows can't show is a CI the log says this ECO released that the form doesn't list at all (which can only
+    # be known when the whole form was read).
+    if pnr_verify and selected_rows is None:
+        eco = str(cover_sheet['S2'].value)
+        for pn, rev in sorted(pnr.eco_coverage(form_new_cis, pnr_list, eco)[0]):
+            pnr_warnings.append("WARNING: PN Reserve Log lists {} Rev. {} as released on ECO {}, but it isn't "
+                                "a new CI on the ECO form.".format(pn, rev, eco))
+            diagnostics.warning("pnr-not-on-eco", pnr_warnings[-1], echo=False,
+                                args={"ci": "{} Rev. {}".format(pn, rev), "eco": eco})
+
+    # The row pass above resolved everything media sets share (dups, previously-released ECOs, the current media),
+    # so each set's table can now be built from the CI hierarchy, and formatted, independently of the others.
+    rendered_sets = cid_output.render_media_sets([ci_records[set_start:set_end]
+                                                  for set_name, set_start, set_end in set_record_spans],
+                                                 arguments["jobs"])
+    for (set_name, set_start, set_end), (table, text) in zip(set_record_spans, rendered_sets):
+        cid_tables[set_name] = table
+        cid_texts[set_name] = text
 
     return cid_tables, cid_table_order, pnr_warnings, missing_from_pnr_warnings_issued
 
 
-def write_single_cid_file(contents_id_table, eol):
-    """
-    Write the contents of a table to a file
-
-    :param contents_id_table: a table of part numbers, formatted into a multi-line string by bdt.pretty_table()
-    :param eol: the end of line format to use, will be \n for UNIX, \r\n for DOS.
-    """
-
-    stripped_line = ""
-
-    # break contents_id "table" into a list of lines
-    for line in contents_id_table.split("\n"):
-
-        # only do the following block on non-blank lines
-        if line:
-            # create a version of line with leading & trailing spaces removed
-            stripped_line = line.strip()
-
-            # does this line not start with a part number?  Then it's a media identifier (CD1, Synergy, etc.)
-            # that should be used to name the file, but not be written to the file.
-            if not stripped_line[0:3].isdigit():
-                current_media = stripped_line[stripped_line.find(":") + 1:]
-                print "Creating file CONTENTS_ID.{}...".format(current_media.replace(" ", "_"))
-                output_file = io.open("CONTENTS_ID." + current_media.replace(" ", "_"), "w", newline=eol)
-                continue
-
-        try:
-            # write line to file, passes along blank lines, too
-            output_file.write(line + "\n")
-        except NameError:
-            print "\nERROR: write_single_cid_file() was passed an empty or improperly-formatted table." \
-                  "Table contents:\n{}\nstripped_line:" \
-                  "\n{}".format(str(contents_id_table), stripped_line)
-            sys.exit(1)
-
-    if not output_file.closed:
-        output_file.close()
-
-
 def make_parser():
     """
     Construct a command-line parser for the script, using the build-in argparse library
@@ -573,6 +886,23 @@ def make_parser():
                               help="allow invalid revisions (issue a warning)")
     output_group.add_argument('-e', type=str, choices=["unix", "dos"], default="unix",
                               help="set EOL type for files (default is unix)")
+    output_group.add_argument('-x', '--export', type=str, choices=cid_export.EXPORT_FORMATS, default=None,
+                              help="also write CIs and diagnostics to CONTENTS_ID.json or CONTENTS_ID.ndjson")
+    output_group.add_argument('--export-only', action='store_true', default=False,
+                              help="write only the -x/--export file, not the text files")
+    output_group.add_argument('--suggest-revs', action='store_true', default=False,
+                              help="also write REV_SUGGESTIONS.csv, listing New Rev cells that don't hold the rev "
+                                   "expected from Cur Rev (and the PN Reserve Log, with -p)")
+    output_group.add_argument('-b', '--bundle', type=str, choices=cid_output.BUNDLE_FORMATS, default=None,
+                              help="write all files into a single CONTENTS_ID.zip or CONTENTS_ID.tar archive")
+
+    select_group = parser.add_argument_group('selection (can be combined)')
+    select_group.add_argument('--media', type=str, action='append', default=None, metavar="NAME",
+                              help="only read and validate the media block NAME, a media type (ex. CD1) or media "
+                                   "set (ex. 139-000001-00-B), and write only its CONTENTS_ID file.  Repeatable.")
+    select_group.add_argument('--rows', type=str, default=None, metavar="FIRST-LAST",
+                              help="only read and validate CI_Sheet rows FIRST to LAST (or from FIRST on, for "
+                                   "FIRST-), without writing CONTENTS_ID files")
 
     special_group = parser.add_argument_group('special modes')
     special_meg = special_group.add_mutually_exclusive_group()
@@ -580,10 +910,27 @@ def make_parser():
                              help="print only new part numbers, to file NEW_PARTS")
     special_meg.add_argument('-p', '--pnr-verify', action='store_true', default=False,
                              help="verify ECO PNs vs. Part Number Reserve Log")
-
-    # Writing to xlsm files doesn't currently work, and even writing to xlsx breaks formatting
-    # special_meg.add_argument('-u', '--update-pnr', action='store_true', default=False,
-    # help="update Part Number Reserve Log with ECO PNs (future)")
+    special_group.add_argument('--pnr-snapshot', type=str, default=None, metavar="PATH",
+                               help="with -p, read the PN Reserve Log through a snapshot at PATH, which is "
+                                    "rebuilt whenever the log changes")
+    special_group.add_argument('--pnr-url', type=str, default=None, metavar="URL",
+                               help="with -p, look ECO PNs up in the PNR web service at URL rather than reading "
+                                    "the PN Reserve Log")
+    special_group.add_argument('-w', '--watch', action='store_true', default=False,
+                               help="re-validate the ECO form each time it is saved, without writing files")
+
+    parser.add_argument('--force', action='store_true', default=False,
+                        help="regenerate files even if the ECO form and flags are unchanged since the last run")
+    parser.add_argument('--progress', action='store_true', default=False,
+                        help="show progress (rows, rows per second and ETA) on stderr while workbooks are read")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar="N",
+                        help="build and format the media sets' tables in N worker processes (0 for one per CPU)")
+    parser.add_argument('--flush-interval', type=float, default=None, metavar="SECONDS",
+                        help="print errors and warnings at least this often, rather than once per phase")
+
+    special_meg.add_argument('-u', '--update-pnr', action='store_true', default=False,
+                             help="verify ECO PNs vs. Part Number Reserve Log (like -p), then add the ECO's new "
+                                  "PNs to it")
 
     return parser
 
@@ -600,18 +947,92 @@ def main():
     # Convert parsed arguments from Namespace to dictionary
     arguments = vars(arguments)
 
-    if arguments["invalid_revs"]:
-        cid_classes.VALID_REV_CHARS = VALID_AND_INVALID_REV_CHARS
+    # without an export to write, --export-only would write nothing at all
+    if arguments["export_only"] and not arguments["export"]:
+        parser.error("--export-only requires -x/--export")
+
+    # the PNR Log can only be updated once the ECO's CIs have been verified against it
+    if arguments["update_pnr"]:
+        if arguments["watch"]:
+            print "\nERROR: -u/--update-pnr can't be used with -w/--watch."
+            sys.exit(1)
+        if arguments["pnr_url"]:
+            print "\nERROR: -u/--update-pnr can't be used with --pnr-url."
+            sys.exit(1)
+        arguments["pnr_verify"] = True
+
+    # --media and --rows limit a run to part of the ECO, so they can't write files that list the whole ECO
+    if arguments["rows"]:
+        rows = parse_row_range(arguments["rows"])
+        if rows is None:
+            print "\nERROR: --rows takes a range of CI_Sheet rows, like 120-180 or 120-, not '{}'.".format(
+                arguments["rows"])
+            sys.exit(1)
+        arguments["rows"] = rows
+    if arguments["media"] or arguments["rows"]:
+        if arguments["print_to_one"] or arguments["new_pn_only"] or arguments["update_pnr"]:
+            print "\nERROR: --media and --rows can't be used with -o, -n or -u/--update-pnr."
+            sys.exit(1)
+
+    # if the ECO form, the output flags and the PNR Log all match the last run and its files are intact, we're done
+    # (an update run always goes ahead, since the log may be missing CIs a previous run found, and so does a run
+    # against the PNR web service, since there's no file to tell whether the log changed)
+    cache_key = cid_cache.cache_key(arguments, VERSION_STRING, pnr.PNRL_PATH)
+    if not arguments["force"] and not arguments["watch"] and not arguments["update_pnr"] and \
+            not (arguments["pnr_verify"] and arguments["pnr_url"]) and cid_cache.is_current(cache_key):
+        # the files are the same as last time, and so are the problems the last run found; show them again
+        previous_diagnostics = DiagnosticLog(buffered=True)
+        previous_diagnostics.extend(cid_cache.manifest_diagnostics())
+        previous_diagnostics.flush()
+
+        print "\nCONTENTS_ID files for {} are up to date. Use --force to " \
+              "regenerate them.".format(arguments["eco_file"])
+        return
+
+    # every error, warning and info message is recorded here.  They're printed in row order, with repeats
+    # collapsed, whenever the log is flushed: at the end of each phase, before a fatal exit, and every
+    # --flush-interval seconds if that was given.
+    diagnostics = DiagnosticLog(buffered=True, flush_interval=arguments["flush_interval"])
+
+    progress = None
+    if arguments["progress"]:
+        progress = cid_progress.Progress([cid_progress.console_indicator()])
 
     pnr_list = None
     pnr_warnings = []
     pnr_dupe_pn_list = []
+    pnr_fingerprint = None
     if arguments["pnr_verify"]:
-        pnr_list, pnr_warnings, pnr_dupe_pn_list = pnr.extract_part_nums_pnr()
+        # taken before the log is read, so an update can tell if someone else changed the log in the meantime
+        pnr_fingerprint = cid_cache.pnr_fingerprint(pnr.PNRL_PATH)
+        try:
+            pnr_list, pnr_warnings, pnr_dupe_pn_list = pnr_backends.open_backend(arguments).load(
+                select_rev_alphabet(arguments), diagnostics, progress)
+        except pnr_backends.PNRServiceError as e:
+            diagnostics.error("pnr-service", "\nERROR: {}".format(e))
+            sys.exit(1)
+        finally:
+            diagnostics.flush()
 
-    # Extract ECO spreadsheet PNs in CONTENTS_ID format (returns a dict of multi-line strings, keyed to media type)
-    cid_tables, cid_table_order, pnr_warnings, missing_from_pnr_warnings_issued = \
-        extract_ps1_tab_part_nums(arguments, pnr_list, pnr_warnings, pnr_dupe_pn_list)
+    # in watch mode the PNR Log stays loaded, and the ECO form is re-validated (without writing files) on each save
+    if arguments["watch"]:
+        cid_watch.watch(extract_ps1_tab_part_nums, arguments, pnr_list, pnr_warnings, pnr_dupe_pn_list)
+        return
+
+    # a run that dies part way through must not leave behind a manifest that vouches for its partial outputs
+    cid_cache.clear_manifest()
+
+    # rows unchanged since the last run are replayed from the row cache rather than validated again
+    row_cache = None
+    if not arguments["force"]:
+        row_cache = cid_cache.load_row_cache()
+    if row_cache is None:
+        row_cache = RowValidationCache()
+
+    ci_records = []
+    cid_texts = {}
+    for warning in pnr_warnings:
+        diagnostics.warning("pnr-log", warning, echo=False)
 
     # Set file output line endings to requested format.  One (and only one) will always be True.  Default is UNIX.
     if arguments["e"] == "dos":
@@ -619,45 +1040,62 @@ def main():
     else:
         eol = '\n'
 
+    # Extract ECO spreadsheet PNs in CONTENTS_ID format (returns a dict of multi-line strings, keyed to media type)
+    try:
+        cid_tables, cid_table_order, pnr_warnings, missing_from_pnr_warnings_issued = \
+            extract_ps1_tab_part_nums(arguments, pnr_list, pnr_warnings, pnr_dupe_pn_list, diagnostics, ci_records,
+                                      row_cache, progress, cid_texts)
+    except pnr_backends.PNRServiceError as e:
+        diagnostics.error("pnr-service", "\nERROR: {}".format(e))
+        diagnostics.flush()
+        sys.exit(1)
+    except SystemExit:
+        diagnostics.flush()
+
+        # the export is most useful exactly when the ECO has errors, so write what we have before exiting
+        if arguments["export"]:
+            cid_output.write_outputs([cid_export.render_export(arguments["export"], ci_records, diagnostics,
+                                                               arguments["eco_file"])], eol)
+        raise
+
     if pnr_warnings:
-        print '\nWARNING: Additional issues found in PN Reserve Log validation phase.\n         ' \
-              'See file PNR_WARNINGS for details.\n'
+        diagnostics.warning("pnr-warnings-file",
+                            '\nWARNING: Additional issues found in PN Reserve Log validation phase.\n         '
+                            'See file PNR_WARNINGS for details.\n')
         if missing_from_pnr_warnings_issued:
-            print 'WARNING: Your ECO contains CIs that need to be added to the PN Reserve Log.\n         ' \
-                  'See file PNR_WARNINGS for details.\n'
-        with io.open("PNR_WARNINGS", "w", newline=eol) as f:
-            for warning in pnr_warnings:
-                f.write(warning + "\n")
-
-    if arguments["new_pn_only"]:
-        print "Creating file NEW_PARTS, containing only new, unique parts...",
-        with io.open("NEW_PARTS", "w", newline=eol) as f:
-            f.write("NOTE: This file lists only the new, unique parts on this ECO. Duplicate and previously-released\n"
-                    "parts are not included.  Nesting is preserved (ex. 065s are indented under the first 139 they\n"
-                    "are affiliated with).  Be aware that you may not be seeing all members of a 139/142/etc., since\n"
-                    "previously-released parts, or parts already displayed under earlier 139s/etc., "
-                    "will be missing.\n\n")
-            for table in cid_table_order:
-                if cid_tables[table]:
-                    f.write(bdt_utils.pretty_table(cid_tables[table], 3))
-                    f.write("\n\n")
+            diagnostics.warning("pnr-missing-summary",
+                                'WARNING: Your ECO contains CIs that need to be added to the PN Reserve Log.\n'
+                                '         See file PNR_WARNINGS for details.\n',
+                                args={"cis": len(missing_from_pnr_warnings_issued)})
+    diagnostics.flush()
+
+    # render every file first, then write them all in one go (in parallel, or into a single archive)
+    outputs = []
+    # a --rows selection may cover part of a media block, so it's only validated
+    if not arguments["export_only"] and not arguments["rows"]:
+        outputs += cid_output.render_outputs(arguments, cid_tables, cid_table_order, pnr_warnings, cid_texts)
+    if arguments["export"]:
+        outputs.append(cid_export.render_export(arguments["export"], ci_records, diagnostics, arguments["eco_file"]))
+    if arguments["suggest_revs"]:
+        suggestions = cid_suggest.suggest_revs(ci_records, pnr_list, select_rev_alphabet(arguments))
+        outputs.append(cid_suggest.render_suggestions(suggestions))
+
+    if arguments["bundle"]:
+        output_names = [cid_output.write_bundle(outputs, eol, arguments["bundle"])]
     else:
-        # Combine all CONTENTS_IDs into one document.  Can be combined with -m and/or -s.
-        if arguments["print_to_one"]:
-            print "Creating file CONTENTS_ID.all...\n",
-            with io.open("CONTENTS_ID.all", "w", newline=eol) as f:
-                for table in cid_table_order:
-                    f.write(bdt_utils.pretty_table(cid_tables[table], 3))
-                    f.write("\n\n")
-
-        # if only -o was set, don't print to many.
-        if not arguments["print_to_one"] and not arguments["print_to_many"]:
-            arguments["print_to_many"] = True
-
-        if arguments["print_to_many"]:
-            for table in cid_table_order:
-                # write_single_cid_file outputs everything after the media type line to a CONTENTS_ID.<media type> file.
-                write_single_cid_file(bdt_utils.pretty_table(cid_tables[table], 3), eol)
+        output_names = cid_output.write_outputs(outputs, eol)
+
+    cid_cache.save_row_cache(row_cache)
+    cid_cache.save_manifest(cache_key, output_names, diagnostics=diagnostics.records)
+
+    if arguments["update_pnr"]:
+        if diagnostics.has_errors():
+            diagnostics.error("pnr-update-refused",
+                              "\nPNR ERROR: ECO has errors, so its CIs were not added to the PN Reserve Log.")
+            diagnostics.flush()
+            sys.exit(1)
+        pnr_update.update_pnr(pnr_update.new_cis(ci_records, pnr_list), pnr_list, pnr_fingerprint, pnr_warnings,
+                              pnr_dupe_pn_list, arguments["pnr_snapshot"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,216 @@
+"""
+Output cache for cid.py.
+
+Each run that writes CONTENTS_ID files records a manifest next to those files.  The manifest holds a key built
+from the ECO form's contents, the command line flags that affect output and (for -p runs) a fingerprint of the
+PN Reserve Log, plus a checksum for every file the run wrote and the errors, warnings and info messages it
+recorded.  If a later run produces the same key and every recorded output is still intact, cid.py can skip the
+run entirely, showing the recorded messages again instead.
+
+When the ECO form has changed, per-row validation results from the previous run are kept alongside the manifest,
+so only the rows that changed (and the rows that depend on them) need to be validated again.  Like the manifest,
+the row cache is plain JSON: both sit in folders other users can write to, so neither may hold anything that runs
+code when it's read.
+"""
+
+import hashlib
+import io
+import json
+import os
+
+from cid_classes import Diagnostic, RowResult, RowValidationCache
+
+MANIFEST_NAME = ".cid_manifest"
+ROW_CACHE_NAME = ".cid_rows"
+
+# argparse destinations that change what cid.py writes.  Anything not listed here is ignored when building a key.
+OUTPUT_ARGS = ["all_parts", "invalid_revs", "new_pn_only", "pnr_verify", "e", "print_to_one", "print_to_many",
+               "bundle", "export", "export_only", "suggest_revs", "pnr_url", "media", "rows"]
+
+HASH_BLOCK_SIZE = 1 << 16
+
+
+def file_digest(path):
+    """
+    Return the SHA-1 hex digest of a file's contents, or None if the file can't be read.
+
+    :param path: path of the file to hash
+    :return: hex digest string, or None
+    """
+    sha = hashlib.sha1()
+
+    try:
+        with io.open(path, "rb") as f:
+            block = f.read(HASH_BLOCK_SIZE)
+            while block:
+                sha.update(block)
+                block = f.read(HASH_BLOCK_SIZE)
+    except (IOError, OSError):
+        return None
+
+    return sha.hexdigest()
+
+
+def pnr_fingerprint(pnr_path):
+    """
+    Return a cheap fingerprint of the PN Reserve Log. The log lives on a network share and is large, so
+    size and modification time are used instead of a full content hash.
+
+    :param pnr_path: path of the PN Reserve Log
+    :return: a "size:mtime" string, or None if the log can't be found
+    """
+    try:
+        stat = os.stat(pnr_path)
+    except OSError:
+        return None
+
+    return "{}:{}".format(stat.st_size, int(stat.st_mtime))
+
+
+def cache_key(arguments, version, pnr_path=None):
+    """
+    Build the cache key for a run.
+
+    :param arguments: argparse command line arguments, formatted into a hash
+    :param version: version string of the script, so a new release never reuses old outputs
+    :param pnr_path: path of the PN Reserve Log, only used if -p/--pnr-verify was set
+    :return: hex digest string, or None if one of the inputs can't be read (in which case nothing is cached)
+    """
+    eco_digest = file_digest(arguments["eco_file"])
+    if not eco_digest:
+        return None
+
+    key_data = {"version": version, "eco": eco_digest}
+
+    for arg_name in OUTPUT_ARGS:
+        key_data[arg_name] = arguments.get(arg_name)
+
+    if arguments.get("pnr_verify"):
+        key_data["pnr"] = pnr_fingerprint(pnr_path)
+        if not key_data["pnr"]:
+            return None
+
+    return hashlib.sha1(json.dumps(key_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_manifest(output_dir="."):
+    """
+    :param output_dir: directory the outputs (and the manifest) were written to
+    :return: the manifest as a dict, or None if there isn't a readable manifest
+    """
+    try:
+        with io.open(os.path.join(output_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def is_current(key, output_dir="."):
+    """
+    :param key: cache key of the current run, from cache_key()
+    :param output_dir: directory the outputs (and the manifest) were written to
+    :return: True if the manifest matches key and every output it lists is unchanged on disk
+    """
+    if not key:
+        return False
+
+    manifest = load_manifest(output_dir)
+    if not manifest or manifest.get("key") != key or not manifest.get("outputs"):
+        return False
+
+    for file_name, digest in manifest["outputs"].items():
+        if file_digest(os.path.join(output_dir, file_name)) != digest:
+            return False
+
+    return True
+
+
+def save_manifest(key, output_names, output_dir=".", diagnostics=None):
+    """
+    Record the outputs of a completed run.
+
+    :param key: cache key of the current run, from cache_key()
+    :param output_names: names of every file the run wrote
+    :param output_dir: directory the outputs (and the manifest) were written to
+    :param diagnostics: the Diagnostic objects the run recorded, so a later run skipped as current can show them
+    """
+    if not key:
+        return
+
+    outputs = {}
+    for file_name in output_names:
+        outputs[file_name] = file_digest(os.path.join(output_dir, file_name))
+
+    records = []
+    for record in diagnostics or []:
+        record_dict = record.as_dict()
+        record_dict["echo"] = record.echo
+        records.append(record_dict)
+
+    manifest_text = json.dumps({"key": key, "outputs": outputs, "diagnostics": records}, sort_keys=True, indent=1)
+
+    with io.open(os.path.join(output_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        f.write(unicode(manifest_text))
+
+
+def manifest_diagnostics(output_dir="."):
+    """
+    :param output_dir: directory the outputs (and the manifest) were written to
+    :return: a list of the Diagnostic objects recorded by the run that wrote the manifest
+    """
+    records = []
+    for record_dict in (load_manifest(output_dir) or {}).get("diagnostics", []):
+        record = Diagnostic(record_dict["severity"], record_dict["code"], record_dict["message"],
+                            record_dict["row"], record_dict["cell"], record_dict["args"])
+        record.echo = record_dict["echo"]
+        records.append(record)
+
+    return records
+
+
+def clear_manifest(output_dir="."):
+    """
+    Remove the manifest, so a run that fails part way can't be mistaken for a current one.
+
+    :param output_dir: directory the outputs (and the manifest) were written to
+    """
+    try:
+        os.remove(os.path.join(output_dir, MANIFEST_NAME))
+    except OSError:
+        pass
+
+
+def load_row_cache(output_dir="."):
+    """
+    :param output_dir: directory the outputs (and the row cache) were written to
+    :return: the RowValidationCache saved by the previous run, or None if there isn't a usable one
+    """
+    try:
+        with io.open(os.path.join(output_dir, ROW_CACHE_NAME), "r", encoding="utf-8") as f:
+            cache_dict = json.load(f)
+
+        if cache_dict["format"] != RowValidationCache.FORMAT:
+            return None
+
+        row_cache = RowValidationCache()
+        row_cache.context = cache_dict["context"]
+        for key, result_dict in cache_dict["results"].items():
+            row_cache.results[key] = RowResult.from_dict(result_dict)
+    except Exception:
+        # a missing, truncated or outdated cache file just means this run validates every row
+        return None
+
+    return row_cache
+
+
+def save_row_cache(row_cache, output_dir="."):
+    """
+    :param row_cache: the RowValidationCache used by the current run
+    :param output_dir: directory the outputs (and the row cache) were written to
+    """
+    results = dict((key, result.as_dict()) for key, result in row_cache.results.items())
+    cache_text = json.dumps({"format": row_cache.format, "context": row_cache.context, "results": results},
+                            sort_keys=True, default=unicode)
+
+    with io.open(os.path.join(output_dir, ROW_CACHE_NAME), "w", encoding="utf-8") as f:
+        f.write(unicode(cache_text))
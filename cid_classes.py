@@ -1,23 +1,77 @@
 from functools import total_ordering
+import bisect
+import hashlib
+import json
 import string
 import re
+import time
 
-# The chars in VALID_REV_CHARS are all the valid options for positions in the rev
-# IMPORTANT:  if the "-i" flag is used, VALID_REV_CHARS is overwritten with val of VALID_AND_INVALID_REV_CHARS
+# The chars in VALID_REV_CHARS are all the valid options for positions in the rev, in rev order
 VALID_REV_CHARS = "-123456789ABCDEFGHJKLMNPRTUVWY"
 VALID_AND_INVALID_REV_CHARS = "-123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 INVALID_REV_CHARS = "IOQSXZ"
 
 
-def is_valid_rev(rev_text, mode=1):
+class RevAlphabet(object):
+    def __init__(self, name, chars, invalid_chars=INVALID_REV_CHARS):
+        """
+        The characters Rev objects may be built from, in rev order.  Lookup tables are built once, so comparing
+        revs and finding the next rev never scan the alphabet.
+
+        :param name: short name for the alphabet, used in messages and cache keys
+        :param chars: every char a rev may contain, in rev order
+        :param invalid_chars: chars that are never valid per the CM standards, even if they're in chars
+        """
+        self.name = name
+        self.chars = chars
+
+        # char -> position in rev order
+        self.ordinals = dict((char, ordinal) for ordinal, char in enumerate(chars))
+
+        self.invalid = frozenset(invalid_chars)
+
+        # char -> the first char after it that's valid per the CM standards, or None if there isn't one
+        self.successors = {}
+        for ordinal, char in enumerate(chars):
+            following = [c for c in chars[ordinal + 1:] if c not in self.invalid]
+            self.successors[char] = following[0] if following else None
+
+        # rev name -> name of the rev after it, filled in by Rev.next_rev as revs are advanced
+        self.next_revs = {}
+
+    def order_key(self, rev_text):
+        """
+        Revs are ordered dash first, then numeric (redline) revs, then lettered revs.  Lettered revs are ordered
+        by number of letters (the rev after Y is AA, so Y < AA, and AY < BA), then by letters, then by numeric
+        suffix (B1 is greater than B, and less than C).
+
+        :param rev_text: text of a rev made of this alphabet's chars
+        :return: a tuple that sorts the same way as the rev
+        """
+        letter_count = len(rev_text) - len(rev_text.lstrip(string.ascii_letters))
+
+        return (letter_count,
+                tuple(self.ordinals.get(char, -1) for char in rev_text[:letter_count]),
+                tuple(self.ordinals.get(char, -1) for char in rev_text[letter_count:]))
+
+
+# Revs must be valid per the CM standards
+STRICT_REV_ALPHABET = RevAlphabet("strict", VALID_REV_CHARS)
+
+# Revs may contain invalid chars, used when the -i/--invalid-revs argument is present
+PERMISSIVE_REV_ALPHABET = RevAlphabet("permissive", VALID_AND_INVALID_REV_CHARS)
+
+
+def is_valid_rev(rev_text, mode=1, alphabet=STRICT_REV_ALPHABET):
     """
     :param rev_text: text of the rev being checked for validity
-    :param mode:  mode 2 checks that revs contain only chars in VALID_REV_CHARS, while
+    :param mode:  mode 2 checks that revs contain only chars in the alphabet, while
     default mode 1 checks that revs contain only chars NOT in INVALID_REV_CHARS.  The
-    reason for the two modes is that VALID_REV_CHARS is reset if the -i/--invalid-revs
+    reason for the two modes is that the permissive alphabet is used if the -i/--invalid-revs
     argument is present... if it's set we want to allow the Rev object to be created,
     but still need to be able to detect that the Rev is invalid per company standards,
     so we can issue a warning.
+    :param alphabet: RevAlphabet whose chars mode 2 accepts
     :return: True or False, depending on whether the selected mode flags the rev as valid
     """
 
@@ -34,10 +88,10 @@ def is_valid_rev(rev_text, mode=1):
 
     for char in rev_text:
 
-        if char in INVALID_REV_CHARS and mode == 1:
+        if char in alphabet.invalid and mode == 1:
             return False
 
-        if not char in VALID_REV_CHARS and mode == 2:
+        if not char in alphabet.ordinals and mode == 2:
             return False
 
         # the dash character is only valid if it's the only character in the rev
@@ -56,19 +110,33 @@ def is_valid_rev(rev_text, mode=1):
 
 @total_ordering
 class Rev(object):
-    def __init__(self, name, eco=None):
+    def __init__(self, name, eco=None, alphabet=STRICT_REV_ALPHABET, row=None):
         self.name = str(name).strip()
         self.eco = str(eco)
+        self.alphabet = alphabet
 
-        # mode 2 checks that revs contain only chars in VALID_REV_CHARS, allowing this
+        # the row of the PN Reserve Log (or other source) this rev was read from, if any
+        self.row = row
+
+        # mode 2 checks that revs contain only chars in the alphabet, allowing this
         # Rev object to be created if the Rev is invalid per the CM standards but the
-        # -i/--invalid-rev argument has been used.  We can't use mode 1 (checking that
+        # permissive alphabet is in use.  We can't use mode 1 (checking that
         # revs contain only chars NOT in INVALID_REV_CHARS, because that list isn't
-        # affected by the -i/--invalid-rev argument, i.e. Rev creation would fail on an
-        # invalid rev even if that argument were set.
-        if not is_valid_rev(self.name, mode=2):
+        # affected by the alphabet, i.e. Rev creation would fail on an
+        # invalid rev even if the -i/--invalid-rev argument were set.
+        if not is_valid_rev(self.name, mode=2, alphabet=alphabet):
             raise ValueError(self.name + " is not a valid rev!")
 
+        # most revs are only built to read their name or next rev, so the sort key is worked out on first use
+        self._order_key = None
+
+    @property
+    def order_key(self):
+        if self._order_key is None:
+            self._order_key = self.alphabet.order_key(self.name)
+
+        return self._order_key
+
     def __eq__(self, other):
         return self.name == other.name
 
@@ -78,53 +146,45 @@ class Rev(object):
         if self == other:
             return False
 
-        # catches an oddity of revisions, i.e. that the rev after Y is AA, so Y < AA, and AY < BA
-        if self.name.isalpha() and other.name.isalpha() and len(self.name) != len(other.name):
-            return len(self.name) > len(other.name)
+        # comparisons are the hot path, so the cached keys are read directly, skipping the property when they're set
+        own_key = self._order_key or self.order_key
+        if other.alphabet is self.alphabet:
+            return own_key > (other._order_key or other.order_key)
 
-        for position in range(len(self.name)):
-            # if we've moved past the first position and only one operand has a value, we know that the operand
-            # of greater length is the larger one.  Ex. B1 is greater than B, and C is not greater than CA.
-            if len(other.name) <= position < len(self.name):
-                return True
-            if len(self.name) <= position:
-                if len(other.name) > position:
-                    return False
+        return own_key > self.alphabet.order_key(other.name)
 
-                # if the first letters match, skip to the next letter
-            if self.name[position] == other.name[position]:
-                continue
+    def _advance(self, prefix, char):
+        """
+        :return: the name made of prefix plus the first valid char after char.  The rev after Y is AA.
+        """
+        successor = self.alphabet.successors.get(char)
 
-            # if the current letters don't match, the one with the greater index number is greater
-            return VALID_REV_CHARS.find(self.name[position]) > VALID_REV_CHARS.find(other.name[position])
+        # we never want to suggest an invalid next_rev, even if we're in -i/--invalid-revs mode
+        if successor is None:
+            return prefix + "AA"
 
-        return False
+        return prefix + successor
 
     @property
     def next_rev(self):
+        # an ECO lists the same few revs over and over, so each one is only worked out once per alphabet
+        next_name = self.alphabet.next_revs.get(self.name)
+        if next_name is None:
 
-        if VALID_REV_CHARS.find(self.name) in range(0, 10):
-            return Rev("A")
+            # the dash and numeric (redline) revs are followed by the first lettered rev
+            if self.name == "-" or self.name.isdigit():
+                next_name = "A"
 
-        if VALID_REV_CHARS.find(self.name[-1]) in range(0, 10):
-            new_name = self.name[:-2] + VALID_REV_CHARS[VALID_REV_CHARS.find(self.name[-2:-1])+1]
+            # a lettered rev with a numeric suffix is followed by the next letter, ex. B1 -> C
+            elif self.name[-1].isdigit():
+                next_name = self._advance(self.name[:-2], self.name[-2])
 
-            # we never want to suggest an invalid next_rev, even if we're in -i/--invalid-revs mode
-            if not is_valid_rev(new_name):
-                return Rev(new_name).next_rev
             else:
-                return Rev(new_name)
+                next_name = self._advance(self.name[:-1], self.name[-1])
 
-        if VALID_REV_CHARS.find(self.name[-1]) < 29:
-            new_name = self.name[0:-1] + VALID_REV_CHARS[VALID_REV_CHARS.find(self.name[-1]) + 1]
-            if not is_valid_rev(new_name):
-                return Rev(new_name).next_rev
-            else:
-                return Rev(new_name)
+            self.alphabet.next_revs[self.name] = next_name
 
-        if self.name[-1] == "Y":
-            new_name = self.name[0:-1] + "AA"
-            return Rev(new_name)
+        return Rev(next_name, alphabet=self.alphabet)
 
 
 # a compiled regular expression for the RAST part number format
@@ -141,61 +201,729 @@ def is_valid_part(pn_text):
     return True
 
 
+def eco_order_key(eco):
+    """
+    :param eco: an ECO number, as text
+    :return: a key that sorts ECOs in the order they were issued, or None if eco isn't an ECO number
+    """
+    eco = str(eco).strip()
+    if not eco.isdigit():
+        return None
+
+    return int(eco)
+
+
 class Part(object):
-    def __init__(self, number, revs=None):
+    def __init__(self, number, revs=None, alphabet=STRICT_REV_ALPHABET):
         self.number = str(number)
+        self.alphabet = alphabet
+        self.revs = {}
 
-        if not revs:
-            self.revs = {}
-        else:
-            self.revs = dict(revs)
+        # every rev of the part in rev order, with a parallel list of their order keys to bisect on
+        self.history = []
+        self._history_keys = []
 
-        self.max_rev = None
+        # the revs released on an ECO number, in ECO order, and for each the greatest rev released on that ECO
+        # or any earlier one
+        self._eco_keys = []
+        self._eco_revs = []
+        self._latest_revs = []
 
         if not is_valid_part(number):
             raise ValueError(str(number).strip() + " is not a valid part number!")
 
+        if revs:
+            for rev_text, rev in dict(revs).items():
+                self._insert(rev_text, rev)
+
+    @property
+    def max_rev(self):
+        if not self.history:
+            return None
+
+        return self.history[-1]
+
     def has_rev(self, rev_text):
         # returns True or False, based on whether or not rev_text is one of self.rev's keys
         return rev_text in self.revs
 
-    def add_rev(self, rev_text, eco=None):
+    def add_rev(self, rev_text, eco=None, row=None):
         if self.has_rev(rev_text):
             return False
 
-        self.revs[rev_text] = Rev(rev_text, eco)
-
-        if not self.max_rev or (self.revs[rev_text] > self.max_rev):
-            self.max_rev = Rev(rev_text)
+        self._insert(rev_text, Rev(rev_text, eco, self.alphabet, row))
 
         return True
 
+    def _insert(self, rev_text, rev):
+        self.revs[rev_text] = rev
+
+        position = bisect.bisect_right(self._history_keys, rev.order_key)
+        self._history_keys.insert(position, rev.order_key)
+        self.history.insert(position, rev)
+
+        eco_key = eco_order_key(rev.eco)
+        if eco_key is None:
+            return
+
+        position = bisect.bisect_right(self._eco_keys, eco_key)
+        self._eco_keys.insert(position, eco_key)
+        self._eco_revs.insert(position, rev)
+        self._latest_revs.insert(position, None)
+
+        # the log is normally read in ECO order, so this usually only touches the new entry
+        latest = self._latest_revs[position - 1] if position else None
+        for index in range(position, len(self._eco_revs)):
+            if latest is None or self._eco_revs[index] > latest:
+                latest = self._eco_revs[index]
+            if index > position and self._latest_revs[index] is latest:
+                break
+            self._latest_revs[index] = latest
+
+    def _order_key(self, rev_text):
+        return self.alphabet.order_key(str(rev_text).strip())
+
+    def rev_before(self, rev_text):
+        """
+        :return: the greatest rev of the part earlier than rev_text, or None if there isn't one
+        """
+        position = bisect.bisect_left(self._history_keys, self._order_key(rev_text))
+        return self.history[position - 1] if position else None
+
+    def rev_after(self, rev_text):
+        """
+        :return: the least rev of the part later than rev_text, or None if there isn't one
+        """
+        position = bisect.bisect_right(self._history_keys, self._order_key(rev_text))
+        return self.history[position] if position < len(self.history) else None
+
+    def revs_after(self, rev_text):
+        """
+        :return: a list of the part's revs later than rev_text, in rev order
+        """
+        return self.history[bisect.bisect_right(self._history_keys, self._order_key(rev_text)):]
+
+    def revs_between(self, first_rev_text, last_rev_text):
+        """
+        :return: a list of the part's revs from first_rev_text to last_rev_text (inclusive), in rev order
+        """
+        return self.history[bisect.bisect_left(self._history_keys, self._order_key(first_rev_text)):
+                            bisect.bisect_right(self._history_keys, self._order_key(last_rev_text))]
+
+    def latest_rev_as_of(self, eco):
+        """
+        :param eco: an ECO number
+        :return: the greatest rev of the part released on eco or any earlier ECO, or None if there isn't one.
+                 Revs whose ECO isn't a number are never counted.
+        """
+        eco_key = eco_order_key(eco)
+        if eco_key is None:
+            return None
+
+        position = bisect.bisect_right(self._eco_keys, eco_key)
+        return self._latest_revs[position - 1] if position else None
+
 
 class ListOfParts(object):
-    def __init__(self, parts=None):
+    def __init__(self, parts=None, alphabet=STRICT_REV_ALPHABET):
+        """
+        :param parts: dict of Part objects, keyed by P/N
+        :param alphabet: RevAlphabet the revs of every part are built with
+        """
+        self.alphabet = alphabet
+
         if not parts:
             self.parts = {}
         else:
             self.parts = parts
 
-    def add_part(self, pn, rev, eco=None):
-        if not pn in self.parts.keys():
-            self.parts[pn] = Part(pn)
+        # ECO number -> set of (P/N, rev) tuples the list has as released on that ECO
+        self.eco_index = {}
+        for pn, part in self.parts.items():
+            for rev in part.revs.values():
+                self._index_eco(pn, rev)
+
+    def _index_eco(self, pn, rev):
+        # Rev stores a missing ECO as the string "None"; those CIs aren't on any ECO
+        if rev.eco != "None":
+            self.eco_index.setdefault(rev.eco, set()).add((pn, rev.name))
 
-        return self.parts[pn].add_rev(rev, eco)
+    def add_part(self, pn, rev, eco=None, row=None):
+        if not pn in self.parts:
+            self.parts[pn] = Part(pn, alphabet=self.alphabet)
+
+        if not self.parts[pn].add_rev(rev, eco, row):
+            return False
+
+        self._index_eco(pn, self.parts[pn].revs[rev])
+        return True
 
     def has_part(self, pn, rev):
-        if not pn in self.parts.keys():
+        if not pn in self.parts:
             return False
 
         return self.parts[pn].has_rev(rev)
 
+    def eco(self, pn, rev):
+        """
+        :return: the ECO pn at rev is released on, or None if it isn't in the list
+        """
+        if not self.has_part(pn, rev):
+            return None
+
+        return self.parts[pn].revs[rev].eco
+
+    def parts_for_eco(self, eco):
+        """
+        :param eco: an ECO number
+        :return: a list of (P/N, rev) tuples, one per CI released on eco, sorted by P/N then rev
+        """
+        return sorted(self.eco_index.get(str(eco).strip(), ()),
+                      key=lambda ci: (ci[0], self.alphabet.order_key(ci[1])))
+
+    def iter_cis(self):
+        """
+        :return: a generator of (P/N, rev, ECO) tuples, one per CI in the list, in no particular order
+        """
+        for pn, part in self.parts.items():
+            for rev in part.revs.values():
+                yield pn, rev.name, rev.eco
+
+    def lookup(self, cis):
+        """
+        :param cis: iterable of (P/N, rev) tuples
+        :return: dict of the ECO each CI is released on (None if it isn't in the list), keyed by (P/N, rev)
+        """
+        return dict(((pn, rev), self.eco(pn, rev)) for pn, rev in cis)
+
+    def prefetch(self, cis):
+        """
+        Everything is already in memory, so there's nothing to fetch.
+        """
+
     def next_rev(self, pn):
         if not is_valid_part(pn):
             return None
 
         if not pn in self.parts:
-            return Rev("-")
+            return Rev("-", alphabet=self.alphabet)
 
         return self.parts[pn].max_rev.next_rev
 
+    def rev_before(self, pn, rev):
+        """
+        :return: the greatest rev of pn in the list earlier than rev, or None if there isn't one
+        """
+        if not pn in self.parts:
+            return None
+
+        return self.parts[pn].rev_before(rev)
+
+    def latest_rev_as_of(self, pn, eco):
+        """
+        :return: the greatest rev of pn released on eco or any earlier ECO, or None if there isn't one
+        """
+        if not pn in self.parts:
+            return None
+
+        return self.parts[pn].latest_rev_as_of(eco)
+
+
+class Diagnostic(object):
+    def __init__(self, severity, code, message, row=None, cell=None, args=None):
+        """
+        :param severity: "ERROR", "WARNING" or "INFO"
+        :param code: short, stable identifier for the kind of problem, ex. "invalid-rev"
+        :param message: the text shown to the user
+        :param row: spreadsheet row the message refers to, if any
+        :param cell: spreadsheet cell the message refers to (ex. "C12"), if any
+        :param args: dict of the values that went into the message
+        """
+        self.severity = severity
+        self.code = code
+        self.message = message
+        self.row = row
+        self.cell = cell
+        self.args = dict(args) if args else {}
+        self.echo = None
+
+    def as_dict(self):
+        return {"severity": self.severity, "code": self.code, "message": self.message,
+                "row": self.row, "cell": self.cell, "args": self.args}
+
+
+class DiagnosticLog(object):
+    # once this many messages with the same code have been printed in one flush, the rest are only counted
+    REPEAT_LIMIT = 3
+
+    # rows listed in the count line for collapsed messages
+    REPEAT_ROWS_SHOWN = 10
+
+    def __init__(self, echo=True, buffered=False, flush_interval=None):
+        """
+        :param echo: if True, each message is printed to the console
+        :param buffered: if True, messages are held until flush() and then printed in row order, with repeats of
+                         the same warning or info message collapsed into a count.  Otherwise each message is
+                         printed as it is added.
+        :param flush_interval: if buffered, also flush whenever a message is added this many seconds or more
+                               after the last flush
+        """
+        self.records = []
+        self.echo = echo
+        self.buffered = buffered
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush = time.time()
+
+    def add(self, severity, code, message, row=None, cell=None, args=None, echo=None):
+        record = Diagnostic(severity, code, message, row, cell, args)
+
+        # echo can be overridden per message, ex. for warnings that only go to the PNR_WARNINGS file
+        record.echo = echo
+        self.extend([record])
+
+        return record
+
+    def error(self, code, message, **kwargs):
+        return self.add("ERROR", code, message, **kwargs)
+
+    def warning(self, code, message, **kwargs):
+        return self.add("WARNING", code, message, **kwargs)
+
+    def info(self, code, message, **kwargs):
+        return self.add("INFO", code, message, **kwargs)
+
+    def extend(self, records):
+        """
+        Add Diagnostic objects recorded elsewhere (ex. replayed from a RowValidationCache), echoing them as usual.
+        """
+        for record in records:
+            self.records.append(record)
+            if self.echo if record.echo is None else record.echo:
+                self.pending.append(record)
+
+        if not self.buffered or \
+                (self.flush_interval is not None and time.time() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Print every message added since the last flush.
+        """
+        self.last_flush = time.time()
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, []
+
+        if not self.buffered:
+            for record in pending:
+                print record.message
+            return
+
+        # messages without a row (ex. sheet-level errors) stay after whichever row was reported before them
+        keyed = []
+        last_row = 0
+        for index, record in enumerate(pending):
+            if record.row is not None:
+                last_row = record.row
+            keyed.append((last_row if record.row is None else record.row, index, record))
+        keyed.sort()
+
+        printed = {}
+        collapsed = {}
+        collapsed_order = []
+        for _, _, record in keyed:
+            key = record.severity, record.code
+            if record.severity == "ERROR" or printed.get(key, 0) < self.REPEAT_LIMIT:
+                printed[key] = printed.get(key, 0) + 1
+                print record.message
+            else:
+                if key not in collapsed:
+                    collapsed[key] = []
+                    collapsed_order.append(key)
+                collapsed[key].append(record.row)
+
+        for severity, code in collapsed_order:
+            rows = [str(row) for row in collapsed[(severity, code)] if row is not None]
+            line = "{}: {} more '{}' messages like the above".format(severity, len(collapsed[(severity, code)]),
+                                                                       code)
+            if rows:
+                line += ", on CI_Sheet rows {}".format(", ".join(rows[:self.REPEAT_ROWS_SHOWN]))
+                if len(rows) > self.REPEAT_ROWS_SHOWN:
+                    line += ", ..."
+            print line + "."
+
+    def has_errors(self):
+        return any(record.severity == "ERROR" for record in self.records)
+
+    def query(self, severity=None, code=None, row=None):
+        """
+        :return: the recorded Diagnostic objects matching every criterion given, in the order they were added
+        """
+        return [record for record in self.records
+                if (severity is None or record.severity == severity) and (code is None or record.code == code) and
+                (row is None or record.row == row)]
+
+    def counts(self):
+        """
+        :return: dict of the number of messages recorded, keyed by (severity, code)
+        """
+        counts = {}
+        for record in self.records:
+            counts[(record.severity, record.code)] = counts.get((record.severity, record.code), 0) + 1
+
+        return counts
+
+
+class RowResult(object):
+    # a row number in a message: "row 12", or a cell reference like "C12" (but not a rev like 'C12' or Rev. C12)
+    ROW_NUMBER = re.compile(r"(?<!')(?<!Rev\. )(?<!ECO )\b(row |[A-Z]{1,3})(\d+)\b")
+
+    def __init__(self, ci_records, diagnostics, pnr_warnings, state, row=None, used_row=None):
+        """
+        Everything validating one CI_Sheet row produced, so the row can be replayed instead of re-validated.
+
+        :param ci_records: structured CI records the row added
+        :param diagnostics: Diagnostic objects the row added
+        :param pnr_warnings: PNR_WARNINGS lines the row added
+        :param state: cross-row state after the row, as a (current media type, skip media, row the P/N+rev was
+                      last used on, P/N+rev missing from PNR reported, released P/N+rev ECO dict) tuple
+        :param row: CI_Sheet row the results were produced on
+        :param used_row: earlier row the row's P/N+rev was last used on, if any
+        """
+        self.ci_records = ci_records
+        self.diagnostics = diagnostics
+        self.pnr_warnings = pnr_warnings
+        self.state = state
+        self.row = row
+        self.used_row = used_row
+
+    def moved_to(self, row):
+        """
+        :param row: CI_Sheet row the same contents (and cross-row state) now sit on
+        :return: the results renumbered for that row.  Rows inserted or deleted above a row move it, and the
+                 earlier row it was last used on, by the same number of rows.
+        """
+        if self.row is None or row == self.row:
+            return self
+
+        offset = row - self.row
+        moved_rows = set(number for number in (self.row, self.used_row) if number is not None)
+
+        def move_number(number):
+            if number is not None and int(number) in moved_rows:
+                return type(number)(int(number) + offset)
+            return number
+
+        def move_text(text):
+            return self.ROW_NUMBER.sub(lambda match: match.group(1) + str(move_number(int(match.group(2)))), text)
+
+        def move_cell(cell):
+            if not cell:
+                return cell
+            column = cell.rstrip(string.digits)
+            return column + str(move_number(int(cell[len(column):])))
+
+        ci_records = []
+        for ci_record in self.ci_records:
+            ci_record = dict(ci_record)
+            ci_record["row"] = move_number(ci_record.get("row"))
+            ci_record["rev_cell"] = move_cell(ci_record.get("rev_cell"))
+            ci_records.append(ci_record)
+
+        diagnostics = []
+        for record in self.diagnostics:
+            args = dict((name, move_number(value) if name.endswith("_row") else value)
+                        for name, value in record.args.items())
+            moved = Diagnostic(record.severity, record.code, move_text(record.message), move_number(record.row),
+                               move_cell(record.cell), args)
+            moved.echo = record.echo
+            diagnostics.append(moved)
+
+        current_media, skip_media, row_used, row_missing, row_old = self.state
+
+        return RowResult(ci_records, diagnostics, [move_text(line) for line in self.pnr_warnings],
+                         (current_media, skip_media, move_number(row_used), row_missing, row_old), row,
+                         move_number(self.used_row))
+
+    def as_dict(self):
+        diagnostics = []
+        for record in self.diagnostics:
+            record_dict = record.as_dict()
+            record_dict["echo"] = record.echo
+            diagnostics.append(record_dict)
+
+        return {"ci_records": self.ci_records, "diagnostics": diagnostics, "pnr_warnings": self.pnr_warnings,
+                "state": list(self.state), "row": self.row, "used_row": self.used_row}
+
+    @staticmethod
+    def from_dict(result_dict):
+        """
+        :param result_dict: a RowResult's as_dict(), as read back from JSON
+        """
+        diagnostics = []
+        for record_dict in result_dict["diagnostics"]:
+            record = Diagnostic(record_dict["severity"], record_dict["code"], record_dict["message"],
+                                record_dict["row"], record_dict["cell"], record_dict["args"])
+            record.echo = record_dict["echo"]
+            diagnostics.append(record)
+
+        return RowResult(result_dict["ci_records"], diagnostics, result_dict["pnr_warnings"],
+                         tuple(result_dict["state"]), result_dict["row"], result_dict["used_row"])
+
+
+def key_digest(value):
+    """
+    :param value: a row key or pass context: nested tuples of cell values, strings and numbers
+    :return: a digest of value that's the same whether its strings are str or unicode, so it survives a round
+             trip through JSON
+    """
+    return hashlib.sha1(json.dumps(value, default=repr, sort_keys=True)).hexdigest()
+
+
+class RowValidationCache(object):
+    # bump whenever RowResult changes, so caches saved by older versions are ignored rather than misread
+    FORMAT = 5
+
+    def __init__(self):
+        """
+        Per-row validation results, keyed by a fingerprint of the row's cells plus the cross-row state it read.
+        The row's number isn't part of the key, so rows moved by an inserted or deleted row are still found.
+        Only results looked up or stored during the latest pass are kept, so the cache never outgrows the sheet.
+        """
+        self.format = self.FORMAT
+        self.context = None
+        self.results = {}
+        self.next_results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def start_pass(self, context):
+        """
+        :param context: everything outside the sheet's rows that validation depends on (flags, PNR Log, etc.).
+                        If it differs from the previous pass's context, every cached result is discarded.
+        """
+        context = key_digest(context)
+        if context != self.context:
+            self.context = context
+            self.results = {}
+
+        self.next_results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        key = key_digest(key)
+        result = self.results.get(key)
+
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.next_results[key] = result
+
+        return result
+
+    def store(self, key, result):
+        self.next_results[key_digest(key)] = result
+
+    def end_pass(self, prune=True):
+        """
+        :param prune: drop the results the pass didn't use.  A pass over only part of the sheet should keep them,
+                      for the rows it didn't read.
+        """
+        if prune:
+            self.results = self.next_results
+        else:
+            self.results.update(self.next_results)
+        self.next_results = {}
+
+
+class CINode(object):
+    def __init__(self, index, record, parent, root):
+        """
+        :param index: position of this node in its CITree's pre-order node list
+        :param record: the CI record (dict) this node wraps
+        :param parent: the CINode this CI is nested under, or None for a top-level CI
+        :param root: the top-level CINode this CI is nested under (itself, for a top-level CI)
+        """
+        self.index = index
+        self.record = record
+        self.parent = parent
+        self.root = root if root else self
+        self.children = []
+
+        # pre-order index one past this node's last descendant, so its subtree is nodes[index:end]
+        self.end = index + 1
+
+    @property
+    def descendant_count(self):
+        return self.end - self.index - 1
+
+
+class CITree(object):
+    def __init__(self, records=None):
+        """
+        Parent/child hierarchy of the CIs on an ECO, built from the indent level of each CI's description.
+        A CI's parent is the nearest earlier CI in the same media set with a smaller indent level.
+
+        :param records: CI record dicts, in sheet order, each with at least "pn", "indent" and "media_set" keys
+        """
+        self.nodes = []
+        self.roots = []
+        self.by_pn = {}
+
+        open_nodes = []
+
+        for record in records or []:
+            # a new media set closes every open assembly
+            if open_nodes and open_nodes[0].record["media_set"] != record["media_set"]:
+                open_nodes = []
+
+            while open_nodes and open_nodes[-1].record["indent"] >= record["indent"]:
+                open_nodes.pop()
+
+            parent = open_nodes[-1] if open_nodes else None
+            node = CINode(len(self.nodes), record, parent, parent.root if parent else None)
+
+            if parent:
+                parent.children.append(node)
+            else:
+                self.roots.append(node)
+
+            self.nodes.append(node)
+            self.by_pn.setdefault(record["pn"], []).append(node)
+
+            # every open ancestor's subtree now extends through this node
+            for ancestor in open_nodes:
+                ancestor.end = node.end
+
+            open_nodes.append(node)
+
+    def find(self, pn):
+        """
+        :return: list of the nodes for every listing of P/N pn, in sheet order
+        """
+        return self.by_pn.get(pn, [])
+
+    def subtree(self, node):
+        """
+        :return: list of node and all its descendants, in sheet order
+        """
+        return self.nodes[node.index:node.end]
+
+    def is_ancestor(self, ancestor, node):
+        return ancestor.index < node.index < ancestor.end
+
+    def media_set_nodes(self, media_set):
+        return [node for node in self.nodes if node.record["media_set"] == media_set]
+
+    def assembly_counts(self):
+        """
+        :return: dict of {P/N + rev of each top-level CI: number of CIs nested under it}
+        """
+        return dict(("{} Rev. {}".format(root.record["pn"], root.record["rev"]), root.descendant_count)
+                    for root in self.roots)
+
+    def filter(self, predicate):
+        """
+        :param predicate: function taking a CINode and returning True for the nodes to keep
+        :return: list of the nodes that match, in sheet order
+        """
+        return [node for node in self.nodes if predicate(node)]
+
+    def render_table(self, nodes):
+        """
+        Render nodes as CONTENTS_ID table rows: each P/N + rev indented two spaces per indent level, with a
+        blank line before a top-level CI that follows indented ones, and a "media:set" header row before the
+        first CI of each media set.
+
+        :param nodes: list of CINodes, in sheet order
+        :return: a table represented by a list of lists, ready for bdt_utils.pretty_table()
+        """
+        table = []
+        previous = None
+
+        for node in nodes:
+            record = node.record
+
+            if not previous or previous.record["media_set"] != record["media_set"]:
+                table.append([record["media_type"] + ":" + record["media_set"], ""])
+                previous = None
+
+            pn_plus_rev = "  " * record["indent"] + "{} Rev. {}".format(record["pn"], record["rev"])
+
+            if previous and previous.record["indent"] > 0 and record["indent"] == 0:
+                pn_plus_rev = "\n" + pn_plus_rev
+
+            table.append([pn_plus_rev, record["description"]])
+            previous = node
+
+        return table
+
+
+def column_index(column_letters):
+    """
+    :param column_letters: spreadsheet column name, ex. "A" or "AB"
+    :return: 0-based position of the column, ex. 0 for "A" and 27 for "AB"
+    """
+    index = 0
+    for letter in column_letters.upper():
+        index = index * 26 + ord(letter) - ord("A") + 1
+
+    return index - 1
+
+
+class FormLayout(object):
+    def __init__(self, name, ad_col, cr_col, nr_col, eco_col, des_col, mt_col, iso_col):
+        """
+        Where each CI_Sheet column lives on one revision of the ECO form.  Column letters are kept for messages,
+        and converted once to 0-based indices so rows can be read by position.
+
+        :param name: short name for the layout, used in messages and cache keys
+        :param ad_col: "Affected Documentation" (P/N) column letter
+        :param cr_col: "Cur Rev" column letter
+        :param nr_col: "New Rev" column letter
+        :param eco_col: "ECO" column letter
+        :param des_col: "Description" column letter
+        :param mt_col: "Media" column letter
+        :param iso_col: "ISO Name" column letter
+        """
+        self.name = name
+
+        self.ad_col = ad_col
+        self.cr_col = cr_col
+        self.nr_col = nr_col
+        self.eco_col = eco_col
+        self.des_col = des_col
+        self.mt_col = mt_col
+        self.iso_col = iso_col
+
+        self.ad = column_index(ad_col)
+        self.cr = column_index(cr_col)
+        self.nr = column_index(nr_col)
+        self.eco = column_index(eco_col)
+        self.des = column_index(des_col)
+        self.mt = column_index(mt_col)
+        self.iso = column_index(iso_col)
+
+        # the columns validation looks at, in sheet order
+        self.indices = sorted([self.ad, self.cr, self.nr, self.eco, self.des, self.mt, self.iso])
+        self.width = self.indices[-1] + 1
+
+    @property
+    def key(self):
+        return self.name, tuple(self.indices)
+
+    def row_values(self, row):
+        """
+        :param row: tuple of openpyxl cells for one sheet row
+        :return: list of the row's cell values, padded with None out to the last column the layout uses
+        """
+        values = [cell.value for cell in row]
+
+        if len(values) < self.width:
+            values += [None] * (self.width - len(values))
+
+        return values
@@ -0,0 +1,250 @@
+"""
+Report what changed between two revisions of an ECO form, or between two versions of the PN Reserve Log.
+
+Both inputs are reduced to CI records, (P/N, rev, ECO, media sets) tuples, and sorted by P/N and rev order.  One
+merge pass over the two sorted lists then reports CIs added and removed, parts whose rev changed, CIs that moved
+between media sets and CIs whose ECO number changed, so even 100k-row logs take linear time once sorted.
+
+usage: cid_diff.py [-p] [-i] old new
+"""
+
+import argparse
+import itertools
+import sys
+
+from cid_classes import *
+import cid
+import pnr
+import pnr_snapshot
+
+VERSION_STRING = "CID diff v1.0"
+
+# kinds of change, in the order they're reported for each part
+ADDED = "ADDED"
+REMOVED = "REMOVED"
+REVISED = "REVISED"
+MOVED = "MOVED"
+ECO_CHANGED = "ECO"
+
+
+def eco_records(eco_file, alphabet=STRICT_REV_ALPHABET):
+    """
+    Extract the CIs listed on an ECO form.
+
+    :param eco_file: path of the ECO form
+    :param alphabet: RevAlphabet to validate the form's revs with
+    :return: a list of (P/N, rev, ECO, media sets) tuples, one per P/N and rev.  ECO is the ECO a released CI
+             is listed as released on, or the form's own ECO for new CIs; media sets is a sorted tuple.
+    """
+    arguments = ["-a", eco_file]
+    if alphabet is PERMISSIVE_REV_ALPHABET:
+        arguments.insert(0, "-i")
+    arguments = vars(cid.make_parser().parse_args(arguments))
+
+    diagnostics = DiagnosticLog(echo=False)
+    ci_records = []
+
+    try:
+        cid.extract_ps1_tab_part_nums(arguments, diagnostics=diagnostics, ci_records=ci_records)
+    except SystemExit:
+        for diagnostic in diagnostics.records:
+            if diagnostic.severity == "ERROR":
+                print diagnostic.message
+        print "\nERROR: Could not read every CI on ECO form {}.".format(eco_file)
+        sys.exit(1)
+
+    # a CI may be listed on several rows (ex. once per media set); combine them into one record
+    combined = {}
+    for ci_record in ci_records:
+        if not ci_record["rev"]:
+            continue
+
+        key = ci_record["pn"], ci_record["rev"]
+        eco, media_sets = combined.get(key, (None, set()))
+        media_sets.add(ci_record["media_set"])
+        combined[key] = (eco or ci_record["eco"], media_sets)
+
+    return [(pn, rev, eco, tuple(sorted(media_sets))) for (pn, rev), (eco, media_sets) in combined.items()]
+
+
+def pnr_records(pnr_path, alphabet=STRICT_REV_ALPHABET):
+    """
+    Extract the CIs listed in a PN Reserve Log, or in a snapshot of one.
+
+    :param pnr_path: path of the log or snapshot
+    :param alphabet: RevAlphabet to build the log's revs with
+    :return: a list of (P/N, rev, ECO, media sets) tuples, one per P/N and rev.  Media sets is always empty.
+    """
+    parts = pnr_snapshot.open_snapshot(pnr_path, alphabet)
+    if parts is None:
+        parts = pnr.extract_part_nums_pnr(alphabet, pnr_path)[0]
+
+    return [(pn, rev, eco, ()) for pn, rev, eco in parts.iter_cis()]
+
+
+def diff_part(pn, old_records, new_records):
+    """
+    :param pn: part number both lists of records belong to
+    :param old_records: the part's CI records in the old input, sorted by rev
+    :param new_records: the part's CI records in the new input, sorted by rev
+    :return: a list of (kind, P/N, old rev, new rev, old value, new value) changes
+    """
+    changes = []
+    old_revs = dict((record[1], record) for record in old_records)
+    new_revs = dict((record[1], record) for record in new_records)
+
+    removed = [record for record in old_records if record[1] not in new_revs]
+    added = [record for record in new_records if record[1] not in old_revs]
+
+    # a part listed at some revs before and different revs now was re-revved, rather than removed and re-added.
+    # An old rev is paired with a new rev listed on one of the same media sets, if there is one; the rest are
+    # paired latest rev first, so any revs left over are the earliest old revs or the earliest new ones.
+    revised = []
+    for old_record in list(removed):
+        for new_record in added:
+            if set(old_record[3]) & set(new_record[3]):
+                revised.append((old_record, new_record))
+                removed.remove(old_record)
+                added.remove(new_record)
+                break
+    while removed and added:
+        revised.append((removed.pop(), added.pop()))
+    revised.sort(key=lambda pair: old_records.index(pair[0]))
+
+    for old_record, new_record in revised:
+        changes.append((REVISED, pn, old_record[1], new_record[1], None, None))
+        if old_record[3] != new_record[3]:
+            changes.append((MOVED, pn, old_record[1], new_record[1], old_record[3], new_record[3]))
+
+    for record in added:
+        changes.append((ADDED, pn, None, record[1], None, record[3]))
+    for record in removed:
+        changes.append((REMOVED, pn, record[1], None, record[3], None))
+
+    for old_record in old_records:
+        new_record = new_revs.get(old_record[1])
+        if new_record is None:
+            continue
+
+        if old_record[3] != new_record[3]:
+            changes.append((MOVED, pn, old_record[1], new_record[1], old_record[3], new_record[3]))
+        if old_record[2] != new_record[2]:
+            changes.append((ECO_CHANGED, pn, old_record[1], new_record[1], old_record[2], new_record[2]))
+
+    return changes
+
+
+def diff_records(old_records, new_records, alphabet=STRICT_REV_ALPHABET):
+    """
+    Merge two lists of CI records in one sorted pass.
+
+    :param old_records: list of (P/N, rev, ECO, media sets) tuples from the old input
+    :param new_records: list of (P/N, rev, ECO, media sets) tuples from the new input
+    :param alphabet: RevAlphabet that defines rev order
+    :return: a list of (kind, P/N, old rev, new rev, old value, new value) changes, sorted by P/N
+    """
+    sort_key = lambda record: (record[0], alphabet.order_key(record[1]))
+    old_parts = itertools.groupby(sorted(old_records, key=sort_key), key=lambda record: record[0])
+    new_parts = itertools.groupby(sorted(new_records, key=sort_key), key=lambda record: record[0])
+
+    changes = []
+    old_part = next(old_parts, None)
+    new_part = next(new_parts, None)
+
+    while old_part is not None or new_part is not None:
+        if new_part is None or (old_part is not None and old_part[0] < new_part[0]):
+            changes += diff_part(old_part[0], list(old_part[1]), [])
+            old_part = next(old_parts, None)
+
+        elif old_part is None or new_part[0] < old_part[0]:
+            changes += diff_part(new_part[0], [], list(new_part[1]))
+            new_part = next(new_parts, None)
+
+        else:
+            changes += diff_part(old_part[0], list(old_part[1]), list(new_part[1]))
+            old_part = next(old_parts, None)
+            new_part = next(new_parts, None)
+
+    return changes
+
+
+def format_change(change, alphabet=STRICT_REV_ALPHABET):
+    """
+    :param change: a (kind, P/N, old rev, new rev, old value, new value) tuple from diff_records()
+    :return: the change as one line of text
+    """
+    kind, pn, old_rev, new_rev, old_value, new_value = change
+
+    def media(media_sets):
+        return "[{}]".format(", ".join(media_sets)) if media_sets else ""
+
+    if kind == ADDED:
+        return "{:<8} {} Rev. {} {}".format(kind, pn, new_rev, media(new_value)).rstrip()
+
+    if kind == REMOVED:
+        return "{:<8} {} Rev. {} {}".format(kind, pn, old_rev, media(old_value)).rstrip()
+
+    if kind == REVISED:
+        line = "{:<8} {} Rev. {} -> Rev. {}".format(kind, pn, old_rev, new_rev)
+        if Rev(new_rev, alphabet=alphabet) < Rev(old_rev, alphabet=alphabet):
+            line += "  (new rev is earlier than old rev)"
+        return line
+
+    if kind == MOVED:
+        return "{:<8} {} Rev. {} {} -> {}".format(kind, pn, new_rev, media(old_value) or "[no media]",
+                                                  media(new_value) or "[no media]")
+
+    return "{:<8} {} Rev. {} {} -> {}".format(kind, pn, new_rev, old_value, new_value)
+
+
+def make_parser():
+    """
+    Construct a command-line parser for the script, using the build-in argparse library
+
+    :return: an argparse parser object
+    """
+    description = VERSION_STRING + " - Report CIs that changed between two ECO forms or two PN Reserve Logs."
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('-v', '-V', '--version', action='version', version=VERSION_STRING)
+    parser.add_argument("old", type=str, help="the earlier ECO form (or PN Reserve Log, with -p)")
+    parser.add_argument("new", type=str, help="the later ECO form (or PN Reserve Log, with -p)")
+    parser.add_argument('-p', '--pnr', action='store_true', default=False,
+                        help="compare two PN Reserve Logs or PNR snapshots instead of two ECO forms")
+    parser.add_argument('-i', '--invalid-revs', action='store_true', default=False,
+                        help="allow invalid revisions")
+
+    return parser
+
+
+def main():
+    """
+    Command line execution starts here.
+    """
+    arguments = vars(make_parser().parse_args(sys.argv[1:]))
+
+    if arguments["invalid_revs"]:
+        alphabet = PERMISSIVE_REV_ALPHABET
+    else:
+        alphabet = STRICT_REV_ALPHABET
+
+    if arguments["pnr"]:
+        extract = pnr_records
+    else:
+        extract = eco_records
+
+    changes = diff_records(extract(arguments["old"], alphabet), extract(arguments["new"], alphabet), alphabet)
+
+    for change in changes:
+        print format_change(change, alphabet)
+
+    counts = dict((kind, 0) for kind in [ADDED, REMOVED, REVISED, MOVED, ECO_CHANGED])
+    for change in changes:
+        counts[change[0]] += 1
+
+    print "\n{} added, {} removed, {} re-revved, {} moved, {} ECO changes.".format(
+        counts[ADDED], counts[REMOVED], counts[REVISED], counts[MOVED], counts[ECO_CHANGED])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Machine-readable export of the CIs and diagnostics found on an ECO form.
+
+Downstream release tools used to recover the ECO's structure by scraping the fixed-width CONTENTS_ID text.  The
+export gives them the same data directly: one record per CI, then one record per error/warning/info message.
+JSON output is a single document; NDJSON output is one record per line, so it can be consumed as a stream.
+"""
+
+from __future__ import unicode_literals
+
+import json
+
+EXPORT_FORMATS = ["json", "ndjson"]
+
+
+def iter_export_records(ci_records, diagnostics, eco_file=None):
+    """
+    Yield every record of an export, in order: one header record, the CIs, then the diagnostics.
+
+    :param ci_records: list of CI dicts built by extract_ps1_tab_part_nums()
+    :param diagnostics: DiagnosticLog holding the run's errors, warnings and info messages
+    :param eco_file: path of the ECO form the records came from
+    """
+    yield {"type": "eco", "eco_file": eco_file, "ci_count": len(ci_records),
+           "diagnostic_count": len(diagnostics.records)}
+
+    for ci_record in ci_records:
+        record = {"type": "ci"}
+        record.update(ci_record)
+        yield record
+
+    for diagnostic in diagnostics.records:
+        record = {"type": "diagnostic"}
+        record.update(diagnostic.as_dict())
+        yield record
+
+
+def render_json(ci_records, diagnostics, eco_file=None):
+    """
+    :return: the export as a single JSON document, with "cis" and "diagnostics" lists
+    """
+    records = iter_export_records(ci_records, diagnostics, eco_file)
+    document = next(records)
+    document.pop("type")
+    document["cis"] = []
+    document["diagnostics"] = []
+
+    for record in records:
+        if record.pop("type") == "ci":
+            document["cis"].append(record)
+        else:
+            document["diagnostics"].append(record)
+
+    return json.dumps(document, sort_keys=True, indent=1) + "\n"
+
+
+def render_ndjson(ci_records, diagnostics, eco_file=None):
+    """
+    :return: the export as newline-delimited JSON, one record per line
+    """
+    return "".join(json.dumps(record, sort_keys=True) + "\n"
+                   for record in iter_export_records(ci_records, diagnostics, eco_file))
+
+
+def render_export(export_format, ci_records, diagnostics, eco_file=None):
+    """
+    :param export_format: one of EXPORT_FORMATS
+    :return: a (file name, file text) tuple, ready for the cid_output writers
+    """
+    file_name = "CONTENTS_ID." + export_format
+    print "Creating file {}...".format(file_name)
+
+    if export_format == "json":
+        return file_name, unicode(render_json(ci_records, diagnostics, eco_file))
+
+    return file_name, unicode(render_ndjson(ci_records, diagnostics, eco_file))
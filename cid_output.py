@@ -0,0 +1,295 @@
+"""
+Output subsystem for cid.py.
+
+Every output file is rendered to text in memory first.  The rendered files are then either written in
+parallel, each through a temp file that is renamed over the destination once it is complete (so an interrupted
+run never leaves a half-written CONTENTS_ID file behind), or streamed into a single zip/tar archive with one
+sequential write, which is far cheaper on an SMB share than many small files.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import locale
+import multiprocessing
+import os
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+import bdt_utils
+from cid_classes import CITree
+
+# maximum number of files written at once
+WRITER_THREADS = 8
+
+BUNDLE_FORMATS = ["zip", "tar"]
+
+NEW_PARTS_NOTE = "NOTE: This file lists only the new, unique parts on this ECO. Duplicate and previously-released\n" \
+                 "parts are not included.  Nesting is preserved (ex. 065s are indented under the first 139 they\n" \
+                 "are affiliated with).  Be aware that you may not be seeing all members of a 139/142/etc., since\n" \
+                 "previously-released parts, or parts already displayed under earlier 139s/etc., " \
+                 "will be missing.\n\n"
+
+
+def render_media_set(records):
+    """
+    Build one media set's CONTENTS_ID table from its CIs, and format it.
+
+    :param records: CI record dicts for one pass over a media set, in sheet order
+    :return: a tuple of the table, represented by a list of lists, and the table formatted by
+             bdt_utils.pretty_table()
+    """
+    ci_tree = CITree(records)
+    table = ci_tree.render_table(ci_tree.nodes)
+
+    return table, bdt_utils.pretty_table(table, 3) if table else ""
+
+
+def render_media_sets(record_sets, jobs=1):
+    """
+    Run render_media_set() on every media set, on a pool of worker processes when there's more than one of each.
+    Each worker builds its set's CITree as well as formatting the table.  Media sets share nothing once their rows
+    are validated, and results come back in record_sets order, so the output doesn't depend on the number of jobs.
+
+    :param record_sets: a list of CI record lists, one per media set
+    :param jobs: number of worker processes; 0 for one per CPU
+    :return: a list of render_media_set() results, in record_sets order
+    """
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+
+    if jobs < 2 or len(record_sets) < 2:
+        return [render_media_set(records) for records in record_sets]
+
+    pool = multiprocessing.Pool(min(jobs, len(record_sets)))
+    try:
+        return pool.map(render_media_set, record_sets, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def render_cid_files(contents_id_table):
+    """
+    Split a table into one CONTENTS_ID file per media set.
+
+    :param contents_id_table: a table of part numbers, formatted into a multi-line string by bdt.pretty_table()
+    :return: a list of (file name, file text) tuples, in table order
+    """
+
+    stripped_line = ""
+    cid_files = []
+
+    # break contents_id "table" into a list of lines
+    for line in contents_id_table.split("\n"):
+
+        # only do the following block on non-blank lines
+        if line:
+            # create a version of line with leading & trailing spaces removed
+            stripped_line = line.strip()
+
+            # does this line not start with a part number?  Then it's a media identifier (CD1, Synergy, etc.)
+            # that should be used to name the file, but not be written to the file.
+            if not stripped_line[0:3].isdigit():
+                current_media = stripped_line[stripped_line.find(":") + 1:]
+                print "Creating file CONTENTS_ID.{}...".format(current_media.replace(" ", "_"))
+                cid_files.append(["CONTENTS_ID." + current_media.replace(" ", "_"), []])
+                continue
+
+        if not cid_files:
+            print "\nERROR: render_cid_files() was passed an empty or improperly-formatted table." \
+                  "Table contents:\n{}\nstripped_line:" \
+                  "\n{}".format(unicode(contents_id_table), stripped_line)
+            sys.exit(1)
+
+        # passes along blank lines, too
+        cid_files[-1][1].append(line + "\n")
+
+    return [(file_name, "".join(lines)) for file_name, lines in cid_files]
+
+
+def render_outputs(arguments, cid_tables, cid_table_order, pnr_warnings, cid_texts=None):
+    """
+    Render every file a run produces, without writing anything.
+
+    :param arguments: argparse command line arguments, formatted into a hash
+    :param cid_tables: a dict where each value is a table represented by a list of lists, keyed by media set
+    :param cid_table_order: a list of the keys in cid_tables, in the order they appear on the ECO
+    :param pnr_warnings: a list of warnings generated in the PN_Reserve verification pass
+    :param cid_texts: a dict of the tables already formatted by bdt_utils.pretty_table(), keyed by media set, if
+                      they were formatted along with the tables
+    :return: a list of (file name, file text) tuples, in the order the files should be reported
+    """
+
+    if cid_texts is None:
+        cid_texts = dict((table, bdt_utils.pretty_table(cid_tables[table], 3) if cid_tables[table] else "")
+                         for table in cid_table_order)
+
+    outputs = []
+
+    if pnr_warnings:
+        outputs.append(("PNR_WARNINGS", "".join(warning + "\n" for warning in pnr_warnings)))
+
+    if arguments["new_pn_only"]:
+        print "Creating file NEW_PARTS, containing only new, unique parts...",
+        new_parts_text = NEW_PARTS_NOTE
+        for table in cid_table_order:
+            if cid_tables[table]:
+                new_parts_text += cid_texts[table] + "\n\n"
+        outputs.append(("NEW_PARTS", new_parts_text))
+        return outputs
+
+    # Combine all CONTENTS_IDs into one document.  Can be combined with -m and/or -s.
+    if arguments["print_to_one"]:
+        print "Creating file CONTENTS_ID.all...\n",
+        all_text = ""
+        for table in cid_table_order:
+            all_text += cid_texts[table] + "\n\n"
+        outputs.append(("CONTENTS_ID.all", all_text))
+
+    # if only -o was set, don't print to many.
+    if not arguments["print_to_one"] and not arguments["print_to_many"]:
+        arguments["print_to_many"] = True
+
+    if arguments["print_to_many"]:
+        for table in cid_table_order:
+            # everything after the media type line goes to a CONTENTS_ID.<media type> file.
+            outputs += render_cid_files(cid_texts[table])
+
+    return outputs
+
+
+def replace_file(src_path, dest_path):
+    """
+    Rename src_path over dest_path in a single step.  os.rename already does this on POSIX, but on Windows it
+    refuses to overwrite an existing file, so there we go straight to MoveFileEx.
+    """
+    if os.name != "nt":
+        os.rename(src_path, dest_path)
+        return
+
+    import ctypes
+
+    movefile_replace_existing = 0x1
+    movefile_write_through = 0x8
+
+    if not ctypes.windll.kernel32.MoveFileExW(unicode(src_path), unicode(dest_path),
+                                              movefile_replace_existing | movefile_write_through):
+        raise ctypes.WinError()
+
+
+def new_file_mode():
+    """
+    :return: the permissions open() gives a new file, i.e. 0666 less the umask.  mkstemp() always creates its
+             files 0600, which would leave files on a shared release folder unreadable to everyone else.
+    """
+    # the umask can only be read by setting it, so callers writing from several threads should read it once
+    umask = os.umask(0)
+    os.umask(umask)
+
+    return 0o666 & ~umask
+
+
+def write_file_atomic(file_path, text, eol, mode=None):
+    """
+    Write text to file_path via a temp file in the same directory, renamed into place once it's complete.
+
+    :param file_path: path of the file to (over)write
+    :param text: contents of the file, with "\\n" line endings
+    :param eol: the end of line format to use, will be \\n for UNIX, \\r\\n for DOS.
+    :param mode: permissions to give the file, from new_file_mode() by default
+    """
+    if mode is None:
+        mode = new_file_mode()
+
+    temp_fd, temp_path = tempfile.mkstemp(prefix="." + os.path.basename(file_path) + ".",
+                                          dir=os.path.dirname(file_path) or ".")
+    try:
+        with io.open(temp_fd, "w", newline=eol) as f:
+            f.write(text)
+        os.chmod(temp_path, mode)
+        replace_file(temp_path, file_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_outputs(outputs, eol, output_dir=".", threads=WRITER_THREADS):
+    """
+    Write rendered files in parallel, each one atomically.
+
+    :param outputs: a list of (file name, file text) tuples, from render_outputs()
+    :param eol: the end of line format to use, will be \\n for UNIX, \\r\\n for DOS.
+    :param output_dir: directory to write the files to
+    :param threads: maximum number of files to write at once
+    :return: a list of the names of the files written
+    """
+
+    if not outputs:
+        return []
+
+    mode = new_file_mode()
+    pool = ThreadPool(max(1, min(threads, len(outputs))))
+    try:
+        pool.map(lambda output: write_file_atomic(os.path.join(output_dir, output[0]), output[1], eol, mode),
+                 outputs)
+    finally:
+        pool.close()
+        pool.join()
+
+    return [file_name for file_name, text in outputs]
+
+
+def write_bundle(outputs, eol, archive_format, output_dir="."):
+    """
+    Stream rendered files into one archive, written sequentially and renamed into place once it's complete.
+
+    :param outputs: a list of (file name, file text) tuples, from render_outputs()
+    :param eol: the end of line format to use, will be \\n for UNIX, \\r\\n for DOS.
+    :param archive_format: one of BUNDLE_FORMATS
+    :param output_dir: directory to write the archive to
+    :return: the name of the archive written
+    """
+
+    archive_name = "CONTENTS_ID." + archive_format
+    archive_path = os.path.join(output_dir, archive_name)
+
+    # match the encoding io.open() would have used if the files had been written individually
+    encoding = locale.getpreferredencoding(False)
+    timestamp = time.time()
+
+    print "Creating archive {}, containing {} files...".format(archive_name, len(outputs))
+
+    temp_fd, temp_path = tempfile.mkstemp(prefix="." + archive_name + ".", dir=output_dir)
+    try:
+        with os.fdopen(temp_fd, "wb") as f:
+            if archive_format == "zip":
+                with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as archive:
+                    for file_name, text in outputs:
+                        member = zipfile.ZipInfo(str(file_name), time.localtime(timestamp)[:6])
+                        member.compress_type = zipfile.ZIP_DEFLATED
+                        archive.writestr(member, text.replace("\n", eol).encode(encoding))
+            else:
+                archive = tarfile.open(fileobj=f, mode="w")
+                try:
+                    for file_name, text in outputs:
+                        data = text.replace("\n", eol).encode(encoding)
+                        member = tarfile.TarInfo(str(file_name))
+                        member.size = len(data)
+                        member.mtime = timestamp
+                        archive.addfile(member, io.BytesIO(data))
+                finally:
+                    archive.close()
+        os.chmod(temp_path, new_file_mode())
+        replace_file(temp_path, archive_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return archive_name
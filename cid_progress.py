@@ -0,0 +1,231 @@
+"""
+Progress reporting for the slow parts of a run: loading workbooks (the PN Reserve Log is read from a network
+share) and walking their rows.
+
+A Progress object is handed to the loaders and row loops.  The loops only call update() every check_every rows,
+and update() only builds a report every interval seconds, so the cost in the hot loops is a modulo and, now and
+then, a clock read.  Each report goes to every registered callback: console_indicator() draws a single updating
+line on stderr, and batch or server callers can register their own.
+"""
+
+import os
+import sys
+import time
+
+# rows between checks of the clock, in the row loops
+CHECK_EVERY = 64
+
+# seconds between reports
+REPORT_INTERVAL = 0.25
+
+
+class ProgressReport(object):
+    def __init__(self, phase, rows, total_rows, bytes_read, total_bytes, elapsed, done=False):
+        """
+        :param phase: what's being done, ex. "Reading PN Reserve Log"
+        :param rows: rows processed so far
+        :param total_rows: rows there are to process, if known
+        :param bytes_read: bytes of the workbook read so far
+        :param total_bytes: size of the workbook, if known
+        :param elapsed: seconds since the phase started
+        :param done: True for the last report of the phase
+        """
+        self.phase = phase
+        self.rows = rows
+        self.total_rows = total_rows
+        self.bytes_read = bytes_read
+        self.total_bytes = total_bytes
+        self.elapsed = elapsed
+        self.done = done
+
+    @property
+    def rate(self):
+        """
+        :return: rows processed per second
+        """
+        if self.elapsed <= 0:
+            return 0.0
+
+        return self.rows / self.elapsed
+
+    @property
+    def eta(self):
+        """
+        :return: estimated seconds until the phase is done, or None if it can't be estimated yet
+        """
+        if self.done:
+            return 0.0
+
+        # while a workbook is loading there are no rows yet, only bytes
+        if not self.rows and self.bytes_read and self.total_bytes:
+            return self.elapsed * max(self.total_bytes - self.bytes_read, 0) / self.bytes_read
+
+        if not self.total_rows or not self.rate:
+            return None
+
+        return max(self.total_rows - self.rows, 0) / self.rate
+
+    def as_dict(self):
+        return {"phase": self.phase, "rows": self.rows, "total_rows": self.total_rows,
+                "bytes_read": self.bytes_read, "total_bytes": self.total_bytes, "elapsed": self.elapsed,
+                "rate": self.rate, "eta": self.eta, "done": self.done}
+
+
+class CountingFile(object):
+    def __init__(self, path, progress):
+        """
+        A binary file that reports how much of it has been read, for loading workbooks with a Progress.
+        openpyxl reads workbooks through zipfile, which only needs read(), seek() and tell().
+
+        :param path: path of the file to open
+        :param progress: Progress to report bytes read to
+        """
+        self._file = open(path, "rb")
+        self._progress = progress
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self._progress.add_bytes(len(data))
+        return data
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+class Progress(object):
+    def __init__(self, callbacks=None, interval=REPORT_INTERVAL, check_every=CHECK_EVERY):
+        """
+        :param callbacks: functions to call with each ProgressReport
+        :param interval: minimum seconds between reports, other than each phase's last
+        :param check_every: row loops call update() once per this many rows
+        """
+        self.callbacks = list(callbacks or [])
+        self.interval = interval
+        self.check_every = check_every
+
+        self.phase = None
+        self.rows = 0
+        self.total_rows = None
+        self.bytes_read = 0
+        self.total_bytes = None
+        self.started = 0.0
+        self.last_report = 0.0
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def start(self, phase, total_rows=None, total_bytes=None):
+        """
+        Begin a new phase, ex. reading a workbook or validating its rows.
+        """
+        self.phase = phase
+        self.rows = 0
+        self.total_rows = total_rows
+        self.bytes_read = 0
+        self.total_bytes = total_bytes
+        self.started = self.last_report = time.time()
+
+    def open_workbook(self, path):
+        """
+        Start a phase for loading a workbook.
+
+        :return: the workbook file, opened so that reads are reported, or path itself if it can't be opened (so
+                 the caller's usual error handling for a missing workbook still applies)
+        """
+        try:
+            total_bytes = os.path.getsize(path)
+            workbook_file = CountingFile(path, self)
+        except (IOError, OSError):
+            return path
+
+        self.start("Loading " + os.path.basename(path), total_bytes=total_bytes)
+        return workbook_file
+
+    def add_bytes(self, byte_count):
+        self.bytes_read += byte_count
+        self.update(self.rows)
+
+    def update(self, rows):
+        """
+        :param rows: rows processed so far in this phase
+        """
+        self.rows = rows
+        now = time.time()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(now)
+
+    def finish(self, rows=None):
+        """
+        End the phase, always sending a final report.
+        """
+        if rows is not None:
+            self.rows = rows
+        self.report(time.time(), done=True)
+
+    def report(self, now, done=False):
+        progress_report = ProgressReport(self.phase, self.rows, self.total_rows, self.bytes_read, self.total_bytes,
+                                         now - self.started, done)
+        for callback in self.callbacks:
+            callback(progress_report)
+
+
+def format_bytes(byte_count):
+    for unit in ["B", "KB", "MB"]:
+        if byte_count < 1024:
+            return "{:.0f} {}".format(byte_count, unit)
+        byte_count /= 1024.0
+
+    return "{:.1f} GB".format(byte_count)
+
+
+def console_indicator(stream=None):
+    """
+    :param stream: file to draw the indicator on, stderr by default
+    :return: a Progress callback that keeps one line of stream up to date, ending it when a phase is done
+    """
+    if stream is None:
+        stream = sys.stderr
+
+    # the longest line drawn so far, so shorter lines can blank out what's left of it
+    state = {"width": 0}
+
+    def draw(progress_report):
+        parts = [progress_report.phase + ":"]
+
+        if progress_report.rows or not progress_report.bytes_read:
+            if progress_report.total_rows:
+                parts.append("{}/{} rows".format(progress_report.rows, progress_report.total_rows))
+            else:
+                parts.append("{} rows".format(progress_report.rows))
+            parts.append("({:.0f} rows/s)".format(progress_report.rate))
+        else:
+            if progress_report.total_bytes:
+                # zipfile reads the archive's directory more than once, so reads can add up to more than its size
+                parts.append("{} of {}".format(format_bytes(min(progress_report.bytes_read,
+                                                                progress_report.total_bytes)),
+                                               format_bytes(progress_report.total_bytes)))
+            else:
+                parts.append(format_bytes(progress_report.bytes_read))
+
+        if progress_report.done:
+            parts.append("in {:.1f}s".format(progress_report.elapsed))
+        elif progress_report.eta is not None:
+            parts.append("ETA {:.0f}s".format(progress_report.eta))
+
+        line = " ".join(parts)
+        stream.write("\r" + line.ljust(state["width"]))
+        state["width"] = max(state["width"], len(line))
+
+        if progress_report.done:
+            stream.write("\n")
+            state["width"] = 0
+        stream.flush()
+
+    return draw
@@ -0,0 +1,88 @@
+"""
+Expected new revs for the changed CIs on an ECO form.
+
+Each new CI's expected rev is the later of the rev after its Cur Rev and the rev after the highest rev the PN
+Reserve Log lists for the part, so a part that was re-revved on another ECO since the form was started gets the
+rev that's actually free.  The New Rev cells that don't hold the expected rev are written to a CSV patch, one
+line per cell to change, so an author can fix them all at once instead of one warning (and one rerun) at a time.
+"""
+
+import csv
+import StringIO
+
+from cid_classes import *
+
+SUGGESTIONS_FILE = "REV_SUGGESTIONS.csv"
+SUGGESTION_FIELDS = ["row", "cell", "pn", "cur_rev", "new_rev", "expected_rev", "basis"]
+
+
+def expected_rev(pn, prev_rev, rev, eco, pnr_list=None, alphabet=STRICT_REV_ALPHABET):
+    """
+    :param pn: part number of a new CI
+    :param prev_rev: the CI's Cur Rev
+    :param rev: the CI's New Rev, as listed on the ECO form
+    :param eco: the ECO the CI is new on
+    :param pnr_list: the contents of the PN Reserve Log, in a parts object from pnr_backends, if it was read
+    :param alphabet: RevAlphabet the form's revs are built with
+    :return: a tuple of the expected rev's name and what it was based on
+    """
+    # a rev the log has already reserved for this ECO is the right one, whatever else the log lists
+    if pnr_list is not None and pnr_list.eco(pn, rev) == eco:
+        return rev, "reserved in PNR Log"
+
+    expected = Rev(prev_rev, alphabet=alphabet).next_rev
+    basis = "cur rev"
+
+    if pnr_list is not None:
+        pnr_next_rev = pnr_list.next_rev(pn)
+        if pnr_next_rev is not None and pnr_next_rev > expected:
+            expected = pnr_next_rev
+            basis = "PNR Log max rev"
+
+    return expected.name, basis
+
+
+def suggest_revs(ci_records, pnr_list=None, alphabet=STRICT_REV_ALPHABET):
+    """
+    :param ci_records: list of CI dicts built by extract_ps1_tab_part_nums()
+    :param pnr_list: the contents of the PN Reserve Log, in a parts object from pnr_backends, if it was read
+    :param alphabet: RevAlphabet the form's revs are built with
+    :return: a list of dicts with SUGGESTION_FIELDS keys, one per New Rev cell that should change, in row order
+    """
+    suggestions = []
+
+    # "dup" rows repeat a CI listed earlier, so each CI's expected rev is only worked out once
+    expected_revs = {}
+
+    for ci_record in sorted(ci_records, key=lambda record: record["row"]):
+        if ci_record["prev_rev"] is None:
+            continue
+
+        key = ci_record["pn"], ci_record["prev_rev"], ci_record["rev"]
+        if key not in expected_revs:
+            expected_revs[key] = expected_rev(ci_record["pn"], ci_record["prev_rev"], ci_record["rev"],
+                                              ci_record["eco"], pnr_list, alphabet)
+
+        expected, basis = expected_revs[key]
+        if expected != ci_record["rev"]:
+            suggestions.append({"row": ci_record["row"], "cell": ci_record["rev_cell"], "pn": ci_record["pn"],
+                                "cur_rev": ci_record["prev_rev"], "new_rev": ci_record["rev"],
+                                "expected_rev": expected, "basis": basis})
+
+    return suggestions
+
+
+def render_suggestions(suggestions):
+    """
+    :param suggestions: list of dicts from suggest_revs()
+    :return: a (file name, file text) tuple, ready for the cid_output writers
+    """
+    print "Creating file {}...".format(SUGGESTIONS_FILE)
+
+    text = StringIO.StringIO()
+    writer = csv.DictWriter(text, SUGGESTION_FIELDS, lineterminator="\n")
+    writer.writeheader()
+    for suggestion in suggestions:
+        writer.writerow(suggestion)
+
+    return SUGGESTIONS_FILE, text.getvalue().decode("utf-8")
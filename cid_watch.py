@@ -0,0 +1,150 @@
+"""
+Watch mode for cid.py: keep the PN Reserve Log loaded, and re-validate the ECO form every time it is saved.
+
+Excel doesn't save in place.  It writes a temp file, removes the original and renames the temp file over it, so
+for a moment the form may be missing or incomplete.  A change is therefore only acted on once the file exists
+and its size and modification time have held still for SETTLE_TIME seconds.
+"""
+
+import os
+import sys
+import time
+
+from cid_classes import *
+
+POLL_INTERVAL = 0.5
+SETTLE_TIME = 1.5
+
+
+def file_signature(path):
+    """
+    :param path: path of the file to check
+    :return: a (size, mtime) tuple, or None if the file doesn't currently exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_size, stat.st_mtime
+
+
+def wait_for_save(path, last_signature, poll_interval=POLL_INTERVAL, settle_time=SETTLE_TIME):
+    """
+    Block until path has been saved, i.e. its signature differs from last_signature and has stopped changing.
+
+    :param path: path of the file to watch
+    :param last_signature: signature of the version of the file that was last processed
+    :param poll_interval: seconds between checks
+    :param settle_time: seconds the file must be unchanged before it is considered saved
+    :return: the new signature
+    """
+    while True:
+        signature = file_signature(path)
+
+        if signature is not None and signature != last_signature:
+            settled_since = time.time()
+
+            while time.time() - settled_since < settle_time:
+                time.sleep(poll_interval)
+                new_signature = file_signature(path)
+                if new_signature != signature:
+                    signature = new_signature
+                    settled_since = time.time()
+
+            if signature is not None and signature != last_signature:
+                return signature
+
+        time.sleep(poll_interval)
+
+
+def diagnostic_key(diagnostic):
+    """
+    :return: the identity of a diagnostic, for comparison between passes
+    """
+    return diagnostic.severity, diagnostic.code, diagnostic.cell, diagnostic.row, diagnostic.message
+
+
+def report_changes(previous, current):
+    """
+    Print the diagnostics that appeared or went away since the previous pass.
+
+    :param previous: list of Diagnostic objects from the previous pass, or None if this is the first pass
+    :param current: list of Diagnostic objects from this pass
+    """
+    if previous is None:
+        for diagnostic in current:
+            print diagnostic.message
+        if not current:
+            print "No problems found."
+        return
+
+    previous_keys = set(diagnostic_key(diagnostic) for diagnostic in previous)
+    current_keys = set(diagnostic_key(diagnostic) for diagnostic in current)
+
+    resolved = [diagnostic for diagnostic in previous if diagnostic_key(diagnostic) not in current_keys]
+    added = [diagnostic for diagnostic in current if diagnostic_key(diagnostic) not in previous_keys]
+
+    for diagnostic in resolved:
+        print "RESOLVED: " + diagnostic.message.splitlines()[0]
+    for diagnostic in added:
+        print diagnostic.message
+
+    if not resolved and not added:
+        print "No change in diagnostics ({} total).".format(len(current))
+
+
+def validation_pass(extract, arguments, pnr_list, pnr_warnings, pnr_dupe_pn_list, row_cache):
+    """
+    Run one extraction/validation pass, collecting its diagnostics rather than printing them.
+
+    :param extract: the extraction function, i.e. cid.extract_ps1_tab_part_nums
+    :param row_cache: RowValidationCache shared by every pass, so only rows changed by a save are re-validated
+    :return: a list of Diagnostic objects
+    """
+    diagnostics = DiagnosticLog(echo=False)
+
+    try:
+        # extract appends to the PNR warnings it's given, so each pass gets its own copy
+        extract(arguments, pnr_list, list(pnr_warnings), pnr_dupe_pn_list, diagnostics, row_cache=row_cache)
+    except SystemExit:
+        # a fatal ECO error ends the pass, not the watch; it's in the diagnostics like any other error
+        pass
+
+    return diagnostics.records
+
+
+def watch(extract, arguments, pnr_list=None, pnr_warnings=[], pnr_dupe_pn_list=[]):
+    """
+    Re-validate the ECO form each time it's saved, until interrupted with Ctrl-C.
+
+    :param extract: the extraction function, i.e. cid.extract_ps1_tab_part_nums
+    :param arguments: argparse command line arguments, formatted into a hash
+    :param pnr_list: the contents of the part number reserve log, loaded once and reused by every pass
+    """
+    eco_file = arguments["eco_file"]
+    signature = None
+    previous = None
+    row_cache = RowValidationCache()
+
+    print "\nWatching {} for changes. Press Ctrl-C to stop.".format(eco_file)
+
+    try:
+        while True:
+            signature = wait_for_save(eco_file, signature)
+            print "\n--- {} saved at {} ---".format(eco_file, time.strftime("%H:%M:%S"))
+
+            try:
+                current = validation_pass(extract, arguments, pnr_list, pnr_warnings, pnr_dupe_pn_list, row_cache)
+            except Exception as e:
+                # most likely caught the file mid-save; the next save will trigger another pass
+                print "Could not read {} ({}). Waiting for the next save.".format(eco_file, e)
+                continue
+
+            print "Validated {} of {} rows.".format(row_cache.misses, row_cache.hits + row_cache.misses)
+            report_changes(previous, current)
+            previous = current
+            sys.stdout.flush()
+
+    except KeyboardInterrupt:
+        print "\nStopped watching {}.".format(eco_file)
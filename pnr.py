@@ -1,4 +1,4 @@
-import openpyxl           # third party open source library, https://openpyxl.readthedocs.org/en/latest/
+import argparse
 import sys
 
 from cid_classes import *
@@ -7,10 +7,15 @@ PNRL_PATH = r"\\us.ray.com\SAS\AST\eng\Operations\CM\Internal\Staff\CM_Submittal
 #PNRL_PATH = "PN_Reserve_copy.xlsm"
 
 
-def extract_part_nums_pnr():
+def extract_part_nums_pnr(alphabet=STRICT_REV_ALPHABET, pnr_path=None, diagnostics=None, progress=None):
     """
     Extract part numbers from the part number reserve log, return them as a dict keyed by P/N
 
+    :param alphabet: RevAlphabet the log's revs are built with
+    :param pnr_path: path of the log to read, if not the one at PNRL_PATH
+    :param diagnostics: a DiagnosticLog that receives any errors found
+    :param progress: a cid_progress.Progress that receives bytes read and rows processed, if any
+
     :return: a tuple of values, including...
 
      - contents of part number reserve log main worksheet, formatted as a dict.
@@ -19,35 +24,56 @@ def extract_part_nums_pnr():
      - a list of warnings generated during PN Reserve Log extraction, ex. invalid part numbers or revs
     """
 
+    if pnr_path is None:
+        pnr_path = PNRL_PATH
+    if diagnostics is None:
+        diagnostics = DiagnosticLog()
+
+    # imported here rather than at module level, so cid.py runs answered from the output cache never load it
+    import openpyxl  # third party open source library, https://openpyxl.readthedocs.org/en/latest/
+
+    pnr_file = pnr_path
+    if progress is not None:
+        pnr_file = progress.open_workbook(pnr_path)
+
     try:
         # openpyxl is a library for reading/writing Excel files.
-        pnr_log = openpyxl.load_workbook(PNRL_PATH)
+        pnr_log = openpyxl.load_workbook(pnr_file)
     except openpyxl.exceptions.InvalidFileException:
-        print '\nPNR ERROR: Could not open Part Number Reserve Log at path:' \
-              '\n       {}'.format(PNRL_PATH)
+        diagnostics.error("pnr-open", '\nPNR ERROR: Could not open Part Number Reserve Log at path:'
+                                      '\n       {}'.format(pnr_path))
         sys.exit(1)
+    finally:
+        if pnr_file is not pnr_path:
+            pnr_file.close()
+            progress.finish()
 
     # part number reserve workbook must have a sheet called "PN_Rev"
     pn_sheet = pnr_log.get_sheet_by_name('PN_Rev')
     try:
         pn_rows = pn_sheet.rows
     except AttributeError:
-        print '\nPNR ERROR: No PN_Rev tab on Part Number Reserve Log at path:' \
-              '\n\n     {}'.format(PNRL_PATH)
+        diagnostics.error("pnr-no-sheet", '\nPNR ERROR: No PN_Rev tab on Part Number Reserve Log at path:'
+                                          '\n\n     {}'.format(pnr_path))
         sys.exit(1)
 
     row_num = 0
-    pnr_list = ListOfParts()
+    pnr_list = ListOfParts(alphabet=alphabet)
     pnr_dupe_pn_list = []
     pnr_warnings = []
 
     if not pn_sheet['A1'].value:
-        print "\nPNR ERROR: PNR Log does not appear to be valid!" \
-              "Cell A1 of {} is blank.".format(PNRL_PATH)
+        diagnostics.error("pnr-invalid", "\nPNR ERROR: PNR Log does not appear to be valid!"
+                                         "Cell A1 of {} is blank.".format(pnr_path), cell="A1")
         sys.exit(1)
 
+    if progress is not None:
+        progress.start("Reading PN Reserve Log", total_rows=pn_sheet.max_row)
+
     for row in pn_rows:
         row_num += 1
+        if progress is not None and not row_num % progress.check_every:
+            progress.update(row_num)
         part_num = pn_sheet['A'+str(row_num)].value
         part_rev = pn_sheet['C'+str(row_num)].value
         eco_num = pn_sheet['D'+str(row_num)].value
@@ -60,7 +86,7 @@ def extract_part_nums_pnr():
                 pnr_dupe_pn_list.append(dupe_pn)
 
             try:
-                pnr_list.add_part(part_num, part_rev, eco_num)
+                pnr_list.add_part(part_num, part_rev, eco_num, row_num)
 
             except ValueError:
                 if not is_valid_part(part_num):
@@ -69,4 +95,74 @@ def extract_part_nums_pnr():
                     pnr_warnings.append("PNR WARNING: Skipping PNR Log row {} -- illegal revision {}.".format(row_num,
                                                                                                            part_rev))
 
+    if progress is not None:
+        progress.finish(row_num)
+
     return pnr_list, pnr_warnings, pnr_dupe_pn_list
+
+
+def eco_coverage(form_cis, pnr_list, eco):
+    """
+    Compare the new CIs on an ECO form with the CIs the PN Reserve Log says the ECO released.
+
+    :param form_cis: set of (P/N, rev) tuples, the CIs the ECO form lists as new
+    :param pnr_list: the contents of the PN Reserve Log, in a parts object from pnr_backends
+    :param eco: the ECO's number
+    :return: a tuple of three sets of (P/N, rev) tuples...
+             - missing: released on the ECO per the log, but not on the form
+             - extra: on the form, but not in the log at all
+             - wrong ECO: on the form, but released on a different ECO per the log
+    """
+    log_cis = set(pnr_list.parts_for_eco(eco))
+    unmatched = set(form_cis) - log_cis
+    wrong_eco = set(ci for ci in unmatched if pnr_list.has_part(*ci))
+
+    return log_cis - set(form_cis), unmatched - wrong_eco, wrong_eco
+
+
+def make_parser():
+    """
+    Construct a command-line parser for the script, using the build-in argparse library
+
+    :return: an argparse parser object
+    """
+    parser = argparse.ArgumentParser(description="List the CIs the Part Number Reserve Log has as released on "
+                                                 "an ECO.")
+
+    parser.add_argument("eco", type=str, help="ECO number")
+    parser.add_argument('--pnr-snapshot', type=str, default=None, metavar="PATH",
+                        help="read the PN Reserve Log through a snapshot at PATH, which is rebuilt whenever the "
+                             "log changes")
+    parser.add_argument('-i', '--invalid-revs', action='store_true', default=False,
+                        help="allow invalid revisions")
+
+    return parser
+
+
+def main():
+    """
+    Command line execution starts here.
+    """
+    import pnr_snapshot
+
+    arguments = vars(make_parser().parse_args(sys.argv[1:]))
+
+    if arguments["invalid_revs"]:
+        alphabet = PERMISSIVE_REV_ALPHABET
+    else:
+        alphabet = STRICT_REV_ALPHABET
+
+    if arguments["pnr_snapshot"]:
+        pnr_list = pnr_snapshot.load_pnr(arguments["pnr_snapshot"], alphabet)[0]
+    else:
+        pnr_list = extract_part_nums_pnr(alphabet)[0]
+
+    cis = pnr_list.parts_for_eco(arguments["eco"])
+    for pn, rev in cis:
+        print "{} Rev. {}".format(pn, rev)
+
+    print "\n{} CIs released on ECO {}.".format(len(cis), arguments["eco"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+Where PN Reserve Log data comes from.
+
+A backend loads the log and returns its contents as a "parts" object, plus the warnings and duplicate CIs found
+while reading it.  Every parts object answers the same lookups, so validation doesn't care where the data came from:
+
+    has_part(pn, rev)       True if the log lists pn at rev
+    eco(pn, rev)            the ECO the log lists pn at rev as released on, or None
+    next_rev(pn)            the Rev after pn's max rev in the log ("-" for a part not in the log)
+    rev_before(pn, rev)     the greatest Rev of pn in the log earlier than rev, or None if there isn't one (or,
+                            for the web service, which can't list a part's revs, if it isn't known)
+    parts_for_eco(eco)      the (P/N, rev) tuples the log lists as released on eco
+    iter_cis()              every (P/N, rev, ECO) in the log
+    lookup(cis)             eco() for a list of (P/N, rev) tuples at once, as a dict
+    prefetch(cis)           called once, with every (P/N, rev) on the ECO form, before rows are validated
+
+Three backends are provided: the xlsx/xlsm log itself (a ListOfParts), a local snapshot file of it (a
+PNRSnapshot) and the PNR web service (HTTPParts).  For the first two everything is local and prefetch() does
+nothing.  HTTPParts answers from what prefetch() fetched, in batches of BATCH_SIZE over a small pool of persistent
+connections, so an ECO's lookups take a few requests rather than one per row.
+
+The web service speaks JSON:
+
+    GET  /version                                   {"version": text that changes whenever the log does}
+    GET  /warnings                                  {"warnings": [text, ...], "dupes": ["P/N Rev. rev", ...]}
+    GET  /cis                                       {"cis": [[P/N, rev, ECO], ...]}
+    GET  /eco/<ECO>                                 {"cis": [[P/N, rev], ...]}
+    POST /lookup     {"cis": [[P/N, rev], ...]}     {"cis": [[P/N, rev, ECO or null], ...]}
+    POST /next_revs  {"pns": [P/N, ...]}            {"next_revs": {P/N: rev or null, ...}}
+"""
+
+import httplib
+import json
+import Queue
+import socket
+import urllib
+import urlparse
+
+import cid_cache
+import pnr
+import pnr_snapshot
+from cid_classes import *
+
+POOL_SIZE = 4
+BATCH_SIZE = 500
+TIMEOUT = 30
+
+
+class PNRServiceError(IOError):
+    """
+    The PNR web service couldn't be reached, or gave an answer that couldn't be understood.
+    """
+
+
+class ConnectionPool(object):
+    def __init__(self, url, size=POOL_SIZE, timeout=TIMEOUT):
+        """
+        Persistent HTTP connections to one server, reused across requests.
+
+        :param url: base URL of the server, ex. "http://pnr.example.com:8080/api"
+        :param size: most idle connections kept open
+        :param timeout: socket timeout, in seconds
+        """
+        parsed = urlparse.urlsplit(url)
+        if parsed.scheme not in ("http", "https"):
+            raise ValueError(url + " is not an http or https URL!")
+
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self._idle = Queue.LifoQueue(size)
+
+        # connections opened, for callers (and tests) checking that connections really are reused
+        self.connections_made = 0
+
+    def _connect(self):
+        self.connections_made += 1
+        if self.scheme == "https":
+            return httplib.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+
+        return httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None):
+        """
+        :return: the response's status and body.  A pooled connection the server has since closed is replaced
+                 and the request tried once more.
+        """
+        headers = {"Accept": "application/json"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+
+        for attempt in range(2):
+            try:
+                connection, reused = self._idle.get_nowait(), True
+            except Queue.Empty:
+                connection, reused = self._connect(), False
+
+            try:
+                connection.request(method, self.base_path + path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+
+            if response.getheader("connection", "").lower() == "close":
+                connection.close()
+            else:
+                try:
+                    self._idle.put_nowait(connection)
+                except Queue.Full:
+                    connection.close()
+
+            return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Queue.Empty:
+                return
+
+
+class PNRClient(object):
+    def __init__(self, url, pool_size=POOL_SIZE, batch_size=BATCH_SIZE, timeout=TIMEOUT):
+        """
+        :param url: base URL of the PNR web service
+        :param pool_size: most idle connections kept open
+        :param batch_size: most CIs or P/Ns sent in one request
+        :param timeout: socket timeout, in seconds
+        """
+        self.url = url
+        self.pool = ConnectionPool(url, pool_size, timeout)
+        self.batch_size = batch_size
+
+        # requests made, by path
+        self.request_counts = {}
+
+    def request(self, method, path, document=None):
+        """
+        :param document: JSON-serialisable request body, if any
+        :return: the decoded JSON response
+        :raises PNRServiceError: if the service can't be reached or doesn't answer with JSON
+        """
+        self.request_counts[path.split("/")[1]] = self.request_counts.get(path.split("/")[1], 0) + 1
+
+        body = json.dumps(document) if document is not None else None
+        try:
+            status, data = self.pool.request(method, path, body)
+        except (httplib.HTTPException, socket.error) as e:
+            raise PNRServiceError("Could not reach PNR service {} ({}).".format(self.url, e))
+
+        if status != 200:
+            raise PNRServiceError("PNR service {} answered {} {} with status {}.".format(self.url, method, path,
+                                                                                        status))
+        try:
+            return json.loads(data)
+        except ValueError:
+            raise PNRServiceError("PNR service {} answered {} {} with something other than "
+                                  "JSON.".format(self.url, method, path))
+
+    def batches(self, items):
+        items = list(items)
+        for start in range(0, len(items), self.batch_size):
+            yield items[start:start + self.batch_size]
+
+    def version(self):
+        return self.request("GET", "/version")["version"]
+
+    def warnings(self):
+        """
+        :return: a tuple of the log's warnings and its duplicate CIs
+        """
+        document = self.request("GET", "/warnings")
+        return document["warnings"], document["dupes"]
+
+    def all_cis(self):
+        return [tuple(ci) for ci in self.request("GET", "/cis")["cis"]]
+
+    def eco_cis(self, eco):
+        return [tuple(ci) for ci in self.request("GET", "/eco/" + urllib.quote(str(eco).strip(), safe=""))["cis"]]
+
+    def lookup(self, cis):
+        """
+        :param cis: iterable of (P/N, rev) tuples
+        :return: dict of the ECO each CI is released on (None if the log doesn't list it), keyed by (P/N, rev)
+        """
+        ecos = {}
+        for batch in self.batches(cis):
+            for pn, rev, eco in self.request("POST", "/lookup", {"cis": [list(ci) for ci in batch]})["cis"]:
+                ecos[(pn, rev)] = eco
+
+        return ecos
+
+    def next_revs(self, pns):
+        """
+        :param pns: iterable of P/Ns
+        :return: dict of the name of the rev after each P/N's max rev (None for an invalid P/N), keyed by P/N
+        """
+        next_revs = {}
+        for batch in self.batches(pns):
+            next_revs.update(self.request("POST", "/next_revs", {"pns": batch})["next_revs"])
+
+        return next_revs
+
+    def close(self):
+        self.pool.close()
+
+
+class HTTPParts(object):
+    def __init__(self, client, alphabet=STRICT_REV_ALPHABET, fingerprint=None):
+        """
+        The PN Reserve Log, as served by the PNR web service.  Answers the same lookups as a ListOfParts, from
+        results fetched in bulk by prefetch() (anything not prefetched is fetched when it's first asked for).
+
+        :param client: a PNRClient
+        :param alphabet: RevAlphabet used to build the Rev objects lookups return
+        :param fingerprint: the service's version of the log
+        """
+        self.client = client
+        self.alphabet = alphabet
+        self.fingerprint = fingerprint
+        self._ecos = {}
+        self._next_revs = {}
+
+    @staticmethod
+    def _key(pn, rev):
+        return str(pn).strip(), str(rev).strip()
+
+    def prefetch(self, cis):
+        """
+        :param cis: iterable of (P/N, rev) tuples, every CI the caller is going to look up
+        """
+        keys = set(self._key(pn, rev) for pn, rev in cis)
+        self._ecos.update(self.client.lookup(key for key in keys if key not in self._ecos))
+
+        pns = set(pn for pn, rev in keys if is_valid_part(pn))
+        self._next_revs.update(self.client.next_revs(pn for pn in pns if pn not in self._next_revs))
+
+    def lookup(self, cis):
+        cis = [self._key(pn, rev) for pn, rev in cis]
+        self._ecos.update(self.client.lookup(ci for ci in set(cis) if ci not in self._ecos))
+
+        return dict((ci, self._ecos[ci]) for ci in cis)
+
+    def eco(self, pn, rev):
+        key = self._key(pn, rev)
+        if key not in self._ecos:
+            self._ecos.update(self.client.lookup([key]))
+
+        return self._ecos[key]
+
+    def has_part(self, pn, rev):
+        return self.eco(pn, rev) is not None
+
+    def next_rev(self, pn):
+        if not is_valid_part(pn):
+            return None
+
+        if pn not in self._next_revs:
+            self._next_revs.update(self.client.next_revs([pn]))
+
+        return Rev(self._next_revs[pn], alphabet=self.alphabet)
+
+    def rev_before(self, pn, rev):
+        """
+        The service has no query for a part's revs, so the rev before another is never known here.  Callers fall
+        back to what the ECO form says the previous rev is.
+
+        :return: None
+        """
+        return None
+
+    def parts_for_eco(self, eco):
+        return self.client.eco_cis(eco)
+
+    def iter_cis(self):
+        return iter(self.client.all_cis())
+
+
+class XlsxBackend(object):
+    def __init__(self, pnr_path=None):
+        """
+        :param pnr_path: path of the xlsx/xlsm log, if not the one at pnr.PNRL_PATH
+        """
+        self.pnr_path = pnr_path
+
+    def load(self, alphabet=STRICT_REV_ALPHABET, diagnostics=None, progress=None):
+        """
+        :return: a tuple of the parts, the PNR warnings and the dupe CI list
+        """
+        return pnr.extract_part_nums_pnr(alphabet, self.pnr_path, diagnostics, progress)
+
+
+class SnapshotBackend(object):
+    def __init__(self, snapshot_path):
+        """
+        :param snapshot_path: path of the local snapshot of the log, rebuilt whenever the log changes
+        """
+        self.snapshot_path = snapshot_path
+
+    def load(self, alphabet=STRICT_REV_ALPHABET, diagnostics=None, progress=None):
+        return pnr_snapshot.load_pnr(self.snapshot_path, alphabet, diagnostics, progress)
+
+
+class HTTPBackend(object):
+    def __init__(self, url, pool_size=POOL_SIZE, batch_size=BATCH_SIZE, timeout=TIMEOUT):
+        """
+        :param url: base URL of the PNR web service
+        """
+        self.client = PNRClient(url, pool_size, batch_size, timeout)
+
+    def load(self, alphabet=STRICT_REV_ALPHABET, diagnostics=None, progress=None):
+        """
+        Nothing is fetched but the log's version and warnings; lookups are made as they're needed.
+
+        :raises PNRServiceError: if the service can't be reached
+        """
+        fingerprint = self.client.version()
+        pnr_warnings, pnr_dupe_pn_list = self.client.warnings()
+
+        return HTTPParts(self.client, alphabet, fingerprint), pnr_warnings, pnr_dupe_pn_list
+
+
+def open_backend(arguments):
+    """
+    :param arguments: argparse command line arguments, formatted into a hash
+    :return: the backend the arguments select: the PNR web service, a snapshot of the log, or the log itself
+    """
+    if arguments.get("pnr_url"):
+        return HTTPBackend(arguments["pnr_url"])
+
+    if arguments.get("pnr_snapshot"):
+        return SnapshotBackend(arguments["pnr_snapshot"])
+
+    return XlsxBackend()
+
+
+def fingerprint(pnr_list):
+    """
+    :param pnr_list: parts object returned by a backend
+    :return: text that changes whenever the log the parts came from does
+    """
+    if isinstance(pnr_list, (HTTPParts, pnr_snapshot.PNRSnapshot)):
+        return pnr_list.fingerprint
+
+    return cid_cache.pnr_fingerprint(pnr.PNRL_PATH)
@@ -0,0 +1,393 @@
+"""
+Frozen binary snapshot of the parsed PN Reserve Log.
+
+Parsing the reserve log with openpyxl takes far longer than anything else cid.py -p does, and on the build
+server several jobs do it at once.  A snapshot is written once per version of the log, then opened with mmap,
+so every process shares one copy in the page cache and starts almost instantly.  Lookups binary-search the
+mapped arrays; nothing is deserialised up front except the (short) list of distinct revs.
+
+File layout, all integers little-endian:
+
+    header          MAGIC, then entry count, rev count, ECO count, warning count, dupe count (5 x uint32)
+    part numbers    one uint64 per entry, the P/N's digits packed into an integer, sorted
+    rev ordinals    one uint32 per entry, index of the entry's rev in the string table's rev section
+    ECO ids         one uint32 per entry, index of the entry's ECO in the string table's ECO section
+    ECO index       one uint32 per entry, the entry indices grouped by ECO id (in ECO id order, then entry order)
+    ECO offsets     one uint32 per ECO, plus one for the end, the start of each ECO's group in the ECO index
+    string offsets  one uint32 per string, plus one for the end of the last string
+    strings         UTF-8 text: log fingerprint, rev alphabet name, revs (in rev order), ECOs, warnings, dupes
+
+Entries are sorted by P/N, then rev order, so each part's revs are contiguous and its max rev is its last entry.
+ECOs are sorted as text, so an ECO's id is found by binary search of the string table's ECO section.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+
+import cid_cache
+import cid_output
+import pnr
+from cid_classes import *
+
+MAGIC = b"CIDPNR\x00\x02"
+HEADER = struct.Struct("<8s5I")
+
+PN_SIZE = 8
+INDEX_SIZE = 4
+
+
+def pack_part(pn):
+    """
+    :param pn: a valid part number, ex. "123-456789-01"
+    :return: the part number's digits as an integer, ex. 12345678901
+    """
+    return int(pn.replace("-", ""))
+
+
+def unpack_part(packed_pn):
+    """
+    :param packed_pn: integer from pack_part()
+    :return: the part number as text
+    """
+    digits = "%011d" % packed_pn
+    return "{}-{}-{}".format(digits[:3], digits[3:9], digits[9:])
+
+
+def write_snapshot(snapshot_path, pnr_list, pnr_warnings, pnr_dupe_pn_list, fingerprint):
+    """
+    Write a snapshot via a temp file, renamed into place once it's complete, so a process that is reading the
+    previous snapshot never sees a partial one.
+
+    :param snapshot_path: path of the snapshot to (over)write
+    :param pnr_list: ListOfParts holding the contents of the PN Reserve Log
+    :param pnr_warnings: warnings generated while the log was parsed
+    :param pnr_dupe_pn_list: CIs listed in the log more than once
+    :param fingerprint: cid_cache.pnr_fingerprint() of the log the ListOfParts was read from
+    """
+    alphabet = pnr_list.alphabet
+
+    rev_names = set()
+    eco_names = set()
+    for part in pnr_list.parts.values():
+        for rev in part.revs.values():
+            rev_names.add(rev.name)
+            eco_names.add(rev.eco)
+
+    rev_names = sorted(rev_names, key=alphabet.order_key)
+    eco_names = sorted(eco_names)
+    rev_ordinals = dict((name, ordinal) for ordinal, name in enumerate(rev_names))
+    eco_ids = dict((name, eco_id) for eco_id, name in enumerate(eco_names))
+
+    entries = []
+    for pn, part in pnr_list.parts.items():
+        for rev in part.revs.values():
+            entries.append((pack_part(pn), rev_ordinals[rev.name], eco_ids[rev.eco]))
+    entries.sort()
+
+    # the reverse index: for each ECO, the entries released on it
+    eco_entries = [[] for _ in eco_names]
+    for index, entry in enumerate(entries):
+        eco_entries[entry[2]].append(index)
+
+    eco_index = []
+    eco_offsets = [0]
+    for indices in eco_entries:
+        eco_index += indices
+        eco_offsets.append(len(eco_index))
+
+    strings = [fingerprint, alphabet.name] + rev_names + eco_names + list(pnr_warnings) + list(pnr_dupe_pn_list)
+    encoded = [unicode(string).encode("utf-8") if not isinstance(string, str) else string for string in strings]
+
+    offsets = [0]
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+
+    snapshot_dir = os.path.dirname(snapshot_path) or "."
+    temp_fd, temp_path = tempfile.mkstemp(prefix="." + os.path.basename(snapshot_path) + ".", dir=snapshot_dir)
+    try:
+        with os.fdopen(temp_fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(entries), len(rev_names), len(eco_names), len(pnr_warnings),
+                                len(pnr_dupe_pn_list)))
+            f.write(struct.pack("<{}Q".format(len(entries)), *[entry[0] for entry in entries]))
+            f.write(struct.pack("<{}I".format(len(entries)), *[entry[1] for entry in entries]))
+            f.write(struct.pack("<{}I".format(len(entries)), *[entry[2] for entry in entries]))
+            f.write(struct.pack("<{}I".format(len(eco_index)), *eco_index))
+            f.write(struct.pack("<{}I".format(len(eco_offsets)), *eco_offsets))
+            f.write(struct.pack("<{}I".format(len(offsets)), *offsets))
+            f.write(b"".join(encoded))
+        # every job on the build server reads the snapshot, not just the user who happened to write it
+        os.chmod(temp_path, cid_output.new_file_mode())
+        cid_output.replace_file(temp_path, snapshot_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class PNRSnapshot(object):
+    def __init__(self, snapshot_path, alphabet=STRICT_REV_ALPHABET):
+        """
+        A read-only, memory-mapped PN Reserve Log snapshot.  Answers the same lookups as a ListOfParts.
+
+        :param snapshot_path: path of a snapshot written by write_snapshot()
+        :param alphabet: RevAlphabet used to build the Rev objects lookups return
+        :raises ValueError: if the file isn't a snapshot
+        """
+        self.path = snapshot_path
+        self.alphabet = alphabet
+
+        with open(snapshot_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < HEADER.size:
+            self.close()
+            raise ValueError(snapshot_path + " is not a PNR snapshot!")
+
+        magic, self.entry_count, rev_count, eco_count, warning_count, dupe_count = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(snapshot_path + " is not a PNR snapshot!")
+
+        self._pn_offset = HEADER.size
+        self._rev_offset = self._pn_offset + PN_SIZE * self.entry_count
+        self._eco_offset = self._rev_offset + INDEX_SIZE * self.entry_count
+        self._eco_index_offset = self._eco_offset + INDEX_SIZE * self.entry_count
+        self._eco_offsets_offset = self._eco_index_offset + INDEX_SIZE * self.entry_count
+        self._string_offset = self._eco_offsets_offset + INDEX_SIZE * (eco_count + 1)
+        self._string_count = 2 + rev_count + eco_count + warning_count + dupe_count
+        self._blob_offset = self._string_offset + INDEX_SIZE * (self._string_count + 1)
+
+        self.fingerprint = self._string(0)
+        self.alphabet_name = self._string(1)
+
+        # the few distinct revs are read up front, so a rev can be turned into its ordinal with one dict lookup
+        self._first_rev = 2
+        self._first_eco = self._first_rev + rev_count
+        self.eco_count = eco_count
+        self.rev_names = [self._string(self._first_rev + ordinal) for ordinal in range(rev_count)]
+        self.rev_ordinals = dict((name, ordinal) for ordinal, name in enumerate(self.rev_names))
+
+        first_warning = self._first_eco + eco_count
+        first_dupe = first_warning + warning_count
+        self.warnings = [self._string(index) for index in range(first_warning, first_dupe)]
+        self.dupes = [self._string(index) for index in range(first_dupe, first_dupe + dupe_count)]
+
+    def close(self):
+        self._map.close()
+
+    def _string(self, index):
+        start, end = struct.unpack_from("<2I", self._map, self._string_offset + INDEX_SIZE * index)
+        return self._map[self._blob_offset + start:self._blob_offset + end].decode("utf-8")
+
+    def _pn_at(self, index):
+        return struct.unpack_from("<Q", self._map, self._pn_offset + PN_SIZE * index)[0]
+
+    def _rev_at(self, index):
+        return struct.unpack_from("<I", self._map, self._rev_offset + INDEX_SIZE * index)[0]
+
+    def _eco_at(self, index):
+        return struct.unpack_from("<I", self._map, self._eco_offset + INDEX_SIZE * index)[0]
+
+    def _part_range(self, pn):
+        """
+        :return: (start, end) entry indices of pn's revs; start == end if pn isn't in the snapshot
+        """
+        if not is_valid_part(pn):
+            return 0, 0
+
+        packed_pn = pack_part(pn)
+
+        low, high = 0, self.entry_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._pn_at(middle) < packed_pn:
+                low = middle + 1
+            else:
+                high = middle
+        start = low
+
+        high = self.entry_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._pn_at(middle) <= packed_pn:
+                low = middle + 1
+            else:
+                high = middle
+
+        return start, low
+
+    def _find(self, pn, rev):
+        """
+        :return: the entry index of pn at rev, or None if the snapshot doesn't list it
+        """
+        ordinal = self.rev_ordinals.get(str(rev).strip())
+        if ordinal is None:
+            return None
+
+        low, end = self._part_range(pn)
+        high = end
+        while low < high:
+            middle = (low + high) // 2
+            if self._rev_at(middle) < ordinal:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < end and self._rev_at(low) == ordinal:
+            return low
+
+        return None
+
+    def has_part(self, pn, rev):
+        return self._find(pn, rev) is not None
+
+    def eco(self, pn, rev):
+        """
+        :return: the ECO the log lists pn at rev as released on, or None if the log doesn't list it
+        """
+        index = self._find(pn, rev)
+        if index is None:
+            return None
+
+        return self._string(self._first_eco + self._eco_at(index))
+
+    def _eco_id(self, eco):
+        """
+        :return: the id of eco in the snapshot's string table, or None if no CI is released on it
+        """
+        eco = unicode(eco).strip()
+
+        low, high = 0, self.eco_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._string(self._first_eco + middle) < eco:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.eco_count and self._string(self._first_eco + low) == eco:
+            return low
+
+        return None
+
+    def parts_for_eco(self, eco):
+        """
+        :param eco: an ECO number
+        :return: a list of (P/N, rev) tuples, one per CI released on eco, sorted by P/N then rev
+        """
+        eco_id = self._eco_id(eco)
+        if eco_id is None:
+            return []
+
+        start, end = struct.unpack_from("<2I", self._map, self._eco_offsets_offset + INDEX_SIZE * eco_id)
+        indices = struct.unpack_from("<{}I".format(end - start), self._map,
+                                     self._eco_index_offset + INDEX_SIZE * start)
+
+        return [(unpack_part(self._pn_at(index)), self.rev_names[self._rev_at(index)]) for index in indices]
+
+    def iter_cis(self):
+        """
+        :return: a generator of (P/N, rev, ECO) tuples, one per CI in the snapshot, sorted by P/N then rev
+        """
+        for index in range(self.entry_count):
+            yield (unpack_part(self._pn_at(index)), self.rev_names[self._rev_at(index)],
+                   self._string(self._first_eco + self._eco_at(index)))
+
+    def lookup(self, cis):
+        """
+        :param cis: iterable of (P/N, rev) tuples
+        :return: dict of the ECO each CI is released on (None if the log doesn't list it), keyed by (P/N, rev)
+        """
+        return dict(((pn, rev), self.eco(pn, rev)) for pn, rev in cis)
+
+    def prefetch(self, cis):
+        """
+        The snapshot is memory-mapped, so there's nothing to fetch.
+        """
+
+    def rev_before(self, pn, rev):
+        """
+        :return: the greatest rev of pn in the snapshot earlier than rev, or None if there isn't one
+        """
+        order_key = self.alphabet.order_key(str(rev).strip())
+
+        # rev ordinals follow rev order, so the part's entries are searched on their revs' order keys
+        start, high = self._part_range(pn)
+        low = start
+        while low < high:
+            middle = (low + high) // 2
+            if self.alphabet.order_key(self.rev_names[self._rev_at(middle)]) < order_key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == start:
+            return None
+
+        return Rev(self.rev_names[self._rev_at(low - 1)], alphabet=self.alphabet)
+
+    def next_rev(self, pn):
+        if not is_valid_part(pn):
+            return None
+
+        start, end = self._part_range(pn)
+        if start == end:
+            return Rev("-", alphabet=self.alphabet)
+
+        return Rev(self.rev_names[self._rev_at(end - 1)], alphabet=self.alphabet).next_rev
+
+
+def open_snapshot(snapshot_path, alphabet=STRICT_REV_ALPHABET):
+    """
+    :return: a PNRSnapshot, or None if there isn't a readable snapshot at snapshot_path
+    """
+    try:
+        return PNRSnapshot(snapshot_path, alphabet)
+    except (IOError, OSError, ValueError, struct.error, mmap.error):
+        return None
+
+
+def load_pnr(snapshot_path, alphabet=STRICT_REV_ALPHABET, diagnostics=None, progress=None):
+    """
+    Load the PN Reserve Log through a snapshot: the snapshot is used if it was made from the current log with the
+    same rev alphabet, otherwise the log is parsed as usual and the snapshot is rewritten.
+
+    :param snapshot_path: path of the snapshot
+    :param alphabet: RevAlphabet the log's revs are built with
+    :param diagnostics: a DiagnosticLog that receives any errors and warnings
+    :param progress: a cid_progress.Progress that receives progress reading the log, if it has to be read
+    :return: a tuple of the parts (a PNRSnapshot or ListOfParts), the PNR warnings and the dupe CI list
+    """
+    if diagnostics is None:
+        diagnostics = DiagnosticLog()
+
+    fingerprint = cid_cache.pnr_fingerprint(pnr.PNRL_PATH)
+    snapshot = open_snapshot(snapshot_path, alphabet)
+
+    if snapshot and snapshot.alphabet_name == alphabet.name:
+        if snapshot.fingerprint == fingerprint:
+            return snapshot, list(snapshot.warnings), list(snapshot.dupes)
+
+        # the log lives on a network share; an old snapshot is better than no PNR checks at all
+        if not fingerprint:
+            diagnostics.warning("pnr-snapshot-stale", "\nPNR WARNING: PN Reserve Log not found at path:\n       {}\n"
+                                                      "       Using snapshot {} instead.".format(pnr.PNRL_PATH,
+                                                                                              snapshot_path))
+            return snapshot, list(snapshot.warnings), list(snapshot.dupes)
+
+    if snapshot:
+        snapshot.close()
+
+    pnr_list, pnr_warnings, pnr_dupe_pn_list = pnr.extract_part_nums_pnr(alphabet, diagnostics=diagnostics,
+                                                                         progress=progress)
+
+    try:
+        write_snapshot(snapshot_path, pnr_list, pnr_warnings, pnr_dupe_pn_list, fingerprint)
+    except (IOError, OSError) as e:
+        # ex. another process on Windows still has the old snapshot mapped; the next run will try again
+        diagnostics.warning("pnr-snapshot-write", "\nPNR WARNING: Could not write PNR snapshot {} "
+                                                  "({}).".format(snapshot_path, e))
+
+    return pnr_list, pnr_warnings, pnr_dupe_pn_list
@@ -0,0 +1,336 @@
+"""
+Write-back of new CIs to the PN Reserve Log.
+
+Saving the log through openpyxl breaks its macros, and loading and re-saving the whole workbook to append a
+handful of rows is very slow.  Instead, the PN_Rev sheet's XML part is patched in place: the new rows are
+inserted just before the end of its <sheetData> element, as inline strings, so the shared string table doesn't
+have to change.  Every other part of the xlsm (macros, styles, other sheets) is copied into the new archive
+still compressed, byte for byte, and the new archive is renamed over the log once it is complete.
+
+Writers take an advisory lock (a lock file created with O_EXCL next to the log) for the duration of the update,
+and refuse to write if the log has changed since it was read, since the CIs to add were decided from that read.
+"""
+
+import os
+import re
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import time
+import zipfile
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape
+
+import cid_cache
+import cid_output
+import pnr
+import pnr_snapshot
+from cid_classes import *
+
+PNR_SHEET_NAME = "PN_Rev"
+
+LOCK_SUFFIX = ".lock"
+LOCK_WAIT = 30
+LOCK_POLL_INTERVAL = 0.5
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+DOC_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+SHEET_DATA_END_RE = re.compile(r"</(\w+:)?sheetData>")
+EMPTY_SHEET_DATA_RE = re.compile(r"<(\w+:)?sheetData\s*/>")
+ROW_NUMBER_RE = re.compile(r'<(?:\w+:)?row\b[^>]*?\br="(\d+)"')
+DIMENSION_RE = re.compile(r'(<(?:\w+:)?dimension\b[^>]*?\bref="[A-Z]+\d+:[A-Z]+)(\d+)(")')
+
+
+def acquire_lock(pnr_path, wait=LOCK_WAIT):
+    """
+    Take the advisory write lock on the PN Reserve Log, waiting up to wait seconds for another writer to finish.
+
+    :param pnr_path: path of the PN Reserve Log
+    :return: path of the lock file, to pass to release_lock()
+    """
+    lock_path = pnr_path + LOCK_SUFFIX
+    give_up_at = time.time() + wait
+
+    while True:
+        try:
+            lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            if time.time() >= give_up_at:
+                print "\nPNR ERROR: PN Reserve Log is being updated by someone else.  If no update is running,\n" \
+                      "           delete the lock file {} and try again.".format(lock_path)
+                sys.exit(1)
+            time.sleep(LOCK_POLL_INTERVAL)
+            continue
+
+        # who holds the lock, for whoever finds it left behind
+        os.write(lock_fd, "{} {} {}\n".format(socket.gethostname(), os.getpid(), time.strftime("%Y-%m-%d %H:%M:%S")))
+        os.close(lock_fd)
+        return lock_path
+
+
+def release_lock(lock_path):
+    try:
+        os.remove(lock_path)
+    except OSError:
+        pass
+
+
+def find_sheet_part(archive, sheet_name=PNR_SHEET_NAME):
+    """
+    :param archive: zipfile.ZipFile of the workbook
+    :param sheet_name: name of the worksheet, as shown on its tab
+    :return: name of the zip member holding the worksheet's XML, or None if the workbook has no such sheet
+    """
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    relationship_id = None
+    for sheet in workbook.iter("{%s}sheet" % MAIN_NS):
+        if sheet.get("name") == sheet_name:
+            relationship_id = sheet.get("{%s}id" % DOC_REL_NS)
+
+    if not relationship_id:
+        return None
+
+    relationships = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    for relationship in relationships.iter("{%s}Relationship" % PKG_REL_NS):
+        if relationship.get("Id") == relationship_id:
+            target = relationship.get("Target")
+            if target.startswith("/"):
+                return target[1:]
+            return "xl/" + target
+
+    return None
+
+
+def inline_cell(reference, value, prefix=""):
+    """
+    :return: the XML for one cell: a number if value is all digits, otherwise an inline string
+    """
+    value = unicode(value)
+    if value.isdigit():
+        return '<{0}c r="{1}"><{0}v>{2}</{0}v></{0}c>'.format(prefix, reference, value)
+
+    return '<{0}c r="{1}" t="inlineStr"><{0}is><{0}t>{2}</{0}t></{0}is></{0}c>'.format(prefix, reference,
+                                                                                        escape(value))
+
+
+def append_rows(sheet_xml, cis):
+    """
+    :param sheet_xml: the worksheet's XML, as UTF-8 bytes
+    :param cis: list of (P/N, rev, ECO) tuples to append, in order
+    :return: a tuple of the patched XML and a list of the row numbers the CIs were written to
+    """
+    end_match = None
+    for end_match in SHEET_DATA_END_RE.finditer(sheet_xml):
+        pass
+
+    # a sheet with no rows at all may have an empty <sheetData/>, which is opened up to take the new rows
+    if end_match is None:
+        empty_match = EMPTY_SHEET_DATA_RE.search(sheet_xml)
+        if empty_match is None:
+            raise ValueError("worksheet has no <sheetData> element")
+
+        prefix = empty_match.group(1) or ""
+        sheet_xml = sheet_xml[:empty_match.start()] + "<{0}sheetData></{0}sheetData>".format(prefix) + \
+            sheet_xml[empty_match.end():]
+        end_match = SHEET_DATA_END_RE.search(sheet_xml, empty_match.start())
+
+    prefix = end_match.group(1) or ""
+
+    # rows are in order, so the last row element before </sheetData> holds the last row number in use
+    last_row = 0
+    row_start = sheet_xml.rfind("<{}row".format(prefix), 0, end_match.start())
+    if row_start >= 0:
+        last_row = int(ROW_NUMBER_RE.match(sheet_xml, row_start).group(1))
+
+    rows = []
+    row_numbers = []
+    for pn, rev, eco in cis:
+        last_row += 1
+        row_numbers.append(last_row)
+        rows.append('<{0}row r="{1}">{2}{3}{4}</{0}row>'.format(prefix, last_row,
+                                                              inline_cell("A{}".format(last_row), pn, prefix),
+                                                              inline_cell("C{}".format(last_row), rev, prefix),
+                                                              inline_cell("D{}".format(last_row), eco, prefix)))
+
+    patched = sheet_xml[:end_match.start()] + "".join(rows).encode("utf-8") + sheet_xml[end_match.start():]
+
+    # keep the sheet's used range covering the new rows
+    dimension = DIMENSION_RE.search(patched)
+    if dimension and int(dimension.group(2)) < last_row:
+        patched = patched[:dimension.start()] + dimension.group(1) + str(last_row) + dimension.group(3) + \
+            patched[dimension.end():]
+
+    return patched, row_numbers
+
+
+def copy_member(source, destination, member):
+    """
+    Copy a member of one zip archive into another as it is, still compressed, rather than decompressing it and
+    compressing it again.
+
+    :param source: zipfile.ZipFile the member is read from
+    :param destination: zipfile.ZipFile, open for writing, the member is added to
+    :param member: the member's ZipInfo in source
+    """
+    # the member's data follows its local header, whose file name and extra field lengths are the last two fields
+    source.fp.seek(member.header_offset)
+    header = source.fp.read(zipfile.sizeFileHeader)
+    if header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipfile("bad local header for " + member.filename)
+    name_length, extra_length = struct.unpack("<2H", header[26:30])
+    source.fp.seek(name_length + extra_length, os.SEEK_CUR)
+    data = source.fp.read(member.compress_size)
+
+    copied_member = zipfile.ZipInfo(member.filename, member.date_time)
+    for field in ("compress_type", "comment", "extra", "create_system", "create_version", "extract_version",
+                  "flag_bits", "volume", "internal_attr", "external_attr", "CRC", "compress_size", "file_size"):
+        setattr(copied_member, field, getattr(member, field))
+
+    # the CRC and sizes are known, so they go in the local header rather than in a data descriptor after the data
+    copied_member.flag_bits &= ~0x08
+
+    copied_member.header_offset = destination.fp.tell()
+    destination.fp.write(copied_member.FileHeader())
+    destination.fp.write(data)
+    destination.filelist.append(copied_member)
+    destination.NameToInfo[copied_member.filename] = copied_member
+    destination._didModify = True
+
+
+def write_rows(pnr_path, cis, sheet_name=PNR_SHEET_NAME):
+    """
+    Append rows to a worksheet of an xlsx/xlsm workbook, leaving every other part of the workbook unchanged.
+
+    :param pnr_path: path of the workbook
+    :param cis: list of (P/N, rev, ECO) tuples to append, in order
+    :param sheet_name: name of the worksheet
+    :return: a list of the row numbers the CIs were written to
+    """
+    pnr_dir = os.path.dirname(pnr_path) or "."
+    temp_fd, temp_path = tempfile.mkstemp(prefix="." + os.path.basename(pnr_path) + ".", dir=pnr_dir)
+
+    try:
+        with zipfile.ZipFile(pnr_path, "r") as source:
+            sheet_part = find_sheet_part(source, sheet_name)
+            if sheet_part is None:
+                raise ValueError("workbook has no {} sheet".format(sheet_name))
+
+            with os.fdopen(temp_fd, "wb") as f:
+                with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as destination:
+                    for member in source.infolist():
+                        if member.filename != sheet_part:
+                            copy_member(source, destination, member)
+                            continue
+
+                        data, row_numbers = append_rows(source.read(member), cis)
+
+                        copied_member = zipfile.ZipInfo(member.filename, member.date_time)
+                        copied_member.compress_type = member.compress_type
+                        copied_member.external_attr = member.external_attr
+                        copied_member.create_system = member.create_system
+                        destination.writestr(copied_member, data)
+
+        # the log is shared, so it keeps its own permissions rather than mkstemp()'s 0600
+        shutil.copymode(pnr_path, temp_path)
+        cid_output.replace_file(temp_path, pnr_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return row_numbers
+
+
+def is_eco_number(eco):
+    """
+    :param eco: an ECO number, as text
+    :return: True if eco looks like an ECO number (digits only)
+    """
+    return str(eco).strip().isdigit()
+
+
+def new_cis(ci_records, pnr_list):
+    """
+    :param ci_records: list of CI dicts built by extract_ps1_tab_part_nums()
+    :param pnr_list: the contents of the PN Reserve Log, in a ListOfParts or PNRSnapshot object
+    :return: a list of (P/N, rev, ECO) tuples, one for each new CI on the ECO that isn't in the log yet
+    """
+    cis = []
+    seen = set()
+
+    for ci_record in ci_records:
+        key = ci_record["pn"], ci_record["rev"]
+        if ci_record["status"] != "new" or key in seen or pnr_list.has_part(*key):
+            continue
+
+        seen.add(key)
+        cis.append((ci_record["pn"], ci_record["rev"], ci_record["eco"]))
+
+    return cis
+
+
+def update_pnr(cis, pnr_list, fingerprint, pnr_warnings=None, pnr_dupe_pn_list=None, snapshot_path=None):
+    """
+    Append CIs to the PN Reserve Log, then bring the in-memory log (and its snapshot, if one is used) up to date
+    without reading the log again.
+
+    :param cis: list of (P/N, rev, ECO) tuples to append, from new_cis()
+    :param pnr_list: the contents of the PN Reserve Log, in a ListOfParts or PNRSnapshot object
+    :param fingerprint: cid_cache.pnr_fingerprint() of the log when pnr_list was read from it
+    :param pnr_warnings: warnings generated while the log was read, kept in the updated snapshot
+    :param pnr_dupe_pn_list: CIs listed in the log more than once, kept in the updated snapshot
+    :param snapshot_path: path of the PNR snapshot to update, if any
+    :return: the updated contents of the log, a ListOfParts (which is pnr_list itself, if it was one)
+    """
+    if not cis:
+        print "\nPN Reserve Log already lists every new CI on this ECO."
+        return pnr_list
+
+    # the ECO comes from the ECO form's CoverSheet; a blank cell would add every CI as released on ECO "None"
+    for pn, rev, eco in cis:
+        if not is_eco_number(eco):
+            print "\nPNR ERROR: ECO form's ECO number (CoverSheet cell S2) is '{}', which is not an ECO number, so " \
+                  "its\n           CIs were not added to the PN Reserve Log.".format(eco)
+            sys.exit(1)
+
+    pnr_path = pnr.PNRL_PATH
+    lock_path = acquire_lock(pnr_path)
+    try:
+        if cid_cache.pnr_fingerprint(pnr_path) != fingerprint:
+            print "\nPNR ERROR: PN Reserve Log changed after it was read, so it was not updated.  Run again to " \
+                  "add\n           this ECO's new CIs."
+            sys.exit(1)
+
+        print "\nAdding {} new CIs to the PN Reserve Log...".format(len(cis))
+        row_numbers = write_rows(pnr_path, cis)
+        new_fingerprint = cid_cache.pnr_fingerprint(pnr_path)
+    finally:
+        release_lock(lock_path)
+
+    # a snapshot is read-only, so its contents are copied into a ListOfParts that can take the new CIs.  The
+    # snapshot is closed once copied, since on Windows a file that's still mapped can't be replaced.
+    if not isinstance(pnr_list, ListOfParts):
+        snapshot_list = ListOfParts(alphabet=pnr_list.alphabet)
+        for pn, rev, eco in pnr_list.iter_cis():
+            snapshot_list.add_part(pn, rev, eco)
+        pnr_list.close()
+        pnr_list = snapshot_list
+
+    for (pn, rev, eco), row_num in zip(cis, row_numbers):
+        pnr_list.add_part(pn, rev, eco, row_num)
+        print "  Row {}: {} Rev. {}, ECO {}".format(row_num, pn, rev, eco)
+
+    # the log itself is already updated; a stale snapshot is caught by its fingerprint and rebuilt next run
+    if snapshot_path:
+        try:
+            pnr_snapshot.write_snapshot(snapshot_path, pnr_list, pnr_warnings or [], pnr_dupe_pn_list or [],
+                                        new_fingerprint)
+        except (IOError, OSError) as e:
+            print "\nPNR WARNING: Could not update PNR snapshot {} ({}).  It will be rebuilt from the PN Reserve " \
+                  "Log\n             on the next run.".format(snapshot_path, e)
+
+    return pnr_list
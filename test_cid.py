@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import openpyxl
+
+from cid_classes import *
+import cid
+
+
+def make_eco_form(path, rows, eco="12345"):
+    """
+    Write a small ECO form, form rev C1 (the wide CI_Sheet layout), with rows listed from CI_Sheet row 5.
+
+    :param rows: list of (P/N, cur rev, new rev, ECO cell, description, media type) tuples
+    """
+    workbook = openpyxl.Workbook()
+    cover_sheet = workbook.active
+    cover_sheet.title = "CoverSheet"
+    cover_sheet["S2"] = eco
+    cover_sheet["A44"] = "C1"
+
+    ci_sheet = workbook.create_sheet(title="CI_Sheet")
+    for row_num in range(1, 5):
+        ci_sheet["A{}".format(row_num)] = "header"
+    for row_num, (pn, cur_rev, new_rev, eco_cell, description, media_type) in enumerate(rows, 5):
+        ci_sheet["A{}".format(row_num)] = pn
+        ci_sheet["B{}".format(row_num)] = cur_rev
+        ci_sheet["C{}".format(row_num)] = new_rev
+        ci_sheet["E{}".format(row_num)] = eco_cell
+        ci_sheet["F{}".format(row_num)] = description
+        ci_sheet["G{}".format(row_num)] = media_type
+
+    workbook.save(path)
+
+
+class CidTest(unittest.TestCase):
+
+    def setUp(self):
+        self.eco_dir = tempfile.mkdtemp()
+        self.eco_path = os.path.join(self.eco_dir, "eco.xlsx")
+
+    def tearDown(self):
+        shutil.rmtree(self.eco_dir)
+
+    def extract(self, rows, pnr_list=None, jobs=1):
+        make_eco_form(self.eco_path, rows)
+        flags = ["-a", "-p"] if pnr_list is not None else ["-a"]
+        arguments = vars(cid.make_parser().parse_args(flags + ["-j", str(jobs), self.eco_path]))
+        diagnostics = DiagnosticLog(echo=False)
+        ci_records = []
+        self.cid_texts = {}
+        self.cid_tables = cid.extract_ps1_tab_part_nums(arguments, pnr_list, diagnostics=diagnostics,
+                                                        ci_records=ci_records, cid_texts=self.cid_texts)[0]
+
+        return ci_records, diagnostics
+
+    def test_dup_status(self):
+        ci_records, diagnostics = self.extract([
+            ("139-000001-00", "A", "B", None, "Top assembly", "CD1"),
+            ("065-000002-00", "A", "B", "dup", "Listed first, wrongly marked dup", None),
+            ("065-000002-00", "A", "B", "dup", "Listed again", None),
+            ("065-000003-00", "A", "B", None, "Listed first", None),
+            ("065-000003-00", "A", "B", None, "Listed again, not marked dup", None)])
+
+        # only a CI listed before is a dup, whatever its ECO cell says
+        self.assertEqual([(ci_record["row"], ci_record["status"]) for ci_record in ci_records],
+                         [(5, "new"), (6, "new"), (7, "dup"), (8, "new"), (9, "dup")])
+        self.assertEqual([record.row for record in diagnostics.query(code="dup-marked-new")], [6])
+        self.assertEqual([record.row for record in diagnostics.query(code="dup-not-marked")], [9])
+
+    def test_pnr_prev_rev(self):
+        pnr_list = ListOfParts()
+        pnr_list.add_part("139-000001-00", "B", "12345")
+        pnr_list.add_part("065-000002-00", "A", "11111")
+        pnr_list.add_part("065-000002-00", "B", "11500")
+        pnr_list.add_part("065-000003-00", "A", "11111")
+        pnr_list.add_part("065-000003-00", "C", "11500")
+
+        ci_records, diagnostics = self.extract([
+            ("139-000001-00", "A", "B", None, "Top assembly", "CD1"),
+            ("065-000002-00", "A", "C", None, "Cur Rev is stale, but C follows the log's B", None),
+            ("065-000003-00", "A", "D", None, "D follows the log's C", None),
+            ("065-000003-00", "C", "B", None, "B is before the Cur Rev", None),
+            ("065-000002-00", "A", "E", None, "E skips the rev after the log's B", None)], pnr_list)
+
+        # the new rev should follow the log's rev before it, or the form's Cur Rev if that's later
+        self.assertEqual([(record.row, record.args["prev_rev"], record.args["expected"])
+                          for record in diagnostics.query(code="pnr-prev-rev")],
+                         [(8, "C", "D"), (9, "B", "C")])
+
+    def test_jobs(self):
+        rows = [
+            ("139-000001-00", "A", "B", None, "Top assembly", "CD1"),
+            ("065-000002-00", "A", "B", None, "CD1 part", None),
+            ("139-000004-00", "A", "B", None, "Top assembly", "CD2"),
+            ("065-000002-00", "A", "B", "dup", "Listed again, on another CD", None),
+            ("065-000005-00", "A", "B", None, "CD2 part", None),
+            ("139-000006-00", "A", "B", None, "Top assembly", "DVD")]
+
+        self.extract(rows)
+        cid_tables, cid_texts = self.cid_tables, self.cid_texts
+        self.assertEqual(sorted(cid_tables), ["139-000001-00-B", "139-000004-00-B", "139-000006-00-B"])
+        self.assertIn("065-000005-00", cid_texts["139-000004-00-B"])
+
+        # each set's table is built and formatted on its own worker, but comes back the same as in-process
+        self.extract(rows, jobs=2)
+        self.assertEqual(self.cid_tables, cid_tables)
+        self.assertEqual(self.cid_texts, cid_texts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,6 @@
+import json
+import StringIO
+import sys
 import unittest
 
 from cid_classes import *
@@ -47,6 +50,32 @@ class CidClassesTest(unittest.TestCase):
         self.assertEqual(Rev("B1").next_rev, Rev("C"))
         self.assertEqual(Rev("CA7").next_rev, Rev("CB"))
 
+    def test_rev_alphabets(self):
+        # the permissive alphabet allows invalid revs to be created, but never suggests one
+        with self.assertRaises(ValueError):
+            Rev("I")
+        self.assertEqual(Rev("I", alphabet=PERMISSIVE_REV_ALPHABET).name, "I")
+        self.assertFalse(is_valid_rev("I", alphabet=PERMISSIVE_REV_ALPHABET))
+        self.assertTrue(is_valid_rev("I", mode=2, alphabet=PERMISSIVE_REV_ALPHABET))
+
+        self.assertEqual(Rev("H", alphabet=PERMISSIVE_REV_ALPHABET).next_rev.name, "J")
+        self.assertEqual(Rev("T", alphabet=PERMISSIVE_REV_ALPHABET).next_rev.name, "U")
+        self.assertEqual(Rev("Y", alphabet=PERMISSIVE_REV_ALPHABET).next_rev.name, "AA")
+        self.assertTrue(Rev("S", alphabet=PERMISSIVE_REV_ALPHABET) > Rev("R", alphabet=PERMISSIVE_REV_ALPHABET))
+
+        # the two alphabets can be used side by side
+        strict_list = ListOfParts()
+        permissive_list = ListOfParts(alphabet=PERMISSIVE_REV_ALPHABET)
+        with self.assertRaises(ValueError):
+            strict_list.add_part("123-456789-01", "O")
+        self.assertTrue(permissive_list.add_part("123-456789-01", "O"))
+        self.assertEqual(permissive_list.next_rev("123-456789-01").name, "P")
+
+        # next revs are remembered per alphabet
+        self.assertEqual(Rev("O", alphabet=PERMISSIVE_REV_ALPHABET).next_rev.name, "P")
+        self.assertEqual(PERMISSIVE_REV_ALPHABET.next_revs["O"], "P")
+        self.assertFalse("O" in STRICT_REV_ALPHABET.next_revs)
+
     def test_valid_part_numbers(self):
         self.assertEqual(Part("123-456789-01").number, "123-456789-01")
         self.assertEqual(Part("145-123456-00").number, "145-123456-00")
@@ -94,6 +123,32 @@ class CidClassesTest(unittest.TestCase):
         self.assertEqual(my_part.max_rev, Rev("C"))
         self.assertFalse(my_part.has_rev("D"))
 
+    def test_rev_history(self):
+        my_part = Part("123-456789-01")
+
+        # added out of order, as they might be listed in the PN Reserve Log
+        my_part.add_rev("C", "12000", row=7)
+        my_part.add_rev("A", "10000", row=3)
+        my_part.add_rev("B1", "11500", row=5)
+        my_part.add_rev("B", "11000", row=4)
+        my_part.add_rev("D", "TBD", row=9)
+
+        self.assertEqual([rev.name for rev in my_part.history], ["A", "B", "B1", "C", "D"])
+        self.assertEqual(my_part.history[2].row, 5)
+        self.assertTrue(my_part.max_rev is my_part.history[-1])
+
+        self.assertEqual(my_part.rev_before("C").name, "B1")
+        self.assertEqual(my_part.rev_before("A"), None)
+        self.assertEqual(my_part.rev_after("B").name, "B1")
+        self.assertEqual(my_part.rev_after("D"), None)
+        self.assertEqual([rev.name for rev in my_part.revs_after("B1")], ["C", "D"])
+        self.assertEqual([rev.name for rev in my_part.revs_between("B", "C")], ["B", "B1", "C"])
+
+        self.assertEqual(my_part.latest_rev_as_of("9999"), None)
+        self.assertEqual(my_part.latest_rev_as_of("11000").name, "B")
+        self.assertEqual(my_part.latest_rev_as_of("11999").name, "B1")
+        self.assertEqual(my_part.latest_rev_as_of("99999").name, "C")
+
     def test_add_part(self):
         my_list = ListOfParts()
 
@@ -109,6 +164,33 @@ class CidClassesTest(unittest.TestCase):
         # if the part/rev combo was truly added, has_part(pn, rev) should return True
         self.assertTrue(my_list.has_part("123-456789-01", "A"))
 
+        # point-in-time queries are answered by the part, and None for a part the list doesn't have
+        my_list.add_part("123-456789-01", "C", "12000")
+        self.assertEqual(my_list.rev_before("123-456789-01", "C").name, "A")
+        self.assertEqual(my_list.rev_before("123-456789-01", "A"), None)
+        self.assertEqual(my_list.rev_before("999-999999-99", "A"), None)
+        self.assertEqual(my_list.latest_rev_as_of("123-456789-01", "12345").name, "C")
+        self.assertEqual(my_list.latest_rev_as_of("123-456789-01", "11999"), None)
+        self.assertEqual(my_list.latest_rev_as_of("999-999999-99", "12345"), None)
+
+    def test_eco_index(self):
+        my_list = ListOfParts()
+
+        my_list.add_part("987-654321-01", "B", 12345)
+        my_list.add_part("040-108900-00", "C1", "12345")
+        my_list.add_part("040-108900-00", "A", "12345")
+        my_list.add_part("987-654321-01", "A", "10000")
+        my_list.add_part("123-123123-11", "Y")
+
+        self.assertEqual(my_list.parts_for_eco("12345"),
+                         [("040-108900-00", "A"), ("040-108900-00", "C1"), ("987-654321-01", "B")])
+        self.assertEqual(my_list.parts_for_eco(10000), [("987-654321-01", "A")])
+        self.assertEqual(my_list.parts_for_eco("99999"), [])
+
+        # a CI added again keeps the ECO it was first added with
+        self.assertFalse(my_list.add_part("987-654321-01", "A", "99999"))
+        self.assertEqual(my_list.parts_for_eco("99999"), [])
+
     def test_next_rev(self):
         my_list = ListOfParts()
 
@@ -123,6 +205,184 @@ class CidClassesTest(unittest.TestCase):
         # when a part isn't in the ListOfParts object, return "-" as the "next part
         self.assertEqual(my_list.next_rev("001-100100-00").name, "-")
 
+    def test_diagnostic_log(self):
+        my_log = DiagnosticLog(echo=False)
+        self.assertFalse(my_log.has_errors())
+
+        my_log.warning("iso-name-length", "WARNING: long ISO name", row=10, cell="H10", args={"length": 19})
+        self.assertFalse(my_log.has_errors())
+
+        my_log.error("bad-pn", "ERROR: bad part number", row=12)
+        self.assertTrue(my_log.has_errors())
+
+        self.assertEqual([record.code for record in my_log.records], ["iso-name-length", "bad-pn"])
+        self.assertEqual(my_log.records[0].as_dict()["args"], {"length": 19})
+        self.assertEqual(my_log.records[1].as_dict()["cell"], None)
+
+        my_log.warning("iso-name-length", "WARNING: long ISO name", row=11)
+        self.assertEqual([record.row for record in my_log.query(code="iso-name-length")], [10, 11])
+        self.assertEqual(my_log.query(severity="ERROR", row=12), [my_log.records[1]])
+        self.assertEqual(my_log.counts(), {("WARNING", "iso-name-length"): 2, ("ERROR", "bad-pn"): 1})
+
+    def test_buffered_diagnostic_log(self):
+        saved_stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            my_log = DiagnosticLog(buffered=True)
+
+            # nothing is printed until the log is flushed
+            my_log.warning("iso-name-length", "WARNING: long ISO name", row=10)
+            my_log.info("pnr-missing-released", "INFO: released part not in PNR Log", row=8, echo=False)
+            self.assertEqual([record.row for record in my_log.pending], [10])
+            self.assertEqual(sys.stdout.getvalue(), "")
+
+            my_log.flush()
+            self.assertEqual(my_log.pending, [])
+            self.assertEqual(len(my_log.records), 2)
+            self.assertEqual(sys.stdout.getvalue(), "WARNING: long ISO name\n")
+
+            # messages print in row order; past REPEAT_LIMIT, repeated warnings are counted, but errors never are
+            sys.stdout = StringIO.StringIO()
+            for row in [16, 14, 12, 18, 15, 13]:
+                my_log.warning("iso-name-length", "WARNING: long ISO name on row {}".format(row), row=row)
+            for row in [17, 11, 19, 20, 21]:
+                my_log.error("bad-pn", "ERROR: bad part number on row {}".format(row), row=row)
+            my_log.error("no-media", "ERROR: no media type")
+            my_log.flush()
+
+            self.assertEqual(sys.stdout.getvalue().splitlines(), [
+                "ERROR: bad part number on row 11",
+                "WARNING: long ISO name on row 12",
+                "WARNING: long ISO name on row 13",
+                "WARNING: long ISO name on row 14",
+                "ERROR: bad part number on row 17",
+                "ERROR: bad part number on row 19",
+                "ERROR: bad part number on row 20",
+                "ERROR: bad part number on row 21",
+                "ERROR: no media type",
+                "WARNING: 3 more 'iso-name-length' messages like the above, on CI_Sheet rows 15, 16, 18."])
+        finally:
+            sys.stdout = saved_stdout
+
+    def test_row_validation_cache(self):
+        my_cache = RowValidationCache()
+
+        my_cache.start_pass("context-1")
+        self.assertEqual(my_cache.lookup("row-5"), None)
+        my_cache.store("row-5", "result-5")
+        my_cache.store("row-6", "result-6")
+        my_cache.end_pass()
+
+        # same context: earlier results are replayed
+        my_cache.start_pass("context-1")
+        self.assertEqual(my_cache.lookup("row-5"), "result-5")
+        self.assertEqual((my_cache.hits, my_cache.misses), (1, 0))
+        my_cache.end_pass()
+
+        # results not used by the latest pass are dropped
+        my_cache.start_pass("context-1")
+        self.assertEqual(my_cache.lookup("row-6"), None)
+        self.assertEqual(my_cache.lookup("row-5"), "result-5")
+        my_cache.end_pass()
+
+        # ...unless the pass only covered part of the sheet
+        my_cache.start_pass("context-1")
+        my_cache.store("row-7", "result-7")
+        my_cache.end_pass(prune=False)
+        my_cache.start_pass("context-1")
+        self.assertEqual(my_cache.lookup("row-5"), "result-5")
+        self.assertEqual(my_cache.lookup("row-7"), "result-7")
+
+        # a new context discards everything
+        my_cache.start_pass("context-2")
+        self.assertEqual(my_cache.lookup("row-5"), None)
+
+        # keys built from str and unicode text are the same key
+        my_cache.store(("065-000003-00", 1), "result-8")
+        my_cache.end_pass()
+        my_cache.start_pass(u"context-2")
+        self.assertEqual(my_cache.lookup((u"065-000003-00", 1)), "result-8")
+
+    def test_row_result_moved_to(self):
+        record = Diagnostic("WARNING", "dup-not-marked", "WARNING: CI_Sheet row 9 has duplicate P/N 065-000003-00 "
+                            "Rev. C9\n         which is not marked \"dup.\" Last used on row 7.",
+                            row=9, cell="E9", args={"ci": "065-000003-00 Rev. C9", "last_row": "7"})
+        record.echo = False
+        my_result = RowResult([{"pn": "065-000003-00", "rev": "C9", "rev_cell": "B9", "row": 9}], [record],
+                              ["WARNING: CI_Sheet row 9 - Add part 065-000003-00 Rev. 'C9'"],
+                              ("CD1", False, "9", False, None), row=9, used_row=7)
+
+        # rows inserted above move the row and the row it was last used on alike; revs and P/Ns are left alone
+        moved = my_result.moved_to(12)
+        self.assertEqual(moved.ci_records, [{"pn": "065-000003-00", "rev": "C9", "rev_cell": "B12", "row": 12}])
+        self.assertEqual(moved.diagnostics[0].message, "WARNING: CI_Sheet row 12 has duplicate P/N 065-000003-00 "
+                         "Rev. C9\n         which is not marked \"dup.\" Last used on row 10.")
+        self.assertEqual((moved.diagnostics[0].row, moved.diagnostics[0].cell), (12, "E12"))
+        self.assertEqual(moved.diagnostics[0].args, {"ci": "065-000003-00 Rev. C9", "last_row": "10"})
+        self.assertEqual(moved.diagnostics[0].echo, False)
+        self.assertEqual(moved.pnr_warnings, ["WARNING: CI_Sheet row 12 - Add part 065-000003-00 Rev. 'C9'"])
+        self.assertEqual(moved.state, ("CD1", False, "12", False, None))
+        self.assertIs(my_result.moved_to(9), my_result)
+
+        # results survive a round trip through JSON
+        restored = RowResult.from_dict(json.loads(json.dumps(my_result.as_dict())))
+        self.assertEqual(restored.as_dict(), my_result.as_dict())
+        self.assertEqual(restored.state, ("CD1", False, "9", False, None))
+
+    def test_ci_tree(self):
+        def ci(pn, indent, media_set="139-000001-00-B", status="released"):
+            return {"pn": pn, "rev": "A", "description": pn, "indent": indent, "media_set": media_set,
+                    "media_type": "CD1", "status": status}
+
+        my_tree = CITree([ci("139-000001-00", 0),
+                          ci("065-000002-00", 1, status="new"),
+                          ci("065-000003-00", 2),
+                          ci("065-000004-00", 1),
+                          ci("139-000005-00", 0),
+                          ci("065-000006-00", 1, media_set="139-000007-00-A", status="new")])
+
+        top, child, grandchild, second_child, second_top, other_set = my_tree.nodes
+
+        self.assertEqual(my_tree.roots, [top, second_top, other_set])
+        self.assertEqual(top.children, [child, second_child])
+        self.assertTrue(grandchild.parent is child)
+        self.assertTrue(grandchild.root is top)
+        self.assertEqual(my_tree.subtree(child), [child, grandchild])
+        self.assertEqual(top.descendant_count, 3)
+        self.assertTrue(my_tree.is_ancestor(top, grandchild))
+        self.assertFalse(my_tree.is_ancestor(second_top, grandchild))
+
+        # an indented CI at the start of a media set isn't nested under the previous set's assembly
+        self.assertEqual(other_set.parent, None)
+
+        self.assertEqual(my_tree.assembly_counts()["139-000001-00 Rev. A"], 3)
+        self.assertEqual(my_tree.filter(lambda node: node.record["status"] == "new"), [child, other_set])
+        self.assertEqual(my_tree.find("065-000003-00"), [grandchild])
+
+        self.assertEqual(my_tree.render_table(my_tree.nodes[:5]),
+                         [["CD1:139-000001-00-B", ""],
+                          ["139-000001-00 Rev. A", "139-000001-00"],
+                          ["  065-000002-00 Rev. A", "065-000002-00"],
+                          ["    065-000003-00 Rev. A", "065-000003-00"],
+                          ["  065-000004-00 Rev. A", "065-000004-00"],
+                          ["\n139-000005-00 Rev. A", "139-000005-00"]])
+
+    def test_form_layout(self):
+        class Cell(object):
+            def __init__(self, value):
+                self.value = value
+
+        self.assertEqual(column_index("A"), 0)
+        self.assertEqual(column_index("H"), 7)
+        self.assertEqual(column_index("AA"), 26)
+
+        my_layout = FormLayout("wide", ad_col='A', cr_col='B', nr_col='C', eco_col='E', des_col='F', mt_col='G',
+                               iso_col='H')
+        self.assertEqual(my_layout.indices, [0, 1, 2, 4, 5, 6, 7])
+        self.assertEqual(my_layout.width, 8)
+        self.assertEqual(my_layout.row_values([Cell("139-000001-00"), Cell("A")]),
+                         ["139-000001-00", "A", None, None, None, None, None, None])
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,73 @@
+import unittest
+
+from cid_classes import *
+import cid_diff
+
+
+class CidDiffTest(unittest.TestCase):
+
+    def test_diff_records(self):
+        old_records = [("139-000001-00", "A", "10000", ("CD1",)),
+                       ("065-000002-00", "C", "11111", ("CD1",)),
+                       ("065-000003-00", "A", "12345", ("CD1",)),
+                       ("065-000004-00", "B", "12345", ("CD1",)),
+                       ("065-000005-00", "D", "12345", ("CD1",))]
+        new_records = [("139-000001-00", "A", "10000", ("CD1",)),
+                       ("065-000003-00", "A", "12345", ("CD1", "CD2")),
+                       ("065-000004-00", "B", "12346", ("CD1",)),
+                       ("065-000005-00", "E", "12345", ("CD2",)),
+                       ("065-000006-00", "-", "12345", ())]
+
+        self.assertEqual(cid_diff.diff_records(old_records, new_records), [
+            (cid_diff.REMOVED, "065-000002-00", "C", None, ("CD1",), None),
+            (cid_diff.MOVED, "065-000003-00", "A", "A", ("CD1",), ("CD1", "CD2")),
+            (cid_diff.ECO_CHANGED, "065-000004-00", "B", "B", "12345", "12346"),
+            (cid_diff.REVISED, "065-000005-00", "D", "E", None, None),
+            (cid_diff.MOVED, "065-000005-00", "D", "E", ("CD1",), ("CD2",)),
+            (cid_diff.ADDED, "065-000006-00", None, "-", None, ())])
+
+        # nothing changed, nothing reported
+        self.assertEqual(cid_diff.diff_records(old_records, list(reversed(old_records))), [])
+
+    def test_revised_pairs(self):
+        # several revs re-revved at once pair up by media set, not as separate adds and removes
+        old_records = [("065-000002-00", "A", "12345", ("CD1",)),
+                       ("065-000002-00", "B", "12345", ("CD2",)),
+                       ("065-000002-00", "C", "12345", ("DVD",))]
+        new_records = [("065-000002-00", "D", "12345", ("CD2",)),
+                       ("065-000002-00", "E", "12345", ("DVD",)),
+                       ("065-000002-00", "F", "12345", ("CD1",))]
+
+        self.assertEqual(cid_diff.diff_part("065-000002-00", old_records, new_records), [
+            (cid_diff.REVISED, "065-000002-00", "A", "F", None, None),
+            (cid_diff.REVISED, "065-000002-00", "B", "D", None, None),
+            (cid_diff.REVISED, "065-000002-00", "C", "E", None, None)])
+
+        # without a shared media set, revs pair latest first and the earliest are left over
+        old_records = [("065-000002-00", "A", "12345", ()),
+                       ("065-000002-00", "B", "12345", ()),
+                       ("065-000002-00", "C", "12345", ())]
+        new_records = [("065-000002-00", "D", "12345", ()),
+                       ("065-000002-00", "E", "12345", ())]
+
+        self.assertEqual(cid_diff.diff_part("065-000002-00", old_records, new_records), [
+            (cid_diff.REVISED, "065-000002-00", "B", "D", None, None),
+            (cid_diff.REVISED, "065-000002-00", "C", "E", None, None),
+            (cid_diff.REMOVED, "065-000002-00", "A", None, (), None)])
+
+    def test_format_change(self):
+        self.assertEqual(cid_diff.format_change((cid_diff.ADDED, "065-000006-00", None, "-", None, ("CD1",))),
+                         "ADDED    065-000006-00 Rev. - [CD1]")
+        self.assertEqual(cid_diff.format_change((cid_diff.REMOVED, "065-000002-00", "C", None, (), None)),
+                         "REMOVED  065-000002-00 Rev. C")
+        self.assertEqual(cid_diff.format_change((cid_diff.REVISED, "065-000005-00", "E", "D", None, None)),
+                         "REVISED  065-000005-00 Rev. E -> Rev. D  (new rev is earlier than old rev)")
+        self.assertEqual(cid_diff.format_change((cid_diff.MOVED, "065-000003-00", "A", "A", ("CD1",), ())),
+                         "MOVED    065-000003-00 Rev. A [CD1] -> [no media]")
+        self.assertEqual(cid_diff.format_change((cid_diff.ECO_CHANGED, "065-000004-00", "B", "B", "12345",
+                                                 "12346")),
+                         "ECO      065-000004-00 Rev. B 12345 -> 12346")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import csv
+import StringIO
+import sys
+import unittest
+
+from cid_classes import *
+import cid_suggest
+
+
+def make_record(row, pn, prev_rev, rev, eco="12345"):
+    return {"pn": pn, "rev": rev, "rev_cell": "C{}".format(row), "prev_rev": prev_rev, "row": row,
+            "status": "new", "eco": eco}
+
+
+class CountingParts(ListOfParts):
+    """
+    A ListOfParts that counts next_rev() lookups.
+    """
+    next_rev_calls = 0
+
+    def next_rev(self, pn):
+        self.next_rev_calls += 1
+        return ListOfParts.next_rev(self, pn)
+
+
+class CidSuggestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pnr_list = CountingParts()
+        self.pnr_list.add_part("065-000002-00", "C", "11111")
+        self.pnr_list.add_part("065-000003-00", "A", "11111")
+        self.pnr_list.add_part("065-000003-00", "B", "11111")
+        self.pnr_list.add_part("065-000003-00", "C", "12000")
+        self.pnr_list.add_part("065-000004-00", "A", "11111")
+        self.pnr_list.add_part("065-000004-00", "B", "12345")
+
+    def test_expected_rev(self):
+        # the rev after Cur Rev, when the log has nothing later
+        self.assertEqual(cid_suggest.expected_rev("065-000002-00", "C", "E", "12345", self.pnr_list),
+                         ("D", "cur rev"))
+
+        # the rev after the log's max rev, when the part was re-revved on another ECO since
+        self.assertEqual(cid_suggest.expected_rev("065-000003-00", "A", "B", "12345", self.pnr_list),
+                         ("D", "PNR Log max rev"))
+
+        # a rev the log already reserved for this ECO is accepted, even though it isn't after the log's max rev
+        self.assertEqual(cid_suggest.expected_rev("065-000004-00", "A", "B", "12345", self.pnr_list),
+                         ("B", "reserved in PNR Log"))
+        self.assertEqual(cid_suggest.expected_rev("065-000004-00", "A", "B", "99999", self.pnr_list),
+                         ("C", "PNR Log max rev"))
+
+        # without the log, only Cur Rev counts
+        self.assertEqual(cid_suggest.expected_rev("065-000003-00", "A", "C", "12345"), ("B", "cur rev"))
+
+    def test_suggest_revs(self):
+        ci_records = [make_record(9, "065-000003-00", "A", "B"),
+                      make_record(5, "065-000002-00", "C", "D"),
+                      make_record(7, "065-000003-00", "A", "B"),
+                      make_record(6, "065-000004-00", "A", "B"),
+                      {"pn": "139-000001-00", "rev": "A", "rev_cell": "B8", "prev_rev": None, "row": 8,
+                       "status": "released", "eco": "10000"}]
+
+        # only cells that should change are listed, in row order, and the dup row gets its own line for its cell
+        suggestions = cid_suggest.suggest_revs(ci_records, self.pnr_list)
+        self.assertEqual([(suggestion["row"], suggestion["cell"]) for suggestion in suggestions],
+                         [(7, "C7"), (9, "C9")])
+        self.assertEqual(self.pnr_list.next_rev_calls, 2)
+        self.assertEqual(suggestions[0], {"row": 7, "cell": "C7", "pn": "065-000003-00", "cur_rev": "A",
+                                          "new_rev": "B", "expected_rev": "D", "basis": "PNR Log max rev"})
+
+        saved_stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            file_name, text = cid_suggest.render_suggestions(suggestions)
+        finally:
+            sys.stdout = saved_stdout
+
+        self.assertEqual(file_name, cid_suggest.SUGGESTIONS_FILE)
+        rows = list(csv.reader(StringIO.StringIO(text)))
+        self.assertEqual(rows[0], ["row", "cell", "pn", "cur_rev", "new_rev", "expected_rev", "basis"])
+        self.assertEqual(rows[1:], [["7", "C7", "065-000003-00", "A", "B", "D", "PNR Log max rev"],
+                                    ["9", "C9", "065-000003-00", "A", "B", "D", "PNR Log max rev"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+import unittest
+
+from cid_classes import *
+import pnr_backends
+
+
+def make_log():
+    pnr_list = ListOfParts()
+    pnr_list.add_part("139-000001-00", "A", "ECO-1")
+    pnr_list.add_part("139-000001-00", "B", "ECO-2")
+    pnr_list.add_part("139-000002-00", "A", "ECO-2")
+    for index in range(10, 30):
+        pnr_list.add_part("139-0000{}-00".format(index), "A", "ECO-3")
+
+    return pnr_list
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A stand-in for the PNR web service, answering from a ListOfParts and counting requests and connections.
+    """
+    daemon_threads = True
+
+    def __init__(self, pnr_list):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), StandInHandler)
+        self.pnr_list = pnr_list
+        self.requests = []
+        self.connections = 0
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def answer(self, document):
+        body = json.dumps(document)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path))
+        pnr_list = self.server.pnr_list
+
+        if self.path == "/api/version":
+            self.answer({"version": "v1"})
+        elif self.path == "/api/warnings":
+            self.answer({"warnings": ["WARNING: a warning"], "dupes": []})
+        elif self.path == "/api/cis":
+            self.answer({"cis": [list(ci) for ci in pnr_list.iter_cis()]})
+        elif self.path.startswith("/api/eco/"):
+            self.answer({"cis": [list(ci) for ci in pnr_list.parts_for_eco(self.path[len("/api/eco/"):])]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        self.server.requests.append(("POST", self.path))
+        pnr_list = self.server.pnr_list
+        document = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+        if self.path == "/api/lookup":
+            self.answer({"cis": [[pn, rev, pnr_list.eco(pn, rev)] for pn, rev in document["cis"]]})
+        elif self.path == "/api/next_revs":
+            next_revs = {}
+            for pn in document["pns"]:
+                next_rev = pnr_list.next_rev(pn)
+                next_revs[pn] = next_rev.name if next_rev is not None else None
+            self.answer({"next_revs": next_revs})
+        else:
+            self.send_error(404)
+
+
+class PNRBackendsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(make_log())
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}/api".format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_http_backend(self):
+        backend = pnr_backends.HTTPBackend(self.url, batch_size=8)
+        pnr_list, pnr_warnings, pnr_dupe_pn_list = backend.load()
+        self.assertEqual(pnr_list.fingerprint, "v1")
+        self.assertEqual(pnr_warnings, ["WARNING: a warning"])
+
+        cis = [("139-0000{}-00".format(index), "A") for index in range(10, 30)] + [("139-000001-00", "C")]
+        pnr_list.prefetch(cis)
+
+        # 21 CIs and 21 P/Ns, 8 to a request, over one persistent connection
+        posts = [path for method, path in self.server.requests if method == "POST"]
+        self.assertEqual(posts.count("/api/lookup"), 3)
+        self.assertEqual(posts.count("/api/next_revs"), 3)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(backend.client.pool.connections_made, 1)
+
+        # prefetched lookups are answered without asking the service again
+        request_count = len(self.server.requests)
+        self.assertEqual(pnr_list.eco("139-000010-00", "A"), "ECO-3")
+        self.assertFalse(pnr_list.has_part("139-000001-00", "C"))
+        self.assertEqual(pnr_list.next_rev("139-000001-00").name, "C")
+        self.assertEqual(pnr_list.lookup([("139-000011-00", "A")]), {("139-000011-00", "A"): "ECO-3"})
+
+        # the service can't list a part's revs, so the rev before another is never known
+        self.assertEqual(pnr_list.rev_before("139-000001-00", "B"), None)
+        self.assertEqual(len(self.server.requests), request_count)
+
+        # anything else is fetched when it's first asked for
+        self.assertEqual(pnr_list.eco("139-000002-00", "A"), "ECO-2")
+        self.assertEqual(pnr_list.next_rev("139-000099-00").name, "-")
+        self.assertEqual(pnr_list.next_rev("bogus"), None)
+        self.assertEqual(len(self.server.requests), request_count + 2)
+
+        self.assertEqual(pnr_list.parts_for_eco("ECO-2"), [("139-000001-00", "B"), ("139-000002-00", "A")])
+        self.assertEqual(len(list(pnr_list.iter_cis())), 23)
+        self.assertEqual(self.server.connections, 1)
+
+        backend.client.close()
+
+    def test_http_backend_errors(self):
+        client = pnr_backends.PNRClient(self.url + "/missing")
+        with self.assertRaises(pnr_backends.PNRServiceError):
+            client.version()
+
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaises(pnr_backends.PNRServiceError):
+            pnr_backends.PNRClient(self.url, timeout=1).version()
+
+    def test_local_lookup(self):
+        pnr_list = make_log()
+        pnr_list.prefetch([("139-000001-00", "A")])
+        self.assertEqual(pnr_list.lookup([("139-000001-00", "A"), ("139-000001-00", "C")]),
+                         {("139-000001-00", "A"): "ECO-1", ("139-000001-00", "C"): None})
+
+    def test_open_backend(self):
+        self.assertIsInstance(pnr_backends.open_backend({"pnr_url": self.url, "pnr_snapshot": None}),
+                              pnr_backends.HTTPBackend)
+        self.assertIsInstance(pnr_backends.open_backend({"pnr_url": None, "pnr_snapshot": "log.snap"}),
+                              pnr_backends.SnapshotBackend)
+        self.assertIsInstance(pnr_backends.open_backend({"pnr_url": None, "pnr_snapshot": None}),
+                              pnr_backends.XlsxBackend)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from cid_classes import *
+import pnr_snapshot
+
+
+class PNRSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.snapshot_dir, "pnr.snap")
+
+        self.pnr_list = ListOfParts()
+        self.pnr_list.add_part("139-000001-00", "B", "12345")
+        self.pnr_list.add_part("139-000001-00", "A", "10000")
+        self.pnr_list.add_part("139-000001-00", "B1", "12345")
+        self.pnr_list.add_part("065-000002-00", "C", "11111")
+        self.pnr_list.add_part("145-000007-00", "-", "10000")
+        for index in range(10, 40):
+            self.pnr_list.add_part("065-0000{}-00".format(index), "A", "33333")
+
+        pnr_snapshot.write_snapshot(self.snapshot_path, self.pnr_list, ["WARNING: a warning"],
+                                    ["065-000002-00 Rev. C"], "fingerprint-1")
+
+    def tearDown(self):
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_round_trip(self):
+        snapshot = pnr_snapshot.PNRSnapshot(self.snapshot_path)
+        self.assertEqual(snapshot.fingerprint, "fingerprint-1")
+        self.assertEqual(snapshot.alphabet_name, STRICT_REV_ALPHABET.name)
+        self.assertEqual(snapshot.warnings, ["WARNING: a warning"])
+        self.assertEqual(snapshot.dupes, ["065-000002-00 Rev. C"])
+
+        # every CI in the log is found, with its ECO
+        self.assertEqual(sorted(snapshot.iter_cis()), sorted(self.pnr_list.iter_cis()))
+        for pn, rev, eco in self.pnr_list.iter_cis():
+            self.assertTrue(snapshot.has_part(pn, rev))
+            self.assertEqual(snapshot.eco(pn, rev), eco)
+            self.assertIsNotNone(snapshot._find(pn, rev))
+
+        # ...and nothing else is: a P/N that isn't in the log, one that sorts before or after every entry, a rev
+        # the part doesn't have and a rev no part has
+        self.assertEqual(snapshot._find("065-000099-00", "A"), None)
+        self.assertEqual(snapshot._find("000-000000-00", "A"), None)
+        self.assertEqual(snapshot._find("999-999999-99", "A"), None)
+        self.assertFalse(snapshot.has_part("139-000001-00", "C"))
+        self.assertFalse(snapshot.has_part("139-000001-00", "ZZ"))
+        self.assertEqual(snapshot.eco("065-000099-00", "A"), None)
+        self.assertEqual(snapshot._find("bogus", "A"), None)
+
+        # next rev follows the max rev in rev order, not insertion or text order
+        self.assertEqual(snapshot.next_rev("139-000001-00").name, "C")
+        self.assertEqual(snapshot.next_rev("145-000007-00").name, "A")
+        self.assertEqual(snapshot.next_rev("065-000099-00").name, "-")
+        self.assertEqual(snapshot.next_rev("bogus"), None)
+
+        # the rev before another follows rev order too, whether or not the part has the later rev
+        self.assertEqual(snapshot.rev_before("139-000001-00", "C").name, "B1")
+        self.assertEqual(snapshot.rev_before("139-000001-00", "B1").name, "B")
+        self.assertEqual(snapshot.rev_before("139-000001-00", "A"), None)
+        self.assertEqual(snapshot.rev_before("065-000099-00", "B"), None)
+        for pn in ["139-000001-00", "065-000002-00", "145-000007-00", "065-000010-00"]:
+            for rev in ["-", "A", "B", "B1", "C", "D", "AA"]:
+                self.assertEqual(getattr(snapshot.rev_before(pn, rev), "name", None),
+                                 getattr(self.pnr_list.rev_before(pn, rev), "name", None))
+
+        self.assertEqual(snapshot.parts_for_eco("12345"), [("139-000001-00", "B"), ("139-000001-00", "B1")])
+        self.assertEqual(snapshot.parts_for_eco("99999"), [])
+
+        snapshot.close()
+
+    def test_file_mode(self):
+        # the snapshot gets the permissions of any other new file, not mkstemp()'s 0600
+        umask = os.umask(0o022)
+        try:
+            pnr_snapshot.write_snapshot(self.snapshot_path, self.pnr_list, [], [], "fingerprint-2")
+        finally:
+            os.umask(umask)
+
+        self.assertEqual(stat.S_IMODE(os.stat(self.snapshot_path).st_mode), 0o644)
+        self.assertEqual([name for name in os.listdir(self.snapshot_dir)], ["pnr.snap"])
+
+
+if __name__ == "__main__":
+    unittest.main()
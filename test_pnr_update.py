@@ -0,0 +1,185 @@
+import os
+import shutil
+import stat
+import StringIO
+import sys
+import tempfile
+import unittest
+import zipfile
+
+from cid_classes import *
+import cid_cache
+import pnr
+import pnr_snapshot
+import pnr_update
+
+WORKBOOK_XML = '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" ' \
+               'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>' \
+               '<sheet name="Notes" sheetId="1" r:id="rId1"/><sheet name="PN_Rev" sheetId="2" r:id="rId2"/>' \
+               '</sheets></workbook>'
+
+RELS_XML = '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">' \
+           '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/>' \
+           '<Relationship Id="rId2" Target="/xl/worksheets/sheet2.xml"/></Relationships>'
+
+SHEET_XML = '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">' \
+            '<dimension ref="A1:D3"/><sheetData>' \
+            '<row r="1"><c r="A1" t="inlineStr"><is><t>P/N</t></is></c></row>' \
+            '<row r="3"><c r="A3" t="inlineStr"><is><t>139-000001-00</t></is></c></row>' \
+            '</sheetData></worksheet>'
+
+EMPTY_SHEET_XML = '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData/>' \
+                  '</worksheet>'
+
+
+def make_workbook(path, sheet_xml=SHEET_XML):
+    """
+    Write a small xlsm: a workbook with a Notes sheet and a PN_Rev sheet, plus a stored (uncompressed) macro part.
+    """
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", "<Types/>")
+        archive.writestr("xl/workbook.xml", WORKBOOK_XML)
+        archive.writestr("xl/_rels/workbook.xml.rels", RELS_XML)
+        archive.writestr("xl/worksheets/sheet1.xml", EMPTY_SHEET_XML)
+        archive.writestr("xl/worksheets/sheet2.xml", sheet_xml)
+        archive.writestr(zipfile.ZipInfo("xl/vbaProject.bin"), "\x00\x01macros" * 100)
+
+
+def raw_members(path):
+    """
+    :return: dict of each member's (CRC, compressed size, compression type, data), keyed by name
+    """
+    with zipfile.ZipFile(path) as archive:
+        return dict((member.filename, (member.CRC, member.compress_size, member.compress_type,
+                                       archive.read(member)))
+                    for member in archive.infolist())
+
+
+class PNRUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pnr_dir = tempfile.mkdtemp()
+        self.pnr_path = os.path.join(self.pnr_dir, "log.xlsm")
+        make_workbook(self.pnr_path)
+
+        self.saved_pnrl_path = pnr.PNRL_PATH
+        pnr.PNRL_PATH = self.pnr_path
+
+        self.saved_stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.saved_stdout
+        pnr.PNRL_PATH = self.saved_pnrl_path
+        shutil.rmtree(self.pnr_dir)
+
+    def test_find_sheet_part(self):
+        with zipfile.ZipFile(self.pnr_path) as archive:
+            self.assertEqual(pnr_update.find_sheet_part(archive), "xl/worksheets/sheet2.xml")
+            self.assertEqual(pnr_update.find_sheet_part(archive, "Notes"), "xl/worksheets/sheet1.xml")
+            self.assertEqual(pnr_update.find_sheet_part(archive, "Missing"), None)
+
+    def test_append_rows(self):
+        patched, row_numbers = pnr_update.append_rows(SHEET_XML, [("065-000002-00", "A", "12345"),
+                                                                  ("065-000003-00", "B1", "R&D")])
+
+        # the new rows follow the last row in use, and the used range grows to cover them
+        self.assertEqual(row_numbers, [4, 5])
+        self.assertTrue(patched.endswith(
+            '<row r="3"><c r="A3" t="inlineStr"><is><t>139-000001-00</t></is></c></row>'
+            '<row r="4"><c r="A4" t="inlineStr"><is><t>065-000002-00</t></is></c>'
+            '<c r="C4" t="inlineStr"><is><t>A</t></is></c><c r="D4"><v>12345</v></c></row>'
+            '<row r="5"><c r="A5" t="inlineStr"><is><t>065-000003-00</t></is></c>'
+            '<c r="C5" t="inlineStr"><is><t>B1</t></is></c><c r="D5" t="inlineStr"><is><t>R&amp;D</t></is></c>'
+            '</row></sheetData></worksheet>'))
+        self.assertIn('<dimension ref="A1:D5"/>', patched)
+
+        # a sheet without any rows has an empty <sheetData/>
+        patched, row_numbers = pnr_update.append_rows(EMPTY_SHEET_XML, [("065-000002-00", "A", "12345")])
+        self.assertEqual(row_numbers, [1])
+        self.assertIn('<sheetData><row r="1"><c r="A1" t="inlineStr">', patched)
+        self.assertTrue(patched.endswith('</row></sheetData></worksheet>'))
+
+        with self.assertRaises(ValueError):
+            pnr_update.append_rows("<worksheet/>", [("065-000002-00", "A", "12345")])
+
+    def test_write_rows(self):
+        os.chmod(self.pnr_path, 0o640)
+        before = raw_members(self.pnr_path)
+
+        self.assertEqual(pnr_update.write_rows(self.pnr_path, [("065-000002-00", "A", "12345")]), [4])
+
+        # every member but the PN_Rev sheet is copied byte for byte, still compressed as it was
+        after = raw_members(self.pnr_path)
+        self.assertEqual(sorted(after), sorted(before))
+        for name in before:
+            if name != "xl/worksheets/sheet2.xml":
+                self.assertEqual(after[name], before[name])
+        self.assertIn("065-000002-00", after["xl/worksheets/sheet2.xml"][3])
+        with zipfile.ZipFile(self.pnr_path) as archive:
+            self.assertEqual(archive.testzip(), None)
+
+        # the log keeps its permissions, and no temp file is left behind
+        self.assertEqual(stat.S_IMODE(os.stat(self.pnr_path).st_mode), 0o640)
+        self.assertEqual(os.listdir(self.pnr_dir), ["log.xlsm"])
+
+    def test_new_cis(self):
+        pnr_list = ListOfParts()
+        pnr_list.add_part("139-000001-00", "A", "12345")
+
+        ci_records = [{"pn": "139-000001-00", "rev": "A", "status": "new", "eco": "12345"},
+                      {"pn": "065-000002-00", "rev": "B", "status": "new", "eco": "12345"},
+                      {"pn": "065-000002-00", "rev": "B", "status": "new", "eco": "12345"},
+                      {"pn": "065-000003-00", "rev": "C", "status": "released", "eco": "11111"}]
+        self.assertEqual(pnr_update.new_cis(ci_records, pnr_list), [("065-000002-00", "B", "12345")])
+
+    def test_update_pnr(self):
+        pnr_list = ListOfParts()
+        fingerprint = cid_cache.pnr_fingerprint(self.pnr_path)
+        before = raw_members(self.pnr_path)
+
+        # refused when the log changed after it was read, or when the ECO form has no ECO number
+        with self.assertRaises(SystemExit):
+            pnr_update.update_pnr([("065-000002-00", "A", "12345")], pnr_list, "0:0")
+        with self.assertRaises(SystemExit):
+            pnr_update.update_pnr([("065-000002-00", "A", "None")], pnr_list, fingerprint)
+        self.assertIn("PNR ERROR: PN Reserve Log changed after it was read", sys.stdout.getvalue())
+        self.assertIn("PNR ERROR: ECO form's ECO number (CoverSheet cell S2) is 'None'", sys.stdout.getvalue())
+        self.assertEqual(raw_members(self.pnr_path), before)
+        self.assertFalse(os.path.exists(self.pnr_path + pnr_update.LOCK_SUFFIX))
+
+        pnr_list = pnr_update.update_pnr([("065-000002-00", "A", "12345")], pnr_list, fingerprint)
+        self.assertEqual(pnr_list.eco("065-000002-00", "A"), "12345")
+        self.assertIn("Row 4: 065-000002-00 Rev. A, ECO 12345", sys.stdout.getvalue())
+        self.assertFalse(os.path.exists(self.pnr_path + pnr_update.LOCK_SUFFIX))
+
+    def test_update_pnr_snapshot(self):
+        snapshot_path = os.path.join(self.pnr_dir, "log.snap")
+        pnr_list = ListOfParts()
+        pnr_list.add_part("139-000001-00", "A", "10000")
+        pnr_snapshot.write_snapshot(snapshot_path, pnr_list, [], [], "stale")
+
+        # the snapshot is closed before it's rewritten (on Windows a mapped file can't be replaced), and then lists
+        # the new CIs under the log's new fingerprint
+        snapshot = pnr_snapshot.PNRSnapshot(snapshot_path)
+        pnr_list = pnr_update.update_pnr([("065-000002-00", "A", "12345")], snapshot,
+                                         cid_cache.pnr_fingerprint(self.pnr_path), snapshot_path=snapshot_path)
+        with self.assertRaises(ValueError):
+            snapshot._map[0]
+
+        snapshot = pnr_snapshot.PNRSnapshot(snapshot_path)
+        self.assertEqual(snapshot.fingerprint, cid_cache.pnr_fingerprint(self.pnr_path))
+        self.assertEqual(snapshot.eco("065-000002-00", "A"), "12345")
+        self.assertEqual(snapshot.eco("139-000001-00", "A"), "10000")
+        snapshot.close()
+
+        # a snapshot that can't be written is only a warning: the log itself was updated
+        missing_path = os.path.join(self.pnr_dir, "missing", "log.snap")
+        pnr_list = pnr_update.update_pnr([("065-000003-00", "A", "12345")], pnr_list,
+                                         cid_cache.pnr_fingerprint(self.pnr_path), snapshot_path=missing_path)
+        self.assertEqual(pnr_list.eco("065-000003-00", "A"), "12345")
+        self.assertIn("PNR WARNING: Could not update PNR snapshot " + missing_path, sys.stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()